@@ -0,0 +1,287 @@
+"""
+Benchmarks of the hot paths of the driving simulator.
+
+Each benchmark reports its latency per call and its throughput in steps per second
+(the unit of a step depends on the benchmark: a physics step, a network activation,
+an agent...). The results can be saved as a JSON baseline, and compared to a saved
+baseline to flag the regressions. The benchmarks use fixed seeds and the bundled maps
+only, so that they run offline.
+
+Usage:
+    python benchmark.py                       # run and compare to the baseline, if any
+    python benchmark.py --save                # run and save the results as the new baseline
+    python benchmark.py --only player         # only run the player benchmarks (grid, player, networks, simulation, generations)
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import warnings
+import contextlib
+import numpy as np
+import neat
+
+# The simulator uses paths relative to its folder
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from brain.neat import NeatAlgorithm
+from brain.compiled_network import PopulationNetwork
+from brain.evaluator import Evaluator
+from brain.archive import GenomeArchive
+from brain.manifest import RunManifest
+from game.game import Game
+from game.grid import Grid
+from game.maps import MapRegistry
+from game.player import Player
+from game.termination import TerminationPolicy
+
+# Benchmark configuration
+BASELINE_FILE = 'benchmarks/baseline.json'
+CONFIG_FILE = 'brain/config.txt'
+MAP = 'maps/circuit_paillon/'
+SEED = 0
+TOLERANCE = 0.25        # Relative slowdown of the latency flagged as a regression
+MIN_TIME = 0.2          # Minimum duration of a timed batch of calls (s)
+REPEAT = 5              # Number of timed batches, the fastest one is kept
+GENOME_SIZES = [0, 8, 32] # Number of node and connection mutations of the benchmarked genomes
+
+# Simulation parameters of run_simulation and eval_genomes
+PLAYER_MAX_TIME = 20.0
+PLAYER_RAY_COUNT = 5
+DT = 0.01
+TERMINATION = TerminationPolicy(min_velocity=0.01, stall_time=2.0, progress_timeout=5.0, progress_cell=0.05)
+
+
+def measure(function, steps=1, min_time=MIN_TIME, repeat=REPEAT):
+    """
+    Time a function, called in batches lasting at least min_time
+
+    Args:
+        function: function to time, called without arguments
+        steps: number of steps done by a call of the function
+        min_time: minimum duration of a batch (s), 0 to time the calls one by one
+        repeat: number of timed batches
+
+    Returns:
+        dictionary with the latency of a call (s), the steps per second and the number of calls
+    """
+    # Find the number of calls of a batch (the first call is also a warm up)
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(np.ceil(min_time / elapsed)))
+
+    # Keep the fastest batch, the slower ones being disturbed by the rest of the system
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return {'latency': best, 'steps_per_sec': steps / best, 'calls': number * repeat}
+
+def seed():
+    """
+    Reset the random generators used by the simulator and by neat-python
+    """
+    random.seed(SEED)
+    np.random.seed(SEED)
+
+def make_genome(config, size):
+    """
+    Create a genome of a given size, the same for a given seed
+
+    Args:
+        config: NEAT configuration
+        size: number of node and connection mutations applied to the initial genome
+    """
+    seed()
+    genome = config.genome_type(0)
+    genome.configure_new(config.genome_config)
+    for _ in range(size):
+        genome.mutate_add_node(config.genome_config)
+        genome.mutate_add_connection(config.genome_config)
+    return genome
+
+class CountingNetwork:
+    """
+    Network counting its activations, used to count the steps of a simulation
+    """
+    def __init__(self, network):
+        self.network = network
+        self.count = 0
+
+    def activate(self, inputs):
+        self.count += 1
+        return self.network.activate(inputs)
+
+def bench_grid():
+    circuit_file = MAP + 'circuit.png'
+    Grid(250, circuit_file) # Make sure the cache exists
+    MapRegistry('maps/') # Make sure the caches of all the maps exist
+    return {
+        'grid_init': measure(lambda: Grid(250, circuit_file, cache=False)),
+        'grid_init_cached': measure(lambda: Grid(250, circuit_file)),
+        'map_registry_init': measure(lambda: MapRegistry('maps/'), min_time=0, repeat=3),
+    }
+
+def bench_player():
+    grid, player_pos, _ = main.load_map(MAP)
+    walls_grid, _, _ = main.load_map(MAP, wall_segments=True)
+    player = Player(player_pos)
+    game = Game(grid, player_pos, DT)
+    game.player.vel[0] = 0.1
+    walls_game = Game(walls_grid, player_pos, DT)
+    walls_game.player.vel[0] = 0.1
+    return {
+        'player_get_inputs': measure(lambda: player.get_inputs(grid, PLAYER_RAY_COUNT)),
+        'player_get_inputs_walls': measure(lambda: player.get_inputs(walls_grid, PLAYER_RAY_COUNT)),
+        'player_update': measure(lambda: player.update(1e-9, 0.0, 0.0)),
+        'game_update': measure(lambda: game.update(0.0, 0.0)),
+        'game_update_walls': measure(lambda: walls_game.update(0.0, 0.0)),
+    }
+
+def bench_networks():
+    results = {}
+    algorithm = NeatAlgorithm(CONFIG_FILE)
+    config = algorithm.config
+    seed()
+    inputs = np.random.rand(PLAYER_RAY_COUNT + 1).tolist()
+    batch = np.random.rand(50, PLAYER_RAY_COUNT + 1)
+    for size in GENOME_SIZES:
+        genome = make_genome(config, size)
+        network = neat.nn.FeedForwardNetwork.create(genome, config)
+        compiled = algorithm.compile_network(genome)
+        population = PopulationNetwork([compiled] * len(batch))
+        name = 'nodes{}'.format(len(genome.nodes))
+        results['ffn_activate_' + name] = measure(lambda: network.activate(inputs))
+        results['compiled_activate_' + name] = measure(lambda: compiled.activate(inputs))
+        results['population_activate_' + name] = measure(lambda: population.activate(batch), steps=len(batch))
+    return results
+
+def bench_simulation():
+    algorithm = NeatAlgorithm(CONFIG_FILE)
+    grid, player_pos, _ = main.load_map(MAP)
+    network = CountingNetwork(algorithm.create_network(make_genome(algorithm.config, GENOME_SIZES[1])))
+    args = (grid, player_pos, network, (PLAYER_MAX_TIME, PLAYER_RAY_COUNT, DT, TERMINATION, 1, 1))
+    main.run_simulation(args)
+    steps, network.count = network.count, 0
+    return {'run_simulation': measure(lambda: main.run_simulation(args), steps=steps, min_time=0, repeat=3)}
+
+def bench_generations():
+    """
+    Evaluate one generation of a new population on each map, with the evaluation settings of main.py
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as saving_folder:
+        # Settings read by eval_genomes
+        main.SAVING_FOLDER = saving_folder + '/'
+        main.PROB_CHANGE_MAP = 0.0
+        main.BENCHMARK_PAILLON = False
+        main.SAVE_BEST_GENOME_ONLY = False
+        main.BATCH_SIMULATION = True
+        main.COMPILED_NETWORKS = True
+        main.PROFILE_WORKERS = False
+        main.RECORD_TRAJECTORIES = 0
+        main.fitness_cache = None # The same genomes are evaluated at each call
+        main.population_stream = None
+        main.PLAYER_MAX_TIME = PLAYER_MAX_TIME
+        main.PLAYER_RAY_COUNT = PLAYER_RAY_COUNT
+        main.DT = DT
+        main.TERMINATION = TERMINATION
+        main.CONTROL_PERIOD = 1
+        main.PHYSICS_SUBSTEPS = 1
+        main.maps = MapRegistry('maps/')
+        main.evaluator = Evaluator()
+        main.archive = GenomeArchive(main.SAVING_FOLDER + 'genomes.archive', new=True)
+        main.manifest = RunManifest(main.SAVING_FOLDER + 'manifest.sqlite', new=True)
+        try:
+            for map_name in main.maps.names():
+                main.MAP_FOLDER = 'maps/' + map_name + '/'
+                main.grid, main.PLAYER_POS, main.map_name = main.maps.select(main.MAP_FOLDER)
+                seed()
+                main.neat = NeatAlgorithm(CONFIG_FILE)
+                genomes = list(main.neat.population.population.items())
+
+                def generation():
+                    seed()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        main.eval_genomes(genomes, main.neat.config)
+                results['eval_genomes_' + map_name] = measure(generation, steps=len(genomes), min_time=0, repeat=3)
+        finally:
+            main.evaluator.close()
+            main.archive.close()
+            main.manifest.close()
+    return results
+
+BENCHMARKS = [bench_grid, bench_player, bench_networks, bench_simulation, bench_generations]
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the results to a baseline
+
+    Args:
+        results: dictionary of the benchmark results
+        baseline: dictionary of the baseline results
+        tolerance: relative slowdown of the latency flagged as a regression
+
+    Returns:
+        list of the names of the regressed benchmarks
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['latency'] / baseline[name]['latency']
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+        print('{:40s} {:6.2f}x baseline{}'.format(name, ratio, '  REGRESSION' if ratio > 1 + tolerance else ''))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the driving simulator hot paths')
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='relative slowdown flagged as a regression (default: %(default)s)')
+    parser.add_argument('--only', nargs='+', default=[], help='groups of benchmarks to run (grid, player, networks, simulation, generations)')
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+    results = {}
+    for benchmark in BENCHMARKS:
+        if args.only and benchmark.__name__[len('bench_'):] not in args.only:
+            continue
+        for name, result in benchmark().items():
+            results[name] = result
+            print('{:40s} {:12.3f} ms/call {:14.1f} steps/s'.format(name, result['latency'] * 1e3, result['steps_per_sec']))
+
+    # Compare to the baseline
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        print('\nComparison to {} ({})'.format(args.baseline, baseline['machine']))
+        regressions = compare(results, baseline['results'], args.tolerance)
+
+    if args.save:
+        # Keep the baseline of the benchmarks not run this time
+        saved = baseline['results'] if os.path.exists(args.baseline) else {}
+        saved.update(results)
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as file:
+            json.dump({'machine': '{} {} python {} numpy {} cpus {}'.format(platform.system(), platform.machine(),
+                       platform.python_version(), np.__version__, os.cpu_count()), 'results': saved}, file, indent=2)
+        print('\nBaseline saved in ' + args.baseline)
+
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,244 @@
+import os
+import copy
+import zlib
+import queue
+import pickle
+import struct
+import hashlib
+import threading
+from collections import namedtuple
+
+# Entry of the index: a genome saved at a generation, its blob being stored at the given offset
+ArchiveEntry = namedtuple('ArchiveEntry', ['generation', 'genome_id', 'fitness', 'map_name', 'offset'])
+
+_MAGIC = b'NEATARC1'
+_HEADER = struct.Struct('<cI')     # record type, payload length
+_ENTRY = struct.Struct('<qqdQ')    # generation, genome id, fitness, blob offset (followed by the map name)
+_DIGEST_SIZE = 32
+_BLOB, _INDEX = b'G', b'E'
+
+# Attributes of the genomes which change between generations, not stored in the blobs
+_VOLATILE = ('fitness', 'termination')
+
+class GenomeArchive:
+    """
+    Append-only file storing all the genomes of a run. The file is a sequence of records:
+    genome blobs (compressed pickles, content-addressed so that a genome saved again
+    unchanged, as the elites, takes no space) and index entries keyed by
+    (generation, genome_id) pointing to a blob. The index is rebuilt in memory when the
+    archive is opened, and any genome can then be loaded without reading the others.
+    The genomes are written by a background thread, so that adding them does not wait
+    for the disk.
+    """
+    def __init__(self, file, new=False):
+        """
+        Open an archive, creating the file if it does not exist
+
+        Args:
+            file: path of the archive file
+            new: If True, an existing archive file is replaced by an empty one
+        """
+        self.file = file
+        self.entries = {} # (generation, genome_id) -> ArchiveEntry
+        self.written = [] # entries written since the last call to take_written
+        self.blobs = {}   # digest -> offset of the blob
+        self.lock = threading.Lock()
+        self.queue = None
+        self.writer = None
+        self.error = None
+        self.reader = None
+
+        # Rebuild the index, dropping an incomplete record left by an interrupted run
+        end = self.scan() if os.path.exists(file) and not new else None
+        self.output = open(file, 'r+b' if end is not None else 'w+b')
+        if end is None:
+            self.output.write(_MAGIC)
+        else:
+            self.output.truncate(end)
+        self.output.seek(0, os.SEEK_END)
+        self.output.flush()
+
+    def scan(self):
+        """
+        Read the index entries and the blob digests of the archive file
+
+        Returns:
+            offset of the end of the last complete record
+        """
+        with open(self.file, 'rb') as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError('Not a genome archive: ' + self.file)
+            size = os.fstat(f.fileno()).st_size
+            end = f.tell()
+            while end + _HEADER.size <= size:
+                kind, length = _HEADER.unpack(f.read(_HEADER.size))
+                if end + _HEADER.size + length > size:
+                    break
+                if kind == _BLOB:
+                    self.blobs[f.read(_DIGEST_SIZE)] = end
+                    f.seek(length - _DIGEST_SIZE, os.SEEK_CUR)
+                else:
+                    payload = f.read(length)
+                    generation, genome_id, fitness, offset = _ENTRY.unpack_from(payload)
+                    map_name = payload[_ENTRY.size:].decode()
+                    self.entries[(generation, genome_id)] = ArchiveEntry(generation, genome_id, fitness, map_name, offset)
+                end = f.tell()
+        return end
+
+    def add(self, generation, genome_id, genome, fitness, map_name=''):
+        """
+        Add a genome to the archive. The genome is serialized immediately and written in the background.
+
+        Args:
+            generation: generation of the genome
+            genome_id: id of the genome
+            genome: genome to save
+            fitness: fitness of the genome, stored in the index
+            map_name: name of the map on which the genome was evaluated
+        """
+        self.check()
+        if self.writer is None:
+            self.queue = queue.Queue()
+            self.writer = threading.Thread(target=self.write_records, daemon=True)
+            self.writer.start()
+
+        # Serialize the genome without its fitness, so that an unchanged genome has the same content
+        state = copy.copy(genome)
+        for name in _VOLATILE:
+            state.__dict__.pop(name, None)
+        self.queue.put((generation, genome_id, float(fitness), map_name, pickle.dumps(state, pickle.HIGHEST_PROTOCOL)))
+
+    def write_records(self):
+        """
+        Write the queued genomes to the file (background thread)
+        """
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    self.write_record(*item)
+                    if self.queue.empty():
+                        self.output.flush()
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def write_record(self, generation, genome_id, fitness, map_name, data):
+        """
+        Append the blob of a genome (unless already stored) and its index entry
+
+        Args:
+            generation: generation of the genome
+            genome_id: id of the genome
+            fitness: fitness of the genome
+            map_name: name of the map on which the genome was evaluated
+            data: pickled genome
+        """
+        digest = hashlib.sha256(data).digest()
+        with self.lock:
+            offset = self.blobs.get(digest)
+            if offset is None:
+                offset = self.output.tell()
+                blob = zlib.compress(data)
+                self.output.write(_HEADER.pack(_BLOB, _DIGEST_SIZE + len(blob)) + digest + blob)
+                self.blobs[digest] = offset
+            payload = _ENTRY.pack(generation, genome_id, fitness, offset) + map_name.encode()
+            self.output.write(_HEADER.pack(_INDEX, len(payload)) + payload)
+            entry = ArchiveEntry(generation, genome_id, fitness, map_name, offset)
+            self.entries[(generation, genome_id)] = entry
+            self.written.append(entry)
+
+    def take_written(self):
+        """
+        Get the entries written to the file since the last call, without waiting for the queued genomes
+
+        Returns:
+            list of the ArchiveEntry written
+        """
+        with self.lock:
+            written, self.written = self.written, []
+        return written
+
+    def check(self):
+        """
+        Raise the error of the background writer, if any
+        """
+        if self.error is not None:
+            raise IOError('Could not write the genome archive ' + self.file) from self.error
+
+    def flush(self):
+        """
+        Wait until all the added genomes are written to the file
+        """
+        if self.queue is not None:
+            self.queue.join()
+        self.check()
+
+    def close(self):
+        """
+        Write the remaining genomes and close the archive
+        """
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        self.output.close()
+        if self.reader is not None:
+            self.reader.close()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        self.flush()
+        return len(self.entries)
+
+    def index(self, generation=None):
+        """
+        Get the index entries, sorted by generation and genome id
+
+        Args:
+            generation: only get the entries of this generation (None for all)
+        """
+        self.flush()
+        return sorted(entry for entry in self.entries.values() if generation is None or entry.generation == generation)
+
+    def best(self, generation=None):
+        """
+        Get the entry of the genome with the best fitness
+
+        Args:
+            generation: only look at the genomes of this generation (None for all)
+        """
+        return max(self.index(generation), key=lambda entry: entry.fitness)
+
+    def load(self, generation, genome_id):
+        """
+        Load a genome, reading only its blob in the file
+
+        Args:
+            generation: generation of the genome
+            genome_id: id of the genome
+
+        Returns:
+            the genome, with the fitness stored in the index
+        """
+        self.flush()
+        entry = self.entries[(generation, genome_id)]
+        with self.lock:
+            self.output.flush()
+            if self.reader is None:
+                self.reader = open(self.file, 'rb')
+            self.reader.seek(entry.offset)
+            kind, length = _HEADER.unpack(self.reader.read(_HEADER.size))
+            blob = self.reader.read(length)[_DIGEST_SIZE:]
+        genome = pickle.loads(zlib.decompress(blob))
+        genome.fitness = entry.fitness
+        return genome
@@ -0,0 +1,196 @@
+import numpy as np
+from neat.graphs import feed_forward_layers
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(5.0 * z, -60.0, 60.0)))
+
+def _inv(z):
+    with np.errstate(divide='ignore', over='ignore'):
+        inv = 1.0 / z
+    return np.where(np.isfinite(inv), inv, 0.0)
+
+# NumPy versions of the neat-python activation functions
+ACTIVATIONS = {
+    'sigmoid': _sigmoid,
+    'tanh': lambda z: np.tanh(np.clip(2.5 * z, -60.0, 60.0)),
+    'sin': lambda z: np.sin(np.clip(5.0 * z, -60.0, 60.0)),
+    'gauss': lambda z: np.exp(-5.0 * np.clip(z, -3.4, 3.4) ** 2),
+    'relu': lambda z: np.where(z > 0.0, z, 0.0),
+    'softplus': lambda z: 0.2 * np.log(1 + np.exp(np.clip(5.0 * z, -60.0, 60.0))),
+    'identity': lambda z: z,
+    'clamped': lambda z: np.clip(z, -1.0, 1.0),
+    'inv': _inv,
+    'log': lambda z: np.log(np.maximum(1e-7, z)),
+    'exp': lambda z: np.exp(np.clip(z, -60.0, 60.0)),
+    'abs': np.abs,
+    'hat': lambda z: np.maximum(0.0, 1 - np.abs(z)),
+    'square': lambda z: z ** 2,
+    'cube': lambda z: z ** 3,
+}
+
+class CompiledNetwork:
+    """
+    Feed-forward network compiled into dense NumPy arrays. The nodes are stored in slots
+    (inputs, then outputs, then hidden nodes sorted by layer) and each layer of the network
+    is evaluated with a single matrix product, for one input or a batch of inputs.
+    The outputs match neat.nn.FeedForwardNetwork.activate within float tolerance.
+    """
+    def __init__(self, input_count, output_count, weights, bias, response, activations, levels):
+        """
+        Args:
+            input_count: number of input nodes
+            output_count: number of output nodes
+            weights: (array) weight of the connection from slot j to slot i at [i, j] : shape = (slots, slots)
+            bias: (array) bias of each slot : shape = (slots,)
+            response: (array) response of each slot : shape = (slots,)
+            activations: list of the activation function name of each slot
+            levels: (array) layer in which each slot is evaluated, -1 if never evaluated : shape = (slots,)
+        """
+        self.input_count = input_count
+        self.output_count = output_count
+        self.weights = weights
+        self.bias = bias
+        self.response = response
+        self.activations = activations
+        self.levels = levels
+        self.level_count = int(levels.max()) + 1 if len(levels) > 0 else 0
+        
+        # Slots and activation functions evaluated in each layer
+        self.layers = []
+        for level in range(self.level_count):
+            nodes = np.flatnonzero(levels == level)
+            names = np.array([activations[i] for i in nodes])
+            self.layers.append((nodes, {name: names == name for name in set(names)}))
+
+    def create(genome, config):
+        """
+        Compile a genome into a network, keeping only the enabled connections and the
+        nodes required to compute the outputs (as neat.nn.FeedForwardNetwork.create)
+
+        Args:
+            genome: genome to compile
+            config: NEAT configuration
+        """
+        genome_config = config.genome_config
+        input_keys, output_keys = genome_config.input_keys, genome_config.output_keys
+
+        # Gather expressed connections and the layers of required nodes
+        connections = [cg.key for cg in genome.connections.values() if cg.enabled]
+        layers = feed_forward_layers(input_keys, output_keys, connections)
+
+        # Assign a slot to each node: inputs, outputs, then hidden nodes by layer
+        level_of = {node: level for level, layer in enumerate(layers) for node in layer}
+        hidden = sorted((node for node in level_of if node not in output_keys), key=lambda node: (level_of[node], node))
+        slots = {node: i for i, node in enumerate(list(input_keys) + list(output_keys) + hidden)}
+        slot_count = len(slots)
+
+        weights = np.zeros((slot_count, slot_count))
+        bias = np.zeros(slot_count)
+        response = np.ones(slot_count)
+        activations = ['identity'] * slot_count
+        levels = np.full(slot_count, -1)
+        for node, level in level_of.items():
+            ng = genome.nodes[node]
+            if ng.aggregation != 'sum':
+                raise ValueError('Only the sum aggregation can be compiled, got ' + str(ng.aggregation))
+            if ng.activation not in ACTIVATIONS:
+                raise ValueError('No compiled version of the activation function ' + str(ng.activation))
+            i = slots[node]
+            bias[i], response[i], activations[i], levels[i] = ng.bias, ng.response, ng.activation, level
+        for inode, onode in connections:
+            if onode in level_of:
+                weights[slots[onode], slots[inode]] = genome.connections[(inode, onode)].weight
+
+        return CompiledNetwork(len(input_keys), len(output_keys), weights, bias, response, activations, levels)
+
+    def activate(self, inputs):
+        """
+        Evaluate the network
+
+        Args:
+            inputs: input values : shape = (inputs,) or (batch, inputs)
+
+        Returns:
+            list of the output values for a single input, array of shape (batch, outputs) for a batch
+        """
+        inputs = np.asarray(inputs, dtype=float)
+        if inputs.shape[-1] != self.input_count:
+            raise RuntimeError("Expected {0:n} inputs, got {1:n}".format(self.input_count, inputs.shape[-1]))
+
+        values = np.zeros(inputs.shape[:-1] + (len(self.levels),))
+        values[..., :self.input_count] = inputs
+        for nodes, activations in self.layers:
+            z = self.bias[nodes] + self.response[nodes] * (values @ self.weights[nodes].T)
+            values[..., nodes] = _apply_activations(z, activations)
+
+        outputs = values[..., self.input_count:self.input_count + self.output_count]
+        return list(outputs) if inputs.ndim == 1 else outputs
+
+class PopulationNetwork:
+    """
+    Several compiled networks of different topologies padded to the same number of
+    slots and stacked, so that a whole population is evaluated on its respective
+    inputs with one batched matrix product per layer.
+    """
+    def __init__(self, networks):
+        """
+        Args:
+            networks: list of CompiledNetwork sharing the same inputs and outputs
+        """
+        self.count = len(networks)
+        self.input_count = networks[0].input_count
+        self.output_count = networks[0].output_count
+        slot_count = max(len(network.levels) for network in networks)
+        self.level_count = max(network.level_count for network in networks)
+
+        # Pad every network with slots that are never evaluated
+        self.weights = np.zeros((self.count, slot_count, slot_count))
+        self.bias = np.zeros((self.count, slot_count))
+        self.response = np.ones((self.count, slot_count))
+        self.levels = np.full((self.count, slot_count), -1)
+        activations = np.full((self.count, slot_count), 'identity', dtype=object)
+        for k, network in enumerate(networks):
+            n = len(network.levels)
+            self.weights[k, :n, :n] = network.weights
+            self.bias[k, :n] = network.bias
+            self.response[k, :n] = network.response
+            self.levels[k, :n] = network.levels
+            activations[k, :n] = network.activations
+
+        # Group the slots by activation function, the slots never evaluated can use any of them
+        names = sorted(set(activations[self.levels >= 0])) or ['identity']
+        activations[self.levels < 0] = names[0]
+        self.activation_masks = {name: activations == name for name in names}
+
+    def activate(self, inputs):
+        """
+        Evaluate each network on its own inputs
+
+        Args:
+            inputs: (array) input values of each network : shape = (networks, inputs)
+
+        Returns:
+            array of the output values of each network : shape = (networks, outputs)
+        """
+        values = np.zeros(self.levels.shape)
+        values[:, :self.input_count] = inputs
+        for level in range(self.level_count):
+            z = self.bias + self.response * np.einsum('pij,pj->pi', self.weights, values)
+            values = np.where(self.levels == level, _apply_activations(z, self.activation_masks), values)
+        return values[:, self.input_count:self.input_count + self.output_count]
+
+def _apply_activations(z, activations):
+    """
+    Apply the activation functions to the aggregated node values
+
+    Args:
+        z: (array) aggregated values
+        activations: dictionary {activation name: mask of the values using it}
+    """
+    if len(activations) == 1:
+        return ACTIVATIONS[next(iter(activations))](z)
+    out = np.zeros(z.shape)
+    for name, mask in activations.items():
+        mask = np.broadcast_to(mask, z.shape)
+        out[mask] = ACTIVATIONS[name](z[mask])
+    return out
@@ -0,0 +1,368 @@
+import io
+import os
+import time
+import socket
+import pickle
+import hashlib
+import warnings
+import threading
+import traceback
+from collections import deque
+from multiprocessing.managers import BaseManager
+
+HEARTBEAT_PERIOD = 2.0   # Period of the heartbeats sent by a worker running a task (s)
+HEARTBEAT_TIMEOUT = 10.0 # Time without heartbeat after which the tasks of a worker are given to the other workers (s)
+POLL_TIMEOUT = 1.0       # Maximum wait of a worker asking for a task, or of the coordinator waiting for results (s)
+NO_WORKER_WARNING = 30.0 # Time without any live worker after which the coordinator warns (s)
+AUTHKEY_VARIABLE = 'NEAT_AUTHKEY' # Environment variable of the key authenticating the workers, when it is not given
+DEFAULT_HOST = 'localhost' # Interface on which the coordinator is served when only its port is given
+
+class WorkQueue:
+    """
+    Queue of the tasks of the coordinator, shared with the workers through a manager.
+    The tasks are given in order to the workers asking for them, and the tasks of a worker
+    which stops sending heartbeats (crashed node, lost connection...) are put back in
+    front of the queue for the other workers. The first result of a task is kept.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = deque()  # ids of the tasks waiting for a worker
+        self.tasks = {}         # task id -> pickled task, until its result is received
+        self.assigned = {}      # task id -> worker id
+        self.results = {}       # task id -> (error, result)
+        self.last_seen = {}     # worker id -> time of its last request or heartbeat
+        self.next_id = 0
+        self.stopped = False
+
+    def submit(self, tasks):
+        """
+        Add tasks to the queue
+
+        Args:
+            tasks: list of the pickled tasks
+
+        Returns:
+            list of the ids of the tasks
+        """
+        with self.condition:
+            ids = list(range(self.next_id, self.next_id + len(tasks)))
+            self.next_id += len(tasks)
+            self.tasks.update(zip(ids, tasks))
+            self.pending.extend(ids)
+            self.condition.notify_all()
+        return ids
+
+    def get_task(self, worker_id, timeout=POLL_TIMEOUT):
+        """
+        Get the next task to run, waiting for one if the queue is empty
+
+        Args:
+            worker_id: id of the worker asking for a task
+            timeout: maximum wait (s)
+
+        Returns:
+            tuple (task id, pickled task), None if there is no task to run, False once the queue is stopped
+        """
+        with self.condition:
+            self.last_seen[worker_id] = time.monotonic()
+            self.requeue_lost()
+            if not self.pending and not self.stopped:
+                self.condition.wait(timeout)
+            if self.stopped:
+                return False
+            while self.pending:
+                task_id = self.pending.popleft()
+                if task_id in self.tasks:
+                    self.assigned[task_id] = worker_id
+                    return task_id, self.tasks[task_id]
+            return None
+
+    def heartbeat(self, worker_id):
+        """
+        Signal that a worker is still running its task
+
+        Args:
+            worker_id: id of the worker
+        """
+        with self.condition:
+            self.last_seen[worker_id] = time.monotonic()
+
+    def put_result(self, worker_id, task_id, error, result):
+        """
+        Save the result of a task
+
+        Args:
+            worker_id: id of the worker which ran the task
+            task_id: id of the task
+            error: traceback of the exception raised by the task, None if it succeeded
+            result: result of the task
+        """
+        with self.condition:
+            self.last_seen[worker_id] = time.monotonic()
+            if task_id in self.tasks:
+                del self.tasks[task_id]
+                self.assigned.pop(task_id, None)
+                self.results[task_id] = (error, result)
+                self.condition.notify_all()
+
+    def requeue_lost(self):
+        """
+        Put back in the queue the tasks of the workers without recent heartbeat
+        (called with the condition held)
+        """
+        now = time.monotonic()
+        lost = [task_id for task_id, worker_id in self.assigned.items() if now - self.last_seen[worker_id] > HEARTBEAT_TIMEOUT]
+        for task_id in sorted(lost, reverse=True):
+            del self.assigned[task_id]
+            self.pending.appendleft(task_id)
+        if lost:
+            self.condition.notify_all()
+
+    def take_results(self, ids, timeout=POLL_TIMEOUT):
+        """
+        Wait for the results of tasks
+
+        Args:
+            ids: ids of the tasks
+            timeout: maximum wait (s)
+
+        Returns:
+            list of the (error, result) of the tasks, None if some results are still missing
+        """
+        with self.condition:
+            self.requeue_lost()
+            if not all(task_id in self.results for task_id in ids):
+                self.condition.wait(timeout)
+            if not all(task_id in self.results for task_id in ids):
+                return None
+            return [self.results.pop(task_id) for task_id in ids]
+
+    def take_any_results(self, ids, timeout=POLL_TIMEOUT):
+        """
+        Wait for the result of any of the tasks
+
+        Args:
+            ids: ids of the tasks
+            timeout: maximum wait (s)
+
+        Returns:
+            dictionary {task id: (error, result)} of the tasks finished, empty if none
+        """
+        with self.condition:
+            self.requeue_lost()
+            if not any(task_id in self.results for task_id in ids):
+                self.condition.wait(timeout)
+            return {task_id: self.results.pop(task_id) for task_id in ids if task_id in self.results}
+
+    def stop(self):
+        """
+        Stop giving tasks, so that the workers exit
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def live_workers(self):
+        """
+        Get the number of workers seen recently
+        """
+        with self.condition:
+            now = time.monotonic()
+            return sum(1 for seen in self.last_seen.values() if now - seen <= HEARTBEAT_TIMEOUT)
+
+class QueueManager(BaseManager):
+    pass
+
+def read_authkey(authkey=None):
+    """
+    Get the key authenticating the workers, read from the AUTHKEY_VARIABLE environment
+    variable if it is not given. There is no default key: the tasks and the results are
+    pickled, so that anyone connecting with the key can run code in the coordinator and
+    in the workers.
+
+    Args:
+        authkey: (str or bytes) the key, None to read it from the environment
+
+    Returns:
+        the key (bytes)
+    """
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_VARIABLE)
+    if not authkey:
+        raise ValueError('No key authenticating the workers: set the {} environment variable'.format(AUTHKEY_VARIABLE))
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+class DistributedEvaluator:
+    """
+    Evaluator serving the tasks to worker processes on other machines (see worker.py),
+    instead of a local pool. The workers connect to the coordinator over TCP, pull the
+    tasks from its queue and send back the results. The grids are not sent: the tasks
+    only carry the name of the map, each worker loading the maps from its own copy of
+    the maps folder.
+    It has the interface of brain.evaluator.Evaluator.
+    """
+    def __init__(self, address, authkey=None, processes=32):
+        """
+        Start serving the tasks
+
+        Args:
+            address: (host, port) on which the workers connect, or port served on DEFAULT_HOST
+            authkey: (str or bytes) key authenticating the workers, None to read it from the environment (see read_authkey)
+            processes: number of tasks a population is split into, to balance the load of the workers
+        """
+        authkey = read_authkey(authkey)
+        if isinstance(address, int):
+            address = (DEFAULT_HOST, address)
+        self.processes = processes
+        self.queue = WorkQueue()
+        self.callbacks = {} # task id -> (callback, error callback) of the submitted tasks
+        self.lock = threading.Lock()
+        self.collector = None
+        QueueManager.register('work_queue', callable=lambda: self.queue)
+        self.manager = QueueManager(address=tuple(address), authkey=authkey)
+        self.server = self.manager.get_server()
+        self.address = self.server.address
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def publish(self, key, grid):
+        """
+        Describe a grid by its map, the workers loading the map themselves
+
+        Args:
+            key: name of the map (folder of the map in the maps folder)
+            grid: the grid instance
+
+        Returns:
+            descriptor of the map, to send to the workers instead of the grid
+        """
+        return {'map': key, 'GRID_SIZE': grid.GRID_SIZE, 'walls': getattr(grid, 'walls', None) is not None,
+                'digest': hashlib.sha256(grid.grid.tobytes()).hexdigest()}
+
+    def map(self, function, tasks):
+        """
+        Evaluate the tasks in the workers
+
+        Args:
+            function: function called on each task (must be importable by the workers)
+            tasks: list of the task arguments
+
+        Returns:
+            list of the results, in the order of the tasks
+        """
+        ids = self.queue.submit([pickle.dumps((function, task), pickle.HIGHEST_PROTOCOL) for task in tasks])
+        waiting = time.monotonic()
+        while True:
+            results = self.queue.take_results(ids)
+            if results is not None:
+                break
+            if self.queue.live_workers() > 0:
+                waiting = time.monotonic()
+            elif time.monotonic() - waiting > NO_WORKER_WARNING:
+                warnings.warn('No worker connected to the coordinator at {}:{}'.format(*self.address))
+                waiting = time.monotonic()
+
+        for error, _ in results:
+            if error is not None:
+                raise RuntimeError('A task failed in a worker:\n' + error)
+        return [result for _, result in results]
+
+    def submit(self, function, task, callback, error_callback):
+        """
+        Evaluate a task in a worker without waiting for its result
+
+        Args:
+            function: function called on the task (must be importable by the workers)
+            task: the task arguments
+            callback: function called with the result (from the thread collecting the results)
+            error_callback: function called with the exception raised by the task
+        """
+        task_id, = self.queue.submit([pickle.dumps((function, task), pickle.HIGHEST_PROTOCOL)])
+        with self.lock:
+            self.callbacks[task_id] = (callback, error_callback)
+        if self.collector is None:
+            self.collector = threading.Thread(target=self.collect_results, daemon=True)
+            self.collector.start()
+
+    def collect_results(self):
+        """
+        Call the callbacks of the submitted tasks as their results arrive (background thread)
+        """
+        while not self.queue.stopped:
+            with self.lock:
+                ids = list(self.callbacks)
+            for task_id, (error, result) in self.queue.take_any_results(ids).items():
+                with self.lock:
+                    callback, error_callback = self.callbacks.pop(task_id)
+                if error is not None:
+                    error_callback(RuntimeError('A task failed in a worker:\n' + error))
+                else:
+                    callback(result)
+
+    def close(self):
+        """
+        Stop serving the tasks, the workers exit at their next request
+        """
+        self.queue.stop()
+        time.sleep(POLL_TIMEOUT)
+        self.server.listener.close()
+        while self.thread.is_alive():
+            stop_event = getattr(self.server, 'stop_event', None)
+            if stop_event is not None:
+                stop_event.set()
+            self.thread.join(0.1)
+
+class TaskUnpickler(pickle.Unpickler):
+    """
+    Unpickler of the tasks, the functions of the main script of the coordinator being
+    found in the main module of the simulator
+    """
+    def find_class(self, module, name):
+        if module == '__main__':
+            module = 'main'
+        return super().find_class(module, name)
+
+def run_worker(address, authkey=None, worker_id=None):
+    """
+    Run the tasks of a coordinator until the connection is lost
+
+    Args:
+        address: (host, port) of the coordinator
+        authkey: (str or bytes) key authenticating the worker, None to read it from the environment (see read_authkey)
+        worker_id: name of the worker (None for the host name and process id)
+    """
+    authkey = read_authkey(authkey)
+    worker_id = worker_id or '{}-{}'.format(socket.gethostname(), os.getpid())
+    QueueManager.register('work_queue')
+    manager = QueueManager(address=tuple(address), authkey=authkey)
+    manager.connect()
+    queue = manager.work_queue()
+
+    running = threading.Event()
+    def send_heartbeats():
+        # Signal the coordinator while a task is running (the proxy uses one connection per thread)
+        while True:
+            time.sleep(HEARTBEAT_PERIOD)
+            if running.is_set():
+                queue.heartbeat(worker_id)
+    threading.Thread(target=send_heartbeats, daemon=True).start()
+
+    try:
+        while True:
+            task = queue.get_task(worker_id)
+            if task is False:
+                return
+            if task is None:
+                continue
+            task_id, data = task
+            running.set()
+            try:
+                function, args = TaskUnpickler(io.BytesIO(data)).load()
+                error, result = None, function(args)
+            except Exception:
+                error, result = traceback.format_exc(), None
+            running.clear()
+            queue.put_result(worker_id, task_id, error, result)
+    except (EOFError, ConnectionError, BrokenPipeError):
+        # The coordinator stopped
+        return
@@ -0,0 +1,337 @@
+import os
+import hashlib
+import numpy as np
+from multiprocessing import Pool, shared_memory, resource_tracker
+from game.grid import Grid
+from game.track import Track
+from game.walls import WallSegments
+from game.maps import MapRegistry
+
+# Shared memory blocks attached by the current process, by block name (oldest first)
+_attached = {}
+_MAX_ATTACHED = 32
+
+# Number of blocks kept attached, raised to the number of blocks published by the evaluator
+# so that the blocks of all the maps of a generation stay attached
+_attach_limit = _MAX_ATTACHED
+
+# Maps loaded by the current process from its maps folder, by (map name, distance field)
+_local_maps = {}
+
+class Evaluator:
+    """
+    Long-lived pool of worker processes used to evaluate the genomes. The workers are
+    started once, and the map grids are published once in shared memory so that the
+    tasks only carry the network parameters and a small descriptor of the grid.
+    """
+    def __init__(self, processes=None):
+        """
+        Start the worker processes
+
+        Args:
+            processes: number of worker processes (None for one per CPU)
+        """
+        # Start the resource tracker before the workers so that they share it, otherwise
+        # each worker would track (and unlink at exit) the shared grids it attaches to
+        resource_tracker.ensure_running()
+        
+        self.processes = processes or os.cpu_count()
+        self.pool = Pool(self.processes)
+        self.grids = {} # key -> (grid, descriptor, shared memory blocks)
+
+    def publish(self, key, grid):
+        """
+        Copy a grid in shared memory, the grid already published under the same key is
+        replaced only if it is a different grid instance
+
+        Args:
+            key: name of the grid (the map name)
+            grid: the grid instance
+
+        Returns:
+            descriptor of the shared grid, to send to the workers instead of the grid
+        """
+        if key in self.grids:
+            if self.grids[key][0] is grid:
+                return self.grids[key][1]
+            self.unpublish(key)
+
+        blocks = []
+        descriptor = {'GRID_SIZE': grid.GRID_SIZE, 'track': None}
+        descriptor['grid'] = Evaluator.share(grid.grid, blocks)
+        
+        # The levels of the pyramid are shared, so that the workers do not build them for each task
+        descriptor['pyramid'] = [Evaluator.share(level, blocks) for level in grid.pyramid]
+        
+        # The progress index of the track is shared, its centerline is small enough to be sent as is
+        track = getattr(grid, 'track', None)
+        if track is not None:
+            descriptor['track'] = (Evaluator.share(track.progress, blocks), track.centerline, track.length)
+
+        # The arrays of the segments of the walls are shared, the index of the rays being rebuilt by the workers
+        walls = getattr(grid, 'walls', None)
+        descriptor['walls'] = None
+        if walls is not None:
+            descriptor['walls'] = tuple(Evaluator.share(array, blocks) for array in (walls.levels, walls.segments, walls.buckets))
+        self.grids[key] = (grid, descriptor, blocks)
+        
+        # Number of blocks of all the published grids, for the workers to keep them attached
+        descriptor['published'] = sum(len(published) for _, _, published in self.grids.values())
+        return descriptor
+
+    def share(array, blocks):
+        """
+        Copy an array in a new shared memory block
+
+        Args:
+            array: the array to share (None for no array)
+            blocks: list of the shared memory blocks, the new block is appended to it
+
+        Returns:
+            descriptor (block name, shape, dtype) of the shared array, None for no array
+        """
+        if array is None:
+            return None
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        return (block.name, array.shape, array.dtype.str)
+
+    def unpublish(self, key):
+        """
+        Release the shared memory of a published grid
+
+        Args:
+            key: name of the grid
+        """
+        _, _, blocks = self.grids.pop(key)
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    def map(self, function, tasks):
+        """
+        Evaluate the tasks in the worker processes
+
+        Args:
+            function: function called on each task (must be importable by the workers)
+            tasks: list of the task arguments
+
+        Returns:
+            list of the results, in the order of the tasks
+        """
+        return self.pool.map(function, tasks)
+
+    def submit(self, function, task, callback, error_callback):
+        """
+        Evaluate a task in a worker process without waiting for its result
+
+        Args:
+            function: function called on the task (must be importable by the workers)
+            task: the task arguments
+            callback: function called with the result (from a thread of the pool)
+            error_callback: function called with the exception raised by the task
+        """
+        self.pool.apply_async(function, (task,), callback=callback, error_callback=error_callback)
+
+    def close(self):
+        """
+        Stop the worker processes and release the shared grids
+        """
+        self.pool.close()
+        self.pool.join()
+        for key in list(self.grids):
+            self.unpublish(key)
+
+class StateStream:
+    """
+    States of the agents of a generation in shared memory, written by the workers at
+    each step of their simulations and read by the population viewer (see main.py).
+    The stream only exists while a viewer is shown: without it the tasks carry no stream
+    and the simulations write nothing. The agents whose results are read from the fitness
+    cache are not simulated: they are shown at the final state of their last simulation
+    streamed by this coordinator, if any.
+    """
+    # Columns of the state of an agent, its status being WAITING before its simulation
+    # (CACHED: result read from the fitness cache, the position being nan if its final state is unknown)
+    COLUMNS = ['x', 'y', 'rot', 'status']
+    WAITING, RUNNING, STOPPED, CACHED = 0, 1, 2, 3
+
+    def __init__(self, capacity):
+        """
+        Allocate the stream
+
+        Args:
+            capacity: maximum number of agents of a generation
+        """
+        self.capacity = capacity
+        self.blocks = []
+        self.descriptor = {name: Evaluator.share(array, self.blocks) for name, array in (
+            ('header', np.zeros(2, dtype=np.int64)),                              # generation, number of agents
+            ('map', np.zeros(64, dtype=np.uint8)),                                 # name of the map of the agents
+            ('states', np.zeros((capacity, len(StateStream.COLUMNS)), dtype=np.float32)),
+            ('species', np.zeros(capacity, dtype=np.int32)))}                      # species id of each agent
+        self.arrays = StateStream.attach(self.descriptor)
+        self.final_states = {} # fitness cache key -> final (x, y, rot) of the agents simulated while streamed
+
+    def attach(descriptor):
+        """
+        Get the arrays of a stream (in any process)
+
+        Args:
+            descriptor: the descriptor of the stream
+
+        Returns:
+            dictionary {name: array} of the arrays of the stream ('header', 'map', 'states', 'species')
+        """
+        return {name: _attach_array(array) for name, array in descriptor.items()}
+
+    def begin(self, generation, map_name, species):
+        """
+        Start streaming the agents of a generation
+
+        Args:
+            generation: number of the generation
+            map_name: name of the map whose simulations are streamed
+            species: species id of each agent
+
+        Returns:
+            descriptor of the states, to send to the workers (see attach_states)
+        """
+        count = len(species)
+        if count > self.capacity:
+            raise ValueError('{} agents do not fit in a state stream of {} agents'.format(count, self.capacity))
+        arrays = self.arrays
+        arrays['states'][:] = 0.0
+        arrays['species'][:count] = species
+        name = map_name.encode()[:len(arrays['map'])]
+        arrays['map'][:] = 0
+        arrays['map'][:len(name)] = np.frombuffer(name, dtype=np.uint8)
+        arrays['header'][:] = (generation, count)
+        return self.descriptor['states']
+
+    def remember(self, agents, keys):
+        """
+        Keep the final state of agents simulated in the current generation, to show them again
+        when their results are read from the fitness cache
+
+        Args:
+            agents: indices of the simulated agents
+            keys: fitness cache key of each of these agents
+        """
+        states = self.arrays['states']
+        for agent, key in zip(agents, keys):
+            if states[agent, 3] != StateStream.WAITING:
+                self.final_states[key] = tuple(states[agent, :3].tolist())
+
+    def show_cached(self, agents, keys):
+        """
+        Show agents whose results are read from the fitness cache, at their final state if known
+
+        Args:
+            agents: indices of the agents
+            keys: fitness cache key of each of these agents
+        """
+        states = self.arrays['states']
+        for agent, key in zip(agents, keys):
+            states[agent, :3] = self.final_states.get(key, (np.nan, np.nan, 0.0))
+            states[agent, 3] = StateStream.CACHED
+
+    def read(arrays):
+        """
+        Read the current generation of a stream
+
+        Args:
+            arrays: arrays of the stream (see attach)
+
+        Returns:
+            generation: number of the generation
+            map_name: name of the map of the agents ('' before the first generation)
+            states: array of the state of each agent (see COLUMNS) : shape = (agents, 4)
+            species: array of the species id of each agent : shape = (agents,)
+        """
+        generation, count = arrays['header'].tolist()
+        map_name = arrays['map'].tobytes().rstrip(b'\0').decode()
+        return generation, map_name, arrays['states'][:count], arrays['species'][:count]
+
+    def close(self):
+        """
+        Release the shared memory of the stream
+        """
+        self.arrays = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+def attach_grid(grid):
+    """
+    Get the grid described by a shared grid descriptor, without copying the arrays.
+    The shared memory blocks stay attached for the lifetime of the process.
+
+    Args:
+        grid: descriptor returned by Evaluator.publish or DistributedEvaluator.publish,
+              or a grid instance (returned as is)
+    """
+    if isinstance(grid, Grid):
+        return grid
+    if 'map' in grid:
+        return _load_local_map(grid)
+
+    global _attach_limit
+    _attach_limit = max(_attach_limit, grid['published'] + _MAX_ATTACHED)
+    track = None
+    if grid.get('track') is not None:
+        progress, centerline, length = grid['track']
+        track = Track.from_arrays(_attach_array(progress), centerline, length)
+    walls = None
+    if grid.get('walls') is not None:
+        walls = WallSegments.from_arrays(*[_attach_array(array) for array in grid['walls']])
+    pyramid = [_attach_array(level) for level in grid['pyramid']]
+    return Grid.from_arrays(grid['GRID_SIZE'], _attach_array(grid['grid']), track, pyramid, walls)
+
+def attach_states(descriptor):
+    """
+    Get the array of the states of the agents of a state stream, written by the simulations
+
+    Args:
+        descriptor: descriptor returned by StateStream.begin
+    """
+    return _attach_array(descriptor)
+
+def _load_local_map(descriptor):
+    """
+    Get the grid of a map described by its name (see DistributedEvaluator.publish), loaded
+    once from the maps folder of the current process
+    """
+    key = (descriptor['map'], descriptor['GRID_SIZE'], descriptor['walls'])
+    if key not in _local_maps:
+        grid = MapRegistry.load('maps/' + descriptor['map'] + '/', descriptor['GRID_SIZE'], descriptor['walls']).grid
+        if hashlib.sha256(grid.grid.tobytes()).hexdigest() != descriptor['digest']:
+            raise ValueError('The map {} of this worker differs from the map of the coordinator'.format(descriptor['map']))
+        _local_maps[key] = grid
+    return _local_maps[key]
+
+def _attach_array(descriptor):
+    """
+    Get the array described by a shared array descriptor (see Evaluator.share), None for no array
+    """
+    if descriptor is None:
+        return None
+    block_name, shape, dtype = descriptor
+    if block_name not in _attached:
+        _attached[block_name] = shared_memory.SharedMemory(name=block_name)
+        _detach_oldest()
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=_attached[block_name].buf)
+
+def _detach_oldest():
+    """
+    Detach the oldest shared memory blocks when more blocks are attached than published
+    (grids replaced by the evaluator)
+    """
+    for block_name in list(_attached)[:-_attach_limit]:
+        try:
+            _attached[block_name].close()
+        except BufferError:
+            # Still referenced by a grid in use
+            continue
+        del _attached[block_name]
@@ -0,0 +1,169 @@
+import os
+import json
+import pickle
+import hashlib
+import inspect
+import importlib
+import numpy as np
+from collections import OrderedDict
+from brain.compiled_network import CompiledNetwork
+
+# Version of the cached results, to increase when the results change without a change of the
+# simulator code (e.g. a new version of a dependency), so that the saved results are not reused
+CACHE_VERSION = 1
+
+# Modules of the simulator whose source code is part of the context of the results
+SIMULATOR_MODULES = ['game.game', 'game.batch_game', 'game.player', 'game.sensors', 'game.collision',
+                     'game.termination', 'game.track', 'game.grid', 'game.walls']
+
+class FitnessCache:
+    """
+    Bounded LRU cache of the simulation results of the networks. The simulation being
+    deterministic for a given map and set of simulation parameters, a network already
+    simulated (an elite carried over to the next generation, or an offspring whose
+    mutations do not change the expressed network) is not simulated again.
+    The keys combine the digest of the network with the digest of the simulation context,
+    so that the cache can be saved and reused by the next runs.
+    """
+    def __init__(self, capacity=100000, file=None):
+        """
+        Create the cache, loading the saved one if any
+
+        Args:
+            capacity: maximum number of results kept, the least recently used being dropped first
+            file: path of the file the cache is saved to (None to not save it)
+        """
+        self.capacity = capacity
+        self.file = file
+        self.entries = OrderedDict() # key -> result
+        self.hits = 0
+        self.misses = 0
+        if file is not None and os.path.exists(file):
+            with open(file, 'rb') as f:
+                self.entries.update(pickle.load(f))
+            self.trim()
+
+    def key(network_digest, context_digest):
+        """
+        Key of the result of a network in a simulation context
+
+        Args:
+            network_digest: digest of the network (see network_digest)
+            context_digest: digest of the map and simulation parameters (see context_digest)
+        """
+        return hashlib.sha256(network_digest + context_digest).digest()
+
+    def get(self, key):
+        """
+        Get a cached result, counted as a hit or a miss
+
+        Args:
+            key: key of the result
+
+        Returns:
+            the result, None if not cached
+        """
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        """
+        Cache a result
+
+        Args:
+            key: key of the result
+            result: result of the simulation
+        """
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        self.trim()
+
+    def trim(self):
+        """
+        Drop the least recently used results above the capacity
+        """
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def take_counts(self):
+        """
+        Get the hits and misses counted since the last call
+
+        Returns:
+            dictionary {'hits': count, 'misses': count}
+        """
+        counts = {'hits': self.hits, 'misses': self.misses}
+        self.hits = self.misses = 0
+        return counts
+
+    def save(self):
+        """
+        Save the cache to its file, if any
+        """
+        if self.file is None:
+            return
+        os.makedirs(os.path.dirname(self.file) or '.', exist_ok=True)
+        with open(self.file + '.tmp', 'wb') as f:
+            pickle.dump(list(self.entries.items()), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(self.file + '.tmp', self.file)
+
+    def __len__(self):
+        return len(self.entries)
+
+def network_digest(network):
+    """
+    Digest of the function computed by a network: only the expressed nodes and connections
+    are hashed, not the genome (disabled genes, nodes not required for the outputs...)
+
+    Args:
+        network: CompiledNetwork or neat.nn.FeedForwardNetwork
+    """
+    digest = hashlib.sha256()
+    if isinstance(network, CompiledNetwork):
+        evaluated = network.levels >= 0
+        digest.update(np.array([network.input_count, network.output_count], dtype=np.int64).tobytes())
+        digest.update(network.levels.astype(np.int64).tobytes())
+        for array in (network.weights[evaluated], network.bias[evaluated], network.response[evaluated]):
+            digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        digest.update(','.join(name for name, used in zip(network.activations, evaluated) if used).encode())
+    else:
+        node_evals = [(node, activation.__name__, aggregation.__name__, bias, response, links)
+                      for node, activation, aggregation, bias, response, links in network.node_evals]
+        digest.update(repr((network.input_nodes, network.output_nodes, node_evals)).encode())
+    return digest.digest()
+
+def code_digest(functions):
+    """
+    Digest of the source code of the simulator (SIMULATOR_MODULES and the given functions),
+    so that the results of a previous version of the simulator are not reused
+
+    Args:
+        functions: functions simulating the networks outside of the simulator modules (fitness, controls...)
+    """
+    digest = hashlib.sha256()
+    for source in [importlib.import_module(name) for name in SIMULATOR_MODULES] + list(functions):
+        digest.update(inspect.getsource(source).encode())
+    return digest.digest()
+
+def context_digest(map_name, grid, player_pos, params, code=b''):
+    """
+    Digest of the simulation context of a map
+
+    Args:
+        map_name: name of the map
+        grid: the grid instance
+        player_pos: spawn point of the players
+        params: simulation parameters, any value which can be saved as JSON (the objects by their attributes)
+        code: digest of the source code of the simulator (see code_digest)
+    """
+    digest = hashlib.sha256()
+    digest.update(str(CACHE_VERSION).encode() + code)
+    digest.update(json.dumps([map_name, player_pos, params], default=lambda value: getattr(value, '__dict__', str(value))).encode())
+    digest.update(np.ascontiguousarray(grid.grid).tobytes())
+    digest.update(b'walls' if getattr(grid, 'walls', None) is not None else b'')
+    return digest.digest()
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import glob
+import shutil
+import pstats
+import cProfile
+import tempfile
+import itertools
+from contextlib import contextmanager
+
+# Number of the tasks profiled by the current process, used to name the profile files
+_profiled_tasks = itertools.count()
+
+class PhaseTimer:
+    """
+    Wall time of the phases of a generation, a phase being timed each time it is entered
+    """
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a phase, as a context manager: with timer.phase('name'): ...
+
+        Args:
+            name: name of the phase, the times of the phases entered several times are summed
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+def write_generation_timings(file, generation, map_name, phases, agents, cache=None):
+    """
+    Append the timings of a generation as a JSON line to a file, the file being
+    overwritten at the first generation (as the species statistics)
+
+    Args:
+        file: path of the JSONL file
+        generation: current generation
+        map_name: name of the training map
+        phases: dictionary {phase name: wall time (s)}
+        agents: list of dictionaries with the telemetry of each agent
+        cache: dictionary with the hits and misses of the fitness cache (None without cache)
+    """
+    steps = sum(agent['steps'] for agent in agents)
+    record = {
+        'generation': generation,
+        'map': map_name,
+        'phases': {name: round(duration, 6) for name, duration in phases.items()},
+        'total': round(sum(phases.values()), 6),
+        'steps': steps,
+        'steps_per_sec': steps / phases['simulate'] if phases.get('simulate') else None,
+        'fitness_cache': cache,
+        'agents': agents,
+    }
+    with open(file, 'w' if generation == 0 else 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+def profile_task(args):
+    """
+    Run a task in a worker under cProfile, the statistics being saved in a folder
+    to be merged with the ones of the other tasks (see merge_profiles)
+
+    Args:
+        args: tuple (function, task arguments, profile folder)
+    """
+    function, task, folder = args
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return function(task)
+    finally:
+        profiler.disable()
+        # The folder does not exist on the other machines of a distributed evaluation, whose profiles are dropped
+        os.makedirs(folder, exist_ok=True)
+        profiler.dump_stats(os.path.join(folder, 'task-{}-{}.prof'.format(os.getpid(), next(_profiled_tasks))))
+
+class WorkerProfiler:
+    """
+    Profiling of the tasks run by the workers of the evaluator during a generation
+    """
+    def __init__(self):
+        self.folder = tempfile.mkdtemp(prefix='neat-profile-')
+
+    def wrap(self, function, tasks):
+        """
+        Wrap the tasks so that they are profiled when mapped with profile_task
+
+        Args:
+            function: function called on each task
+            tasks: list of the task arguments
+        """
+        return [(function, task, self.folder) for task in tasks]
+
+    def save(self, file, top=40):
+        """
+        Merge the statistics of the profiled tasks and save them, as a binary profile
+        (readable with pstats) and as a text report of the most expensive functions
+
+        Args:
+            file: path of the profile, without extension (.prof and .txt are added)
+            top: number of functions listed in the text report
+        """
+        profiles = sorted(glob.glob(os.path.join(self.folder, '*.prof')))
+        if profiles:
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(file + '.prof')
+            with open(file + '.txt', 'w') as f:
+                stats.stream = f
+                stats.sort_stats('cumulative').print_stats(top)
+        shutil.rmtree(self.folder, ignore_errors=True)
@@ -0,0 +1,124 @@
+import json
+import time
+import sqlite3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS config (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS generations (
+    generation INTEGER PRIMARY KEY,
+    map TEXT,
+    agents INTEGER,
+    best_fitness REAL,
+    mean_fitness REAL,
+    benchmark_best_fitness REAL,
+    benchmark_mean_fitness REAL,
+    best_genome INTEGER,
+    duration REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS genomes (
+    generation INTEGER,
+    genome_id INTEGER,
+    fitness REAL,
+    map TEXT,
+    archive_offset INTEGER,
+    PRIMARY KEY (generation, genome_id)
+);
+CREATE INDEX IF NOT EXISTS genomes_fitness ON genomes (fitness);
+"""
+
+class RunManifest:
+    """
+    Small SQLite database describing a run: its configuration, a summary of each
+    generation and the offsets of the genomes in the genome archive. It is updated at
+    each generation, so that the results of a run are read with a few indexed queries
+    instead of listing and parsing the saved files.
+    """
+    def __init__(self, file, new=False):
+        """
+        Open the manifest of a run, creating it if it does not exist
+
+        Args:
+            file: path of the database file
+            new: If True, the content of an existing manifest is removed (new run in the same folder)
+        """
+        self.connection = sqlite3.connect(file)
+        if new:
+            self.connection.executescript('DROP TABLE IF EXISTS config; DROP TABLE IF EXISTS generations; DROP TABLE IF EXISTS genomes;')
+        self.connection.executescript(_SCHEMA)
+
+    def set_config(self, config):
+        """
+        Save the configuration of the run
+
+        Args:
+            config: dictionary {parameter name: value}, the values which are not JSON values being saved as strings
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM config')
+            self.connection.executemany('INSERT INTO config VALUES (?, ?)',
+                [(name, json.dumps(value, default=lambda value: getattr(value, '__dict__', str(value)))) for name, value in config.items()])
+
+    def config(self):
+        """
+        Get the configuration of the run as a dictionary {parameter name: value}
+        """
+        return {name: json.loads(value) for name, value in self.connection.execute('SELECT name, value FROM config')}
+
+    def add_generation(self, generation, map_name, fitnesses, genome_ids, benchmark_fitnesses=None, duration=None, entries=()):
+        """
+        Save the summary of a generation, replacing the previous one if the generation is evaluated again
+
+        Args:
+            generation: current generation
+            map_name: name of the training map
+            fitnesses: list of the training fitness of each genome
+            genome_ids: list of the id of each genome
+            benchmark_fitnesses: list of the benchmark fitness of each genome (None without benchmark)
+            duration: wall time of the generation (s)
+            entries: ArchiveEntry of the genomes written to the genome archive since the last generation
+        """
+        best = max(range(len(fitnesses)), key=lambda i: fitnesses[i])
+        benchmark = (max(benchmark_fitnesses), sum(benchmark_fitnesses) / len(benchmark_fitnesses)) if benchmark_fitnesses else (None, None)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (generation, map_name, len(fitnesses), max(fitnesses), sum(fitnesses) / len(fitnesses),
+                 benchmark[0], benchmark[1], genome_ids[best], duration, time.time()))
+            self.add_entries(entries)
+
+    def add_entries(self, entries):
+        """
+        Save the offsets of genomes written to the genome archive
+
+        Args:
+            entries: list of ArchiveEntry
+        """
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO genomes VALUES (?, ?, ?, ?, ?)',
+                [(entry.generation, entry.genome_id, entry.fitness, entry.map_name, entry.offset) for entry in entries])
+
+    def generations(self):
+        """
+        Get the summary of each generation, as a list of dictionaries sorted by generation
+        """
+        cursor = self.connection.execute('SELECT * FROM generations ORDER BY generation')
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def best_fitness(self):
+        """
+        Get the best fitness saved for the genomes of the run (the benchmark fitness if any)
+        """
+        return self.connection.execute('SELECT MAX(COALESCE(benchmark_best_fitness, best_fitness)) FROM generations').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,6 +1,9 @@
 import os
 import pickle
 import neat
+from brain.compiled_network import CompiledNetwork
+from brain.archive import GenomeArchive
+from brain.steady_state import SteadyStateEvolution
 
 class NeatAlgorithm:
     """
@@ -32,12 +35,18 @@ class NeatAlgorithm:
             # Find the checkpoint file
             checkpoint_file = os.path.join(local_dir, checkpoint)
             
-            # Load the population from the checkpoint
-            try:
-                with open(checkpoint_file, 'rb') as f:
-                    self.best = pickle.load(f)
-            except:
-                raise Exception('Could not load checkpoint file. File not found or invalid format.')
+            if checkpoint_file.endswith('.archive'):
+                # Load the best genome of a run archive
+                with GenomeArchive(checkpoint_file) as archive:
+                    entry = archive.best()
+                    self.best = archive.load(entry.generation, entry.genome_id)
+            else:
+                # Load the population from the checkpoint
+                try:
+                    with open(checkpoint_file, 'rb') as f:
+                        self.best = pickle.load(f)
+                except:
+                    raise Exception('Could not load checkpoint file. File not found or invalid format.')
         
         
     def run(self, fitness_function, generations):
@@ -55,6 +64,25 @@ class NeatAlgorithm:
             best: best genome found during the run
         """
         return self.population.run(fitness_function, generations)
+    
+    def run_steady_state(self, evaluate, set_result, generations, in_flight, end_generation=None):
+        """
+        Run the NEAT algorithm without generation barrier: each evaluated genome replaces the
+        worst one of the population and a new offspring is evaluated (see brain.steady_state)
+        
+        Args:
+            evaluate: function evaluate(genome, done) starting the evaluation of a genome, done(result)
+                      being called with its result (or done(None, error) on failure)
+            set_result: function set_result(genome, result) setting the fitness of an evaluated genome
+            generations: number of generations to run, a generation being pop_size evaluations
+            in_flight: number of genomes kept under evaluation
+            end_generation: function called with the (genome_id, genome) evaluated in each generation
+            
+        Returns:
+            best: best genome found during the run
+        """
+        evolution = SteadyStateEvolution(self.population, in_flight)
+        return evolution.run(evaluate, set_result, generations * self.config.pop_size, end_generation)
         
         
     def create_network(self, genome):
@@ -66,6 +94,16 @@ class NeatAlgorithm:
         """
         return neat.nn.FeedForwardNetwork.create(genome, self.config)
     
+    def compile_network(self, genome):
+        """
+        Create a feed-forward network compiled into NumPy arrays from the given genome,
+        which can be evaluated on batches of inputs (see brain.compiled_network)
+        
+        Args:
+            genome: genome to create the network
+        """
+        return CompiledNetwork.create(genome, self.config)
+    
     def save_genome(self, filename, genome):
         """
         Save a genome to a file
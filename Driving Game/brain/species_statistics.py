@@ -0,0 +1,122 @@
+import os
+import json
+import numpy as np
+
+# Columns of the species statistics, one row per agent and generation
+COLUMNS = {
+    'generation': np.int32,
+    'species': np.int32,
+    'agent': np.int64,
+    'fitness': np.float64,
+    'termination': np.int8,
+}
+
+class SpeciesStatistics:
+    """
+    Columnar store of the species statistics: a folder holding one binary file of typed
+    values per column, the rows of a generation being appended at the end of each file.
+    A column is read back with a single np.fromfile, without any parsing.
+    """
+    def __init__(self, folder):
+        """
+        Args:
+            folder: path of the folder of the store
+        """
+        self.folder = folder
+
+    def column_file(self, name):
+        """
+        Path of the file of a column
+
+        Args:
+            name: name of the column
+        """
+        return os.path.join(self.folder, name + '.bin')
+
+    def append(self, columns, reset=False):
+        """
+        Append rows to the store
+
+        Args:
+            columns: dictionary {column name: values}, all the columns having the same length
+            reset: If True, the existing rows are removed first (first generation of a run)
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        if reset or not os.path.exists(os.path.join(self.folder, 'columns.json')):
+            with open(os.path.join(self.folder, 'columns.json'), 'w') as f:
+                json.dump({name: np.dtype(dtype).str for name, dtype in COLUMNS.items()}, f)
+        for name, dtype in COLUMNS.items():
+            with open(self.column_file(name), 'wb' if reset else 'ab') as f:
+                np.asarray(columns[name], dtype=dtype).tofile(f)
+
+    def read(self):
+        """
+        Read all the rows of the store
+
+        Returns:
+            dictionary {column name: array of the values}
+        """
+        with open(os.path.join(self.folder, 'columns.json'), 'r') as f:
+            dtypes = json.load(f)
+        columns = {name: np.fromfile(self.column_file(name), dtype=np.dtype(dtype)) for name, dtype in dtypes.items()}
+
+        # Drop the rows of a generation whose writing was interrupted
+        rows = min(len(values) for values in columns.values())
+        return {name: values[:rows] for name, values in columns.items()}
+
+def load_species_statistics(folder):
+    """
+    Read the species statistics of a run, from the columnar store or from the species.csv
+    file of the older runs
+
+    Args:
+        folder: path of the run folder
+
+    Returns:
+        dictionary {column name: array of the values}
+    """
+    store = SpeciesStatistics(os.path.join(folder, 'species'))
+    if os.path.exists(os.path.join(store.folder, 'columns.json')):
+        return store.read()
+
+    data = np.loadtxt(os.path.join(folder, 'species.csv'), delimiter=',', ndmin=2)
+    columns = {name: data[:, i].astype(dtype) for i, (name, dtype) in enumerate(COLUMNS.items()) if i < data.shape[1]}
+    return columns
+
+def group_max(keys, values):
+    """
+    Maximum of the values of each group of rows sharing the same integer keys, computed by
+    sorting the rows on a single key combining all the keys
+
+    Args:
+        keys: list of the integer arrays of the keys, the groups being sorted by the first key, then the second...
+        values: array of the values
+
+    Returns:
+        list of the arrays of the keys of each group
+        array of the maximum value of each group
+    """
+    if len(values) == 0:
+        return [key[:0] for key in keys], values[:0]
+
+    # Combine the keys into one, as the digits of a number
+    lows = [int(key.min()) for key in keys]
+    spans = [int(key.max()) - low + 1 for key, low in zip(keys, lows)]
+    combined = np.zeros(len(values), dtype=np.int64)
+    for key, low, span in zip(keys, lows, spans):
+        combined *= span
+        combined += key - low
+
+    # Sort the rows and reduce each run of equal keys
+    order = np.argsort(combined)
+    combined = combined[order]
+    starts = np.flatnonzero(np.concatenate([[True], combined[1:] != combined[:-1]]))
+    maxima = np.maximum.reduceat(values[order], starts)
+
+    # Split the combined key of each group back into the keys
+    group_keys = []
+    combined = combined[starts]
+    for key, low, span in zip(keys[::-1], lows[::-1], spans[::-1]):
+        group_keys.insert(0, (combined % span + low).astype(key.dtype))
+        combined = combined // span
+    return group_keys, maxima
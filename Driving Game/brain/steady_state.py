@@ -0,0 +1,196 @@
+import queue
+import random
+from neat.species import Species
+
+class SteadyStateEvolution:
+    """
+    Asynchronous steady-state evolution of a NEAT population, in the style of rtNEAT
+    (Stanley et al., 2005). There is no generation barrier: the genomes are evaluated
+    continuously, and as soon as a genome is evaluated it joins the population, the worst
+    genome (by adjusted fitness) is removed, and a new offspring is bred and sent to
+    evaluation. The workers therefore never wait for the slowest genome of a generation.
+    The population, species set and reproduction of a neat.Population are reused, so
+    that the reporters and the statistics work as in the generational algorithm, a
+    "generation" being a window of pop_size evaluations.
+    """
+    def __init__(self, population, in_flight):
+        """
+        Args:
+            population: neat.Population to evolve (its genomes are evaluated first)
+            in_flight: number of genomes kept under evaluation, at least the number of workers
+        """
+        self.population = population
+        self.config = population.config
+        self.in_flight = in_flight
+        self.members = {} # genome id -> evaluated genome of the population
+        self.pending = {} # genome id -> genome under evaluation
+
+        # The species are rebuilt incrementally as the genomes are evaluated
+        self.species_set = population.species
+        self.species_set.species = {}
+        self.species_set.genome_to_species = {}
+
+    def run(self, evaluate, set_result, evaluations, end_generation=None):
+        """
+        Evolve the population
+
+        Args:
+            evaluate: function evaluate(genome, done) starting the evaluation of a genome, done(result)
+                      being called with its result (or done(None, error) on failure) from any thread
+            set_result: function set_result(genome, result) setting the fitness of an evaluated genome
+            evaluations: number of genomes to evaluate
+            end_generation: function end_generation(genomes) called every pop_size evaluations with the
+                            list of the (genome_id, genome) evaluated since the last call
+
+        Returns:
+            best: best genome found during the run
+        """
+        results = queue.Queue()
+        def submit(genome_id, genome):
+            self.pending[genome_id] = genome
+            evaluate(genome, lambda result, error=None: results.put((genome_id, result, error)))
+
+        # Evaluate the initial population
+        pop_size = self.config.pop_size
+        initial = list(self.population.population.items())
+        for genome_id, genome in initial:
+            submit(genome_id, genome)
+
+        evaluated = 0
+        window = []
+        self.population.reporters.start_generation(self.population.generation)
+        while evaluated < evaluations:
+            genome_id, result, error = results.get()
+            if error is not None:
+                raise error
+            genome = self.pending.pop(genome_id)
+            set_result(genome, result)
+            self.insert(genome_id, genome)
+            evaluated += 1
+            window.append((genome_id, genome))
+
+            if len(window) == pop_size:
+                self.end_generation(window, end_generation)
+                window = []
+                if evaluated < evaluations:
+                    self.population.reporters.start_generation(self.population.generation)
+
+            # Keep the workers busy with new offspring
+            while len(self.pending) < self.in_flight and evaluated + len(self.pending) < evaluations and self.members:
+                submit(*self.breed())
+
+        # The genomes still under evaluation are dropped
+        self.population.population = dict(self.members)
+        return self.population.best_genome
+
+    def end_generation(self, window, end_generation):
+        """
+        Report a window of pop_size evaluations as a generation
+
+        Args:
+            window: list of the (genome_id, genome) evaluated in the window
+            end_generation: function called with the window (None for no function)
+        """
+        population = self.population
+        population.population = dict(self.members)
+        if end_generation is not None:
+            end_generation(window)
+        best = max(self.members.values(), key=lambda genome: genome.fitness)
+        population.reporters.post_evaluate(self.config, population.population, self.species_set, best)
+        population.reporters.end_generation(self.config, population.population, self.species_set)
+        population.generation += 1
+
+    def insert(self, genome_id, genome):
+        """
+        Add an evaluated genome to the population and to its species, removing the worst
+        genome if the population is full
+
+        Args:
+            genome_id: id of the genome
+            genome: the evaluated genome
+        """
+        population = self.population
+        if population.best_genome is None or genome.fitness > population.best_genome.fitness:
+            population.best_genome = genome
+
+        self.members[genome_id] = genome
+        self.speciate(genome_id, genome)
+        if len(self.members) > self.config.pop_size:
+            self.remove(self.worst())
+
+    def speciate(self, genome_id, genome):
+        """
+        Put a genome in the species with the closest representative, or in a new species
+        if no representative is compatible
+
+        Args:
+            genome_id: id of the genome
+            genome: the genome
+        """
+        genome_config = self.config.genome_config
+        threshold = self.config.species_set_config.compatibility_threshold
+        candidates = [(genome.distance(species.representative, genome_config), species_id)
+                      for species_id, species in self.species_set.species.items()]
+        distance, species_id = min(candidates, default=(None, None))
+        if species_id is None or distance >= threshold:
+            species_id = next(self.species_set.indexer)
+            self.species_set.species[species_id] = Species(species_id, self.population.generation)
+            self.species_set.species[species_id].update(genome, {})
+
+        species = self.species_set.species[species_id]
+        species.members[genome_id] = genome
+        self.species_set.genome_to_species[genome_id] = species_id
+        if species.fitness is None or genome.fitness > species.fitness:
+            species.fitness = genome.fitness
+            species.last_improved = self.population.generation
+
+    def worst(self):
+        """
+        Get the id of the genome with the lowest adjusted fitness (its fitness divided by the
+        size of its species), the best genome being kept
+        """
+        best = self.population.best_genome
+        sizes = {species_id: len(species.members) for species_id, species in self.species_set.species.items()}
+        candidates = [genome_id for genome_id, genome in self.members.items() if genome is not best]
+        return min(candidates, key=lambda genome_id: self.members[genome_id].fitness / sizes[self.species_set.genome_to_species[genome_id]])
+
+    def remove(self, genome_id):
+        """
+        Remove a genome from the population and from its species
+
+        Args:
+            genome_id: id of the genome
+        """
+        genome = self.members.pop(genome_id)
+        species_id = self.species_set.genome_to_species.pop(genome_id)
+        species = self.species_set.species[species_id]
+        del species.members[genome_id]
+        if not species.members:
+            del self.species_set.species[species_id]
+        elif species.representative is genome:
+            species.representative = next(iter(species.members.values()))
+
+    def breed(self):
+        """
+        Create an offspring: its species is chosen with a probability proportional to the mean
+        fitness of the species, and its parents among the best members of the species
+
+        Returns:
+            tuple (genome_id, genome) of the offspring
+        """
+        species = list(self.species_set.species.values())
+        weights = [max(0.0, sum(genome.fitness for genome in s.members.values()) / len(s.members)) + 1e-6 for s in species]
+        parent_species = random.choices(species, weights)[0]
+
+        # Keep the best members of the species as parents
+        members = sorted(parent_species.members.items(), key=lambda item: item[1].fitness, reverse=True)
+        survivors = members[:max(2, int(round(self.config.reproduction_config.survival_threshold * len(members))))]
+        (parent1_id, parent1), (parent2_id, parent2) = random.choice(survivors), random.choice(survivors)
+
+        reproduction = self.population.reproduction
+        genome_id = next(reproduction.genome_indexer)
+        child = self.config.genome_type(genome_id)
+        child.configure_crossover(parent1, parent2, self.config.genome_config)
+        child.mutate(self.config.genome_config)
+        reproduction.ancestors[genome_id] = (parent1_id, parent2_id)
+        return genome_id, child
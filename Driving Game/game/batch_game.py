@@ -0,0 +1,113 @@
+import numpy as np
+from game.collision import wall_collisions
+from game.player import Player
+from game.sensors import get_inputs_batch
+
+class BatchGame:
+    """
+    Game instance simulating a whole population of cars on the same grid.
+    The state of the cars is stored as arrays (one entry per car) so that all
+    the cars still running are advanced with a single vectorized step.
+    """
+    def __init__(self, grid, player_pos, count, dt=0.01, substeps=1):
+        """
+        Initialize a batch of games without graphics
+
+        Args:
+            grid: the grid instance
+            player_pos: initial position of every car
+            count: number of cars to simulate
+            dt: time step
+            substeps: number of physics steps (and collision checks) in a time step
+        """
+        # Game current status
+        self.count = count
+        self.game_over = np.zeros(count, dtype=bool)
+        self.dt = dt
+        self.substeps = substeps
+
+        # Initialize game state
+        self.grid = grid
+
+        # Reference player holding the physical car performance shared by all cars
+        self.player = Player(player_pos)
+
+        # Cars state
+        self.pos = np.tile(np.array([player_pos[0], player_pos[1]], dtype=float), (count, 1))
+        self.vel = np.zeros(count) # forward velocity, the cars never move sideways
+        self.rot = np.zeros(count)
+        self.distance = np.zeros(count)
+        self.time = np.zeros(count)
+
+    def update(self, acc, steer):
+        """
+        Tick for every car still running, crashed cars are left untouched
+
+        Args:
+            acc: acceleration to apply to each car (array of size count)
+            steer: steering angle to apply to each car (array of size count)
+        """
+        for _ in range(self.substeps):
+            self.step(self.dt / self.substeps, acc, steer)
+
+    def step(self, dt, acc, steer):
+        """
+        Physics step for every car still running
+
+        Args:
+            dt: duration of the step
+            acc: acceleration to apply to each car (array of size count)
+            steer: steering angle to apply to each car (array of size count)
+        """
+        alive = ~self.game_over
+        if not np.any(alive):
+            return
+        p = self.player
+        vel = self.vel[alive]
+        rot = self.rot[alive]
+
+        # Compute the maximum steering angle based on the velocity
+        max_steer = np.maximum(0, p.max_steer - np.abs(vel) / p.max_vel * p.max_steer * 0.8)
+
+        # Limit the acceleration and steering
+        acc = np.clip(np.asarray(acc, dtype=float)[alive] * p.acc_mult, -p.brake_acc, p.max_acc)
+        steer = np.clip(np.asarray(steer, dtype=float)[alive] * p.steer_mult, -max_steer, max_steer)
+
+        # Add a bit of friction
+        acc = np.where(acc == 0, acc - vel * p.friction * dt, acc)
+
+        # Update and limit the linear velocity
+        vel = np.clip(vel + acc * dt, 0, p.max_vel)
+
+        # Compute the angular velocity of the turning cars
+        with np.errstate(divide='ignore'):
+            turning_radius = p.height / np.sin(steer)
+            angular_vel = np.where(steer != 0, vel / turning_radius, 0.0)
+
+        # Update the position and rotation
+        self.pos[alive] += np.stack([vel * np.cos(rot) * dt, vel * np.sin(rot) * dt], axis=1)
+        self.rot[alive] = rot + angular_vel * dt
+        self.vel[alive] = vel
+
+        # Update the distance
+        self.distance[alive] += vel * dt
+        self.time[alive] += dt
+
+        # Check for circuit collisions
+        collided, self.grid.red_cells = wall_collisions(self.grid, self.pos[alive], self.rot[alive], p.width, p.height)
+        self.game_over[alive] = collided
+
+    def get_inputs(self, ray_count):
+        """
+        Get the inputs for the NEAT networks, one row (vel_x, ray_distance_1, ..., ray_distance_n) per car
+
+        Args:
+            ray_count: number of rays to cast (uniformly distributed in the player's field of view)
+        """
+        return get_inputs_batch(self.grid, self.pos, self.vel, self.rot, ray_count, self.player)
+
+    def get_fitness_parameters(self):
+        """
+        Get the fitness parameters for the NEAT algorithm (distance, time) as arrays over the cars
+        """
+        return self.distance, self.time
@@ -1,5 +1,75 @@
 import pygame
 import numpy as np
+from game.sensors import cast_rays, ray_directions
+
+class GridTiles:
+    """
+    Static rendering of the walls of a grid, cached in tiles: a tile is rendered once,
+    by scaling the pixels of the grid cells, the first time it is visible, and the tiles
+    are dropped when the scale of the view (the zoom) changes. Drawing the grid is then
+    a few blits per frame, whatever the size of the grid.
+    """
+    TILE_SIZE = 256
+
+    def __init__(self, grid):
+        """
+        Args:
+            grid: the grid to display
+        """
+        # One pixel per cell, white for the walls and black for the free cells
+        colors = np.where(grid.grid[..., None] != 0, 255, 0).astype(np.uint8).repeat(3, axis=2)
+        self.cells = pygame.surfarray.make_surface(colors)
+        self.grid_size = grid.GRID_SIZE
+        self.scale = None
+        self.tiles = {}
+
+    def draw(self, screen, origin, scale):
+        """
+        Draw the grid
+
+        Args:
+            screen: the surface to draw on
+            origin: position on the screen of the grid corner (0, 0)
+            scale: size of the grid on the screen (pixels)
+        """
+        if scale != self.scale:
+            self.scale = scale
+            self.tiles = {}
+
+        # Draw the visible tiles
+        size = GridTiles.TILE_SIZE
+        tile_count = int(np.ceil(scale / size))
+        first = [max(0, int(np.floor(-origin[k] / size))) for k in range(2)]
+        last = [min(tile_count - 1, int(np.floor((screen.get_size()[k] - origin[k]) / size))) for k in range(2)]
+        for i in range(first[0], last[0] + 1):
+            for j in range(first[1], last[1] + 1):
+                if (i, j) not in self.tiles:
+                    self.tiles[(i, j)] = self.render_tile(i, j)
+                screen.blit(self.tiles[(i, j)], (int(round(origin[0])) + i * size, int(round(origin[1])) + j * size))
+
+    def render_tile(self, i, j):
+        """
+        Render a tile of the grid at the current scale
+
+        Args:
+            i: column of the tile
+            j: row of the tile
+        """
+        size = GridTiles.TILE_SIZE
+        cell = self.scale / self.grid_size
+        tile = pygame.Surface((size, size))
+        tile.fill("white")
+
+        # Cells covering the tile, scaled and positioned at the pixel of their first cell
+        first = [int(np.floor(k * size / cell)) for k in (i, j)]
+        last = [min(self.grid_size, int(np.ceil((k + 1) * size / cell))) for k in (i, j)]
+        if last[0] <= first[0] or last[1] <= first[1]:
+            return tile
+        start = [int(round(first[k] * cell)) - (i, j)[k] * size for k in range(2)]
+        stop = [int(round(last[k] * cell)) - (i, j)[k] * size for k in range(2)]
+        cells = self.cells.subsurface((first[0], first[1], last[0] - first[0], last[1] - first[1]))
+        tile.blit(pygame.transform.scale(cells, (max(1, stop[0] - start[0]), max(1, stop[1] - start[1]))), start)
+        return tile
 
 class MapCamera:
     """
@@ -14,28 +84,22 @@ class MapCamera:
         self.grid = grid
         self.player = player
         self.ZOOM = 1.0
+        self.tiles = GridTiles(grid)
         
-    def draw(self, screen):
+    def draw(self, screen, snapshot=None):
         """
         Draw the grid and the player
+        
+        Args:
+            screen: the surface to draw on
+            snapshot: latest Snapshot of the game simulated in another thread (see game.simulation), None if none
         """
         # Get view size
         view_size = (screen.get_width(), screen.get_height())
         view_range = min(view_size) * self.ZOOM
         
         # Draw grid
-        off = 0.01
-        for x in range(self.grid.GRID_SIZE):
-            for y in range(self.grid.GRID_SIZE):
-                if self.grid.grid[x, y] == 0:
-                    x0 = x / self.grid.GRID_SIZE
-                    y0 = y / self.grid.GRID_SIZE
-                    x1 = (x + 1) / self.grid.GRID_SIZE
-                    y1 = (y + 1) / self.grid.GRID_SIZE
-                    pygame.draw.rect(screen, "black", (
-                        MapCamera._xy_to_screen(view_size, (x0 - off, y0 - off), view_range),
-                        MapCamera._xy_to_screen(view_size, ((x1 - x0) + off, (y1 - y0) + off), view_range, absolute=True)
-                    ))
+        self.tiles.draw(screen, MapCamera._xy_to_screen(view_size, (0, 0), view_range), view_range)
                     
         # Draw max range of the grid
         grid_min = MapCamera._xy_to_screen(view_size, (0, 0), view_range)
@@ -105,39 +169,22 @@ class PlayerCamera:
         self.player = player
         self.ZOOM = 8.0
         self.player_size = 0.05
+        self.tiles = GridTiles(grid)
         
-    def draw(self, screen):
+    def draw(self, screen, snapshot=None):
         """
         Draw the grid and the player
+        
+        Args:
+            screen: the surface to draw on
+            snapshot: latest Snapshot of the game simulated in another thread (see game.simulation), None if none
         """
         # Get view size
         view_size = (screen.get_width(), screen.get_height())
         
-        # Compute the view extent (implement basic clipping for the grid)
+        # Draw grid (only the tiles in the view)
         view_range = self.ZOOM
-        screen_min = PlayerCamera._screen_to_xy(view_size, (-view_size[0]*0.2, -view_size[1]*0.2), view_range, self.player.pos)
-        screen_max = PlayerCamera._screen_to_xy(view_size, (view_size[0]*1.2, view_size[1]*1.2), view_range, self.player.pos)
-        extend = (max(0, screen_min[0]), min(1, screen_max[0]), max(0, screen_min[1]), min(1, screen_max[1]))
-        
-        # Draw grid
-        off = 0.01
-        grid_min_i = (int(extend[0] * self.grid.GRID_SIZE), int(extend[2] * self.grid.GRID_SIZE))
-        grid_max_i = (int(extend[1] * self.grid.GRID_SIZE), int(extend[3] * self.grid.GRID_SIZE))
-        for i in range(grid_min_i[0], grid_max_i[0]):
-            for j in range(grid_min_i[1], grid_max_i[1]):
-                if i >= 0 and i < self.grid.GRID_SIZE and j >= 0 and j < self.grid.GRID_SIZE:
-                    color = "black"
-                    if self.grid.grid[i, j] != 0:
-                        color = "white"
-                    x0 = i / self.grid.GRID_SIZE
-                    y0 = j / self.grid.GRID_SIZE
-                    x1 = (i + 1) / self.grid.GRID_SIZE
-                    y1 = (j + 1) / self.grid.GRID_SIZE
-                    
-                    pygame.draw.rect(screen, color, (
-                        PlayerCamera._xy_to_screen(view_size, (x0 - off, y0 - off), view_range, self.player.pos),
-                        PlayerCamera._xy_to_screen(view_size, (x1 - x0 + off, y1 - y0 + off), view_range, self.player.pos, absolute=True)
-                    ))
+        self.tiles.draw(screen, PlayerCamera._xy_to_screen(view_size, (0, 0), view_range, self.player.pos), min(view_size) * view_range)
                     
         # Draw max range of the grid
         grid_min = PlayerCamera._xy_to_screen(view_size, (0, 0), view_range, self.player.pos)
@@ -151,29 +198,28 @@ class PlayerCamera:
         )
         pygame.draw.arc(screen, "red", player_rect, -self.player.rot - self.player.fov / 2, -self.player.rot + self.player.fov / 2, 2)
         
-        # Draw n rays
-        ray_count = 5
-        for i in range(ray_count):
-            # Compute ray direction
-            angle = self.player.rot + (i - ray_count // 2) * self.player.fov / ray_count
-            ray_dir = np.array([np.cos(angle), np.sin(angle)])
+        # Draw the wall cells hit by the player
+        if snapshot is not None:
+            cell = 1 / self.grid.GRID_SIZE
+            for x, y in snapshot.red_cells:
+                pygame.draw.rect(screen, "red", (
+                    PlayerCamera._xy_to_screen(view_size, (x * cell, y * cell), view_range, self.player.pos),
+                    PlayerCamera._xy_to_screen(view_size, (cell, cell), view_range, self.player.pos, absolute=True)
+                ))
+        
+        # Draw n rays, green when they hit a wall (the rays seen by the simulated player, if known)
+        if snapshot is not None and snapshot.rays is not None:
+            distances, hits = snapshot.rays
+        else:
+            distances, hits = cast_rays(self.grid, self.player.pos, self.player.rot, 5, self.player.fov, self.player.view_distance, self.player.wall_dx, return_hits=True)
+            distances, hits = distances[0], hits[0]
+        angles = ray_directions([self.player.rot], len(distances), self.player.fov)[0]
+        for angle, distance, hit in zip(angles, distances, hits):
+            ray_pos = self.player.pos + distance * np.array([np.cos(angle), np.sin(angle)])
             
-            # Compute the distance to the nearest wall
-            distance = 0
-            color = "red"
-            while True:
-                if distance + self.player.wall_dx > self.player.view_distance:
-                    break
-                distance += self.player.wall_dx
-                ray_pos = self.player.pos + distance * ray_dir
-                (grid_x, grid_y) = (np.round(ray_pos[0] * self.grid.grid.shape[0]), np.round(ray_pos[1] * self.grid.grid.shape[1]))
-                if self.grid.grid[int(grid_x) + 2, int(grid_y) + 2] == 1:
-                    color = "green"
-                    break
-                
             # Draw the ray
             ray_pos = PlayerCamera._xy_to_screen(view_size, ray_pos, view_range, self.player.pos)
-            pygame.draw.line(screen, color, PlayerCamera._xy_to_screen(view_size, self.player.pos, view_range, self.player.pos), ray_pos)
+            pygame.draw.line(screen, "green" if hit else "red", PlayerCamera._xy_to_screen(view_size, self.player.pos, view_range, self.player.pos), ray_pos)
             
         
         # Draw the player at center
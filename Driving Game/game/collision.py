@@ -0,0 +1,111 @@
+import numpy as np
+
+def car_corners(pos, rot, width, height):
+    """
+    Compute the four corners of each car rectangle
+
+    Args:
+        pos: (array) position of each car : shape = (cars, 2)
+        rot: (array) rotation of each car : shape = (cars,)
+        width: car width
+        height: car height
+
+    Returns:
+        array of the corners (front left, front right, back right, back left) : shape = (cars, 4, 2)
+    """
+    center, forward, left = _car_frame(pos, rot, width, height)
+    return _frame_corners(center, forward, left, width, height)
+
+def wall_collisions(grid, pos, rot, width, height):
+    """
+    Test the rotated rectangle of each car against every wall cell of its bounding box
+    at once, using the separating axis theorem (the car and cell overlap unless their
+    projections are disjoint on one of the axes x, y, forward or left). The cars whose
+    bounding box is in empty blocks of the grid pyramid are not tested. If the grid has
+    the segments of the walls, the cars are tested against them instead (see game.walls).
+
+    Args:
+        grid: the grid instance
+        pos: (array) position of each car : shape = (cars, 2)
+        rot: (array) rotation of each car : shape = (cars,)
+        width: car width
+        height: car height
+
+    Returns:
+        boolean array of the cars hitting a wall : shape = (cars,)
+        list of the (x, y) wall cells hit by the cars
+    """
+    center, forward, left = _car_frame(pos, rot, width, height)
+    size = grid.GRID_SIZE
+    half_cell = 0.5 / size
+
+    # Exact test against the segments, the cells of the segments hit being the red cells
+    if getattr(grid, 'walls', None) is not None:
+        collided, segments = grid.walls.collisions(center, forward, left, width, height)
+        middles = grid.walls.segments[segments]
+        cells = np.floor((middles[:, :2] + middles[:, 2:]) / 2 * size).astype(int)
+        return collided, list(zip(cells[:, 0].tolist(), cells[:, 1].tolist()))
+
+    # Bounding box of the cars in cells
+    corners = _frame_corners(center, forward, left, width, height)
+    min_cell = np.floor(corners.min(axis=1) * size).astype(int)
+    max_cell = np.floor(corners.max(axis=1) * size).astype(int)
+    
+    # Only test the cars which may be near a wall
+    collided = np.zeros(len(center), dtype=bool)
+    near = np.flatnonzero(grid.any_wall(min_cell, max_cell))
+    if len(near) == 0:
+        return collided, []
+    center, forward, left, min_cell, max_cell = center[near], forward[near], left[near], min_cell[near], max_cell[near]
+
+    # Candidate cells in a fixed window covering any bounding box : shape = (cars, window, window)
+    window = int(np.ceil(np.hypot(width, height) * size)) + 2
+    cells_x = min_cell[:, 0, None, None] + np.arange(window)[None, :, None]
+    cells_y = min_cell[:, 1, None, None] + np.arange(window)[None, None, :]
+    inside = (cells_x <= max_cell[:, 0, None, None]) & (cells_y <= max_cell[:, 1, None, None]) & \
+             (cells_x >= 0) & (cells_x < grid.grid.shape[0]) & (cells_y >= 0) & (cells_y < grid.grid.shape[1])
+    walls = inside & grid.grid[np.where(inside, cells_x, 0), np.where(inside, cells_y, 0)]
+
+    # Offset from the car center to the cell centers
+    dx = (cells_x + 0.5) / size - center[:, 0, None, None]
+    dy = (cells_y + 0.5) / size - center[:, 1, None, None]
+
+    # Separating axes of the cells (x and y)
+    extent_x = (np.abs(forward[:, 0]) * height / 2 + np.abs(left[:, 0]) * width / 2)[:, None, None]
+    extent_y = (np.abs(forward[:, 1]) * height / 2 + np.abs(left[:, 1]) * width / 2)[:, None, None]
+    overlap = (np.abs(dx) <= extent_x + half_cell) & (np.abs(dy) <= extent_y + half_cell)
+
+    # Separating axes of the car (forward and left)
+    cell_forward = ((np.abs(forward[:, 0]) + np.abs(forward[:, 1])) * half_cell)[:, None, None]
+    cell_left = ((np.abs(left[:, 0]) + np.abs(left[:, 1])) * half_cell)[:, None, None]
+    overlap &= np.abs(dx * forward[:, 0, None, None] + dy * forward[:, 1, None, None]) <= height / 2 + cell_forward
+    overlap &= np.abs(dx * left[:, 0, None, None] + dy * left[:, 1, None, None]) <= width / 2 + cell_left
+
+    hits = walls & overlap
+    red_cells = list(zip(np.broadcast_to(cells_x, hits.shape)[hits].tolist(), np.broadcast_to(cells_y, hits.shape)[hits].tolist()))
+    collided[near] = np.any(hits, axis=(1, 2))
+    return collided, red_cells
+
+def _car_frame(pos, rot, width, height):
+    """
+    Compute the center and the forward and left directions of each car
+
+    Args:
+        pos: (array) position of each car : shape = (cars, 2)
+        rot: (array) rotation of each car : shape = (cars,)
+        width: car width
+        height: car height
+    """
+    pos = np.asarray(pos, dtype=float).reshape(-1, 2)
+    rot = np.reshape(rot, -1).astype(float)
+    forward = np.stack([np.cos(rot), np.sin(rot)], axis=1)
+    left = np.stack([np.cos(rot + np.pi / 2), np.sin(rot + np.pi / 2)], axis=1)
+    center = pos + np.array([width, height / 2])
+    return center, forward, left
+
+def _frame_corners(center, forward, left, width, height):
+    """
+    Compute the corners (front left, front right, back right, back left) of each car from its frame
+    """
+    signs = np.array([[1, 1], [1, -1], [-1, -1], [-1, 1]])
+    return center[:, None, :] + signs[None, :, 0, None] * forward[:, None, :] * height / 2 + signs[None, :, 1, None] * left[:, None, :] * width / 2
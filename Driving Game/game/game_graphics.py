@@ -3,6 +3,7 @@ import time
 from game.cameras import MapCamera, PlayerCamera
 from game.display import Display
 from game.game import Game
+from game.simulation import SPEEDS
 import numpy as np
 
 class GameGraphics(Game):
@@ -30,6 +31,92 @@ class GameGraphics(Game):
         self.acc = 0.0
         self.steer = 0.0
         
+        # Replay of recorded trajectories (see replay)
+        self.trajectories = None
+        self.replay_agent = 0
+        self.replay_time = 0.0
+        self.replay_speed = 1.0
+        self.replay_paused = False
+        self.last_replay_key = 0
+        
+        # Game simulated in another thread (see follow)
+        self.simulation = None
+        self.snapshot = None
+        self.keyboard = False
+        self.display_rate = None
+        self.frame_clock = pygame.time.Clock()
+        self.last_speed_change = 0
+        
+    def follow(self, simulation, keyboard=False, display_rate=60):
+        """
+        Render a game simulated in another thread instead of simulating the player: the player
+        is moved to the latest snapshot of the simulation at each frame, the simulation running
+        at its own time step and speed whatever the display rate
+        
+        Args:
+            simulation: SimulationThread of the game (see game.simulation)
+            keyboard: if True, the keyboard inputs are the controls of the simulated player (see key_inputs)
+            display_rate: maximum number of frames per second, so that the rendering leaves time to the simulation
+        """
+        self.simulation = simulation
+        self.snapshot = None
+        self.keyboard = keyboard
+        self.display_rate = display_rate
+        self.game_over = False
+        self.acc = 0.0
+        self.steer = 0.0
+        
+    def snapshot_update(self):
+        """
+        Move the player to the latest state published by the simulation, raising the
+        exception which stopped the simulation if any
+        """
+        if self.simulation.error is not None:
+            raise self.simulation.error
+        snapshot = self.simulation.snapshots.latest()
+        if snapshot is None:
+            return
+        self.snapshot = snapshot
+        self.player.pos[:] = snapshot.pos
+        self.player.rot = snapshot.rot
+        self.player.vel[:] = snapshot.vel
+        self.player.distance = snapshot.distance
+        self.player.time = snapshot.time
+        if not self.keyboard:
+            self.acc, self.steer = snapshot.acc, snapshot.steer
+        self.game_over = snapshot.game_over
+        
+    def replay(self, trajectories, agent=0):
+        """
+        Replay recorded trajectories instead of simulating the player: the player is moved to
+        its recorded state at the replay time, which can be paused, scrubbed and sped up
+        
+        Args:
+            trajectories: Trajectories instance (see game.trajectory)
+            agent: index of the agent to replay
+        """
+        self.trajectories = trajectories
+        self.replay_agent = agent % len(trajectories)
+        self.replay_time = 0.0
+        
+    def replay_update(self):
+        """
+        Advance the replay by the frame time and move the player to its recorded state
+        """
+        _, rows = self.trajectories.agent(self.replay_agent)
+        if len(rows) == 0:
+            return
+        if not self.replay_paused:
+            self.replay_time += self.dt * self.replay_speed
+        self.replay_time = min(max(self.replay_time, 0.0), float(rows[-1, 0]))
+        
+        # Recorded state of the first step ending after the replay time
+        row = rows[min(np.searchsorted(rows[:, 0], self.replay_time), len(rows) - 1)]
+        self.player.pos[:] = row[1:3]
+        self.player.rot = float(row[3])
+        self.player.vel[0] = row[4]
+        self.acc, self.steer = float(row[5]), float(row[6])
+        
     def tick(self, dt=None):
         """
         Update the game state
@@ -37,6 +124,10 @@ class GameGraphics(Game):
         Parameters:
             dt: time step : default=None (use the internal clock)
         """
+        # Limit the frame rate when the game is simulated in another thread
+        if self.simulation is not None and self.display_rate:
+            self.frame_clock.tick(self.display_rate)
+        
         # Update the clock
         if dt is None:
             dt_now = time.time()
@@ -73,6 +164,18 @@ class GameGraphics(Game):
                 self.camera = MapCamera(self.grid, self.player)
             self.last_camera_change = pygame.time.get_ticks()
             
+        # Handle simulation speed changes
+        if self.simulation is not None and keys[pygame.K_v] and pygame.time.get_ticks() - self.last_speed_change > 200:
+            index = SPEEDS.index(self.simulation.speed) if self.simulation.speed in SPEEDS else -1
+            self.simulation.speed = SPEEDS[(index + 1) % len(SPEEDS)]
+            self.last_speed_change = pygame.time.get_ticks()
+            
+        # Handle keyboard inputs for the replay, instead of the player controls
+        if self.trajectories is not None:
+            self.replay_events(keys)
+            self.camera.input(self.dt)
+            return
+        
         # Handle keyboard inputs for acceleration
         if keys[pygame.K_z]:
             self.acc += 1.0
@@ -96,6 +199,35 @@ class GameGraphics(Game):
         # Handle keyboard inputs for the camera
         self.camera.input(self.dt)
 
+    def replay_events(self, keys):
+        """
+        Handle the keyboard inputs of the replay
+        
+        Args:
+            keys: state of the keyboard keys
+        """
+        # Scrub while the arrow keys are pressed
+        if keys[pygame.K_RIGHT]:
+            self.replay_time += 5.0 * self.dt
+        if keys[pygame.K_LEFT]:
+            self.replay_time -= 5.0 * self.dt
+        
+        # Pause, speed and agent changes
+        if pygame.time.get_ticks() - self.last_replay_key > 200:
+            pressed = True
+            if keys[pygame.K_SPACE]:
+                self.replay_paused = not self.replay_paused
+            elif keys[pygame.K_UP]:
+                self.replay_speed *= 2.0
+            elif keys[pygame.K_DOWN]:
+                self.replay_speed /= 2.0
+            elif keys[pygame.K_n] or keys[pygame.K_b]:
+                self.replay(self.trajectories, self.replay_agent + (1 if keys[pygame.K_n] else -1))
+            else:
+                pressed = False
+            if pressed:
+                self.last_replay_key = pygame.time.get_ticks()
+
     def draw(self):
         """
         Draw the game state
@@ -104,7 +236,7 @@ class GameGraphics(Game):
         self.screen.fill("white")
         
         # Draw the view
-        self.camera.draw(self.screen)
+        self.camera.draw(self.screen, self.snapshot)
         
         # Display debug information
         self.display.clear()
@@ -118,8 +250,24 @@ class GameGraphics(Game):
         self.display.display(self.screen, "LEFT", format(" - Distance: {:.2f}".format(self.player.distance)))
         self.display.display(self.screen, "LEFT", format("Camera: {}".format(camera_name)))
         
-        self.display.display(self.screen, "RIGHT", format("Z/S: Accelerate/Brake"))
-        self.display.display(self.screen, "RIGHT", format("Q/D: Turn Left/Right"))
+        if self.simulation is not None:
+            speed = "max" if self.simulation.speed is None else "x{:g}".format(self.simulation.speed)
+            self.display.display(self.screen, "LEFT", format("Simulation: {} ({:.2f} s, {} steps)".format(speed, self.player.time, self.simulation.steps)))
+            self.display.display(self.screen, "RIGHT", format("V: Simulation speed"))
+        
+        if self.trajectories is not None:
+            agent, rows = self.trajectories.agent(self.replay_agent)
+            duration = float(rows[-1, 0]) if len(rows) > 0 else 0.0
+            self.display.display(self.screen, "LEFT", format("Replay: agent {} ({}/{})".format(agent['id'], self.replay_agent + 1, len(self.trajectories))))
+            self.display.display(self.screen, "LEFT", format(" - Fitness: {:.3f} ({})".format(agent['fitness'], agent['termination'])))
+            self.display.display(self.screen, "LEFT", format(" - Time: {:.2f}/{:.2f} s x{:g}{}".format(self.replay_time, duration, self.replay_speed, " (paused)" if self.replay_paused else "")))
+            self.display.display(self.screen, "RIGHT", format("Space: Pause"))
+            self.display.display(self.screen, "RIGHT", format("Left/Right: Scrub"))
+            self.display.display(self.screen, "RIGHT", format("Up/Down: Faster/Slower"))
+            self.display.display(self.screen, "RIGHT", format("N/B: Next/Previous agent"))
+        else:
+            self.display.display(self.screen, "RIGHT", format("Z/S: Accelerate/Brake"))
+            self.display.display(self.screen, "RIGHT", format("Q/D: Turn Left/Right"))
         self.display.display(self.screen, "RIGHT", format("P/M: Zoom In/Out"))
         self.display.display(self.screen, "RIGHT", format("C: Change Camera"))
         
@@ -1,35 +1,235 @@
+import os
+import hashlib
+import warnings
 import numpy as np
 from PIL import Image
 
 class Grid:
-    def __init__(self, grid_size, circuit_file):
+    # Number of cells (per axis) of a block of the pyramid, at each level
+    BLOCK = 8
+    
+    def __init__(self, grid_size, circuit_file, cache=True):
         """
         Initialize the grid with a given size and circuit file
         Args:
             grid_size: Number of cells in the grid
             circuit_file: File containing the circuit (image file)
+            cache: If True, the grid is read from (or saved to) a cache file next to the circuit file
         """
         self.GRID_SIZE = grid_size
-        self.grid = np.zeros((grid_size, grid_size)) # 0: empty, 1: wall
-        
-        # Open and read the circuit file pixels
-        im = Image.open(circuit_file)
-        pixels = im.load()
-        
-        # Load the circuit
-        for i in range(grid_size):
-            for j in range(grid_size):
-                # Average the RGB values in this cell
-                r, g, b = 0, 0, 0
-                for x in range(i * im.width // grid_size, (i + 1) * im.width // grid_size):
-                    for y in range(j * im.height // grid_size, (j + 1) * im.height // grid_size):
-                        pixel = pixels[x, y]
-                        r += pixel[0]
-                        g += pixel[1]
-                        b += pixel[2]
-                r, g, b = r // (im.width // grid_size) ** 2, g // (im.width // grid_size) ** 2, b // (im.width // grid_size) ** 2
-                
-                # If the cell is mostly white, it is a wall
-                if r + g + b >= 255:
-                    self.grid[i, j] = 1
-                    
\ No newline at end of file
+        self.grid = None # boolean array of the cells, False: empty, True: wall
+        self.pyramid = None # coarser levels of the grid (see build_pyramid)
+        self.distance_field = None # distance field of the walls, built on demand (see build_distance_field)
+        self.track = None # track of the map, attached by load_map (see game.track)
+        self.walls = None # segments of the walls, attached by load_map (see game.walls)
+        
+        # Try to read the grid from the cache, the key being the circuit content and the grid size
+        cache_file = Grid.cache_file(grid_size, circuit_file) if cache else None
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as data:
+                    self.grid = Grid.unpack(data['bits'], grid_size) if 'bits' in data else data['grid'] != 0
+            except (OSError, ValueError, KeyError):
+                warnings.warn('Invalid grid cache file: ' + cache_file)
+                self.grid = None
+        
+        if self.grid is None:
+            self.grid = Grid.load_circuit(grid_size, circuit_file)
+            if cache_file is not None:
+                self.save_cache(cache_file)
+        self.build_pyramid()
+    
+    def from_arrays(grid_size, grid, track=None, pyramid=None, walls=None):
+        """
+        Create a grid from already built arrays, without reading the circuit file
+        
+        Args:
+            grid_size: Number of cells in the grid
+            grid: Array of the cells (0: empty, 1: wall), viewed as booleans
+            track: Track of the map, None if not built
+            pyramid: Levels of the pyramid of the grid, None to build them (see build_pyramid)
+            walls: Segments of the walls, None if not extracted
+        """
+        instance = Grid.__new__(Grid)
+        instance.GRID_SIZE = grid_size
+        instance.grid = grid if grid.dtype == bool else grid != 0
+        instance.distance_field = None
+        instance.track = track
+        instance.walls = walls
+        instance.pyramid = pyramid
+        if pyramid is None:
+            instance.build_pyramid()
+        return instance
+    
+    def build_pyramid(self):
+        """
+        Build the pyramid of the grid: each level tells whether there is any wall in the
+        blocks of BLOCK x BLOCK cells of the previous level, the first level being built
+        from the cells, until a single block covers the grid. It is the broad phase of the
+        collisions (see any_wall): the cars in empty blocks are not tested against the cells.
+        The rays do not use it, a lookup of the blocks before the cells being slower than
+        reading the cells of the march samples directly.
+        """
+        self.pyramid = []
+        level = self.grid
+        while max(level.shape) > 1:
+            shape = [-(-n // Grid.BLOCK) * Grid.BLOCK for n in level.shape]
+            padded = np.zeros(shape, dtype=bool)
+            padded[:level.shape[0], :level.shape[1]] = level
+            level = padded.reshape(shape[0] // Grid.BLOCK, Grid.BLOCK, shape[1] // Grid.BLOCK, Grid.BLOCK).any(axis=(1, 3))
+            self.pyramid.append(level)
+    
+    def any_wall(self, min_cell, max_cell):
+        """
+        Check whether there may be walls in rectangles of cells, looking at the blocks they
+        overlap in the finest level of the pyramid where they overlap at most BLOCK x BLOCK
+        blocks. The result is conservative: a rectangle without wall may be reported if a
+        wall is in the blocks it overlaps. The cells outside the grid are not walls.
+        
+        Args:
+            min_cell: (array) first cell of each rectangle : shape = (rectangles, 2)
+            max_cell: (array) last cell of each rectangle (included) : shape = (rectangles, 2)
+        
+        Returns:
+            boolean array, False for the rectangles without any wall : shape = (rectangles,)
+        """
+        min_cell = np.clip(min_cell, 0, self.GRID_SIZE - 1)
+        max_cell = np.clip(max_cell, 0, self.GRID_SIZE - 1)
+        block = Grid.BLOCK
+        for level in self.pyramid:
+            first, last = min_cell // block, max_cell // block
+            span = np.max(last - first, initial=0) + 1
+            if span <= Grid.BLOCK:
+                # Blocks overlapped by each rectangle, in a fixed window : shape = (rectangles, span, span)
+                blocks_x = np.minimum(first[:, 0, None, None] + np.arange(span)[None, :, None], last[:, 0, None, None])
+                blocks_y = np.minimum(first[:, 1, None, None] + np.arange(span)[None, None, :], last[:, 1, None, None])
+                return np.any(level[blocks_x, blocks_y], axis=(1, 2))
+            block *= Grid.BLOCK
+        return np.ones(len(min_cell), dtype=bool)
+    
+    def pack(grid):
+        """
+        Pack the cells of a grid in bits (8 cells per byte)
+        
+        Args:
+            grid: boolean array of the cells
+        """
+        return np.packbits(grid, axis=None)
+    
+    def unpack(bits, grid_size):
+        """
+        Unpack the cells of a grid packed by pack
+        
+        Args:
+            bits: array of the packed cells
+            grid_size: Number of cells in the grid
+        """
+        return np.unpackbits(bits, count=grid_size * grid_size).reshape(grid_size, grid_size).astype(bool)
+    
+    def __getstate__(self):
+        # The cells are pickled in bits and the pyramid rebuilt when unpickled
+        state = dict(self.__dict__)
+        state['grid'] = Grid.pack(self.grid)
+        state['pyramid'] = None
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.grid = Grid.unpack(self.grid, self.GRID_SIZE)
+        self.build_pyramid()
+    
+    def load_circuit(grid_size, circuit_file):
+        """
+        Read the circuit file and average its pixels over each cell of the grid
+        
+        Args:
+            grid_size: Number of cells in the grid
+            circuit_file: File containing the circuit (image file)
+            
+        Returns:
+            boolean array of the cells : shape = (grid_size, grid_size), False: empty, True: wall
+        """
+        # Open and read the circuit file pixels, indexed as [x, y, channel]
+        with Image.open(circuit_file) as im:
+            pixels = np.asarray(im.convert('RGB'), dtype=np.int64).transpose(1, 0, 2)
+        width, height = pixels.shape[0], pixels.shape[1]
+        
+        # Grid finer than the image: each cell takes the color of the pixel it is in
+        if grid_size > width or grid_size > height:
+            xs = np.arange(grid_size) * width // grid_size
+            ys = np.arange(grid_size) * height // grid_size
+            return pixels[xs][:, ys].sum(axis=2) >= 255
+        
+        # Sum the RGB values in each cell with an integral image
+        integral = np.zeros((width + 1, height + 1, 3), dtype=np.int64)
+        integral[1:, 1:] = pixels.cumsum(axis=0).cumsum(axis=1)
+        xs = np.arange(grid_size + 1) * width // grid_size
+        ys = np.arange(grid_size + 1) * height // grid_size
+        sums = integral[xs[1:]][:, ys[1:]] - integral[xs[:-1]][:, ys[1:]] - integral[xs[1:]][:, ys[:-1]] + integral[xs[:-1]][:, ys[:-1]]
+        
+        # Average the RGB values in each cell
+        rgb = sums // max(1, width // grid_size) ** 2
+        
+        # If the cell is mostly white, it is a wall
+        return rgb.sum(axis=2) >= 255
+    
+    def cache_file(grid_size, circuit_file):
+        """
+        Path of the cache file of a grid, in the cache/ folder next to the circuit file
+        
+        Args:
+            grid_size: Number of cells in the grid
+            circuit_file: File containing the circuit (image file)
+        """
+        with open(circuit_file, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:16]
+        return os.path.join(os.path.dirname(circuit_file), 'cache', 'grid-{}-{}.npz'.format(grid_size, digest))
+    
+    def save_cache(self, cache_file):
+        """
+        Save the grid (its cells packed in bits) in a compressed cache file
+        
+        Args:
+            cache_file: Path of the cache file
+        """
+        arrays = {'bits': Grid.pack(self.grid)}
+        
+        # Write to a temporary file first, several processes may build the same grid
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            warnings.warn('Could not write the grid cache file: ' + cache_file)
+    
+    def build_distance_field(self, max_distance=0.25):
+        """
+        Build the Euclidean distance transform of the walls: the distance (in cells) from
+        each cell center to the nearest wall cell center, 0 for the walls themselves.
+        The cells outside the grid are considered as walls, and the distances are capped
+        at max_distance so that the transform only looks at a window around each cell.
+        
+        Args:
+            max_distance: Largest distance stored in the field (same unit as the positions, [0, 1])
+        """
+        cap = max(1, int(np.ceil(max_distance * self.GRID_SIZE)))
+        walls = np.pad(self.grid, cap, constant_values=True)
+        
+        # Distance to the nearest wall along the first axis
+        column = np.full(walls.shape, np.inf)
+        column[walls] = 0
+        for k in range(1, cap + 1):
+            column[k:, :] = np.where(walls[:-k, :], np.minimum(column[k:, :], k), column[k:, :])
+            column[:-k, :] = np.where(walls[k:, :], np.minimum(column[:-k, :], k), column[:-k, :])
+        
+        # Combine with the second axis: min over the window of (dy^2 + column distance^2)
+        squared = column ** 2
+        field = squared.copy()
+        for k in range(1, cap + 1):
+            field[:, k:] = np.minimum(field[:, k:], squared[:, :-k] + k ** 2)
+            field[:, :-k] = np.minimum(field[:, :-k], squared[:, k:] + k ** 2)
+        
+        # Cap the distances, a wall further than the window may still be closer than the computed value
+        self.distance_field = np.minimum(np.sqrt(field[cap:-cap, cap:-cap]), cap)
@@ -0,0 +1,88 @@
+import os
+import csv
+import warnings
+import numpy as np
+from collections import namedtuple
+from game.grid import Grid
+from game.track import Track
+from game.walls import WallSegments
+
+# A loaded map: its grid (with the track attached) and the spawn point of the players
+MapEntry = namedtuple('MapEntry', ['grid', 'player_pos', 'name'])
+
+class MapRegistry:
+    """
+    All the maps of a folder, loaded once: the circuit images are decoded and the grids,
+    tracks built when the registry is created, so that changing map
+    during the training is a lookup. The grid instances being kept, a map is also
+    published only once in the shared memory of the evaluator.
+    """
+    def __init__(self, folder='maps/', grid_size=250, wall_segments=False):
+        """
+        Load every map of a folder
+
+        Args:
+            folder: path of the folder containing one folder per map (circuit.png and spawn.csv)
+            grid_size: Number of cells of the grids (per axis)
+            wall_segments: Extract the segments of the walls, so that the rays and collisions are exact
+        """
+        self.maps = {}
+        for name in sorted(os.listdir(folder)):
+            if os.path.exists(os.path.join(folder, name, 'spawn.csv')):
+                self.maps[name] = MapRegistry.load(os.path.join(folder, name) + '/', grid_size, wall_segments)
+
+    def load(map_folder, grid_size=250, wall_segments=False):
+        """
+        Load a map folder: the grid, with the track of the map attached, and the spawn point
+
+        Args:
+            map_folder: path of the map folder (ending with '/')
+            grid_size: Number of cells of the grid (per axis)
+            wall_segments: Extract the segments of the walls, so that the rays and collisions are exact
+
+        Returns:
+            MapEntry of the map
+        """
+        with open(map_folder + 'spawn.csv', 'r') as file:
+            reader = csv.reader(file)
+            for row in reader:
+                player_pos = (float(row[0]), float(row[1]))
+
+        grid = Grid(grid_size, map_folder + 'circuit.png')
+
+        # Centerline and progress index of the track, starting at the spawn point
+        try:
+            grid.track = Track(grid, player_pos, map_folder + 'circuit.png')
+        except ValueError as error:
+            warnings.warn('No track for the map {}: {}'.format(map_folder, error))
+
+        if wall_segments:
+            grid.walls = WallSegments(map_folder + 'circuit.png')
+
+        return MapEntry(grid, player_pos, map_folder.split('/')[-2])
+
+    def names(self):
+        """
+        Get the names of the maps, sorted
+        """
+        return list(self.maps)
+
+    def select(self, map_folder=None):
+        """
+        Get a map of the registry
+
+        Args:
+            map_folder: path or name of the map folder, None for a random map
+
+        Returns:
+            MapEntry of the map
+        """
+        if map_folder is None:
+            return self.maps[np.random.choice(self.names())]
+        return self.maps[os.path.basename(os.path.normpath(map_folder))]
+
+    def __getitem__(self, name):
+        return self.maps[name]
+
+    def __len__(self):
+        return len(self.maps)
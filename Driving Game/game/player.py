@@ -1,4 +1,5 @@
 import numpy as np
+from game.sensors import cast_rays
 
 class Player:
     def __init__(self, pos):
@@ -102,23 +103,7 @@ class Player:
             ray_count: number of rays for the player's field of view
         """
         # Compute rays distance
-        distances = np.zeros(ray_count)
-        for i in range(ray_count):
-            # Compute ray direction
-            angle = self.rot + (i - ray_count // 2) * self.fov / ray_count
-            ray_dir = np.array([np.cos(angle), np.sin(angle)])
-            
-            # Compute the distance to the nearest wall
-            distance = 0
-            while True:
-                if distance + self.wall_dx > self.view_distance:
-                    break
-                distance += self.wall_dx
-                ray_pos = self.pos + distance * ray_dir
-                (grid_x, grid_y) = (np.ceil(ray_pos[0] * grid.grid.shape[0]), np.ceil(ray_pos[1] * grid.grid.shape[1]))
-                if grid.grid[int(grid_x), int(grid_y)] == 1:
-                    break
-            distances[i] = distance
+        distances = cast_rays(grid, self.pos, self.rot, ray_count, self.fov, self.view_distance, self.wall_dx)[0]
         
         # Return the inputs
         return (self.vel[0], *distances)
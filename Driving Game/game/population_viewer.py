@@ -0,0 +1,113 @@
+import pygame
+import numpy as np
+from game.cameras import GridTiles
+from game.display import Display
+from game.player import Player
+
+class PopulationViewer:
+    """
+    Window showing all the agents of a generation at once on their map, colored by species.
+    The cars are rasterized together with NumPy into the pixels of the window: drawing a
+    frame costs the same few array operations whatever the size of the population.
+    """
+    # Colors of the species, by species id
+    PALETTE = np.array([
+        (230, 25, 75), (60, 180, 75), (255, 225, 25), (0, 130, 200), (245, 130, 48),
+        (145, 30, 180), (70, 240, 240), (240, 50, 230), (210, 245, 60), (250, 190, 212),
+        (0, 128, 128), (220, 190, 255), (170, 110, 40), (128, 0, 0), (170, 255, 195),
+        (128, 128, 0), (255, 215, 180), (0, 0, 128)], dtype=np.uint8)
+
+    def __init__(self, size=(720, 720)):
+        """
+        Open the window
+
+        Args:
+            size: size of the window (pixels)
+        """
+        pygame.init()
+        self.screen = pygame.display.set_mode(size)
+        pygame.display.set_caption('Population')
+        self.display = Display()
+        self.running = True
+        self.grid = None
+        self.tiles = None
+        self.player = Player((0.0, 0.0)) # car dimensions
+
+    def events(self):
+        """
+        Handle window events (close)
+        """
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.running = False
+
+    def draw(self, grid, generation, map_name, states, species):
+        """
+        Draw the agents of a generation
+
+        Args:
+            grid: the grid of the map of the agents
+            generation: number of the generation
+            map_name: name of the map
+            states: array of the (x, y, rot, status) of each agent (see brain.evaluator.StateStream)
+            species: array of the species id of each agent
+        """
+        if grid is not self.grid:
+            self.grid = grid
+            self.tiles = GridTiles(grid)
+
+        # Draw the map, fitted in the window
+        self.screen.fill("white")
+        view_size = self.screen.get_size()
+        scale = min(view_size)
+        origin = ((view_size[0] - scale) / 2, (view_size[1] - scale) / 2)
+        self.tiles.draw(self.screen, origin, scale)
+
+        # Draw the stopped and cached cars faded, under the running ones (the cached cars without known state are not drawn)
+        shown = np.flatnonzero((states[:, 3] > 0) & ~np.isnan(states[:, 0]))
+        shown = shown[np.argsort(-states[shown, 3], kind='stable')]
+        colors = PopulationViewer.PALETTE[species[shown] % len(PopulationViewer.PALETTE)]
+        colors = np.where(states[shown, 3, None] > 1, colors // 2 + 64, colors)
+        self.draw_cars(states[shown, :2], states[shown, 2], colors, self.player.width, self.player.height, origin, scale)
+
+        # Display the generation
+        counts = np.bincount(states[:, 3].astype(int), minlength=4)
+        self.display.clear()
+        self.display.display(self.screen, "LEFT", "Generation {} - {}".format(generation, map_name))
+        self.display.display(self.screen, "LEFT", "Agents: {} running, {} stopped, {} cached, {} waiting".format(
+            counts[1], counts[2], counts[3], counts[0]))
+        self.display.display(self.screen, "LEFT", "Species: {}".format(len(np.unique(species))))
+        pygame.display.flip()
+
+    def draw_cars(self, pos, rot, colors, width, height, origin, scale):
+        """
+        Rasterize car rectangles into the pixels of the window, the later cars covering
+        the earlier ones
+
+        Args:
+            pos: (array) position of each car : shape = (cars, 2)
+            rot: (array) rotation of each car : shape = (cars,)
+            colors: (array) color of each car : shape = (cars, 3)
+            width: car width
+            height: car height
+            origin: position on the window of the grid corner (0, 0)
+            scale: size of the grid on the window (pixels)
+        """
+        if len(pos) == 0:
+            return
+
+        # Sample each rectangle, centered on the car as in the cameras, densely enough to cover its pixels : shape = (cars, samples, 2)
+        forward = np.stack([np.cos(rot), np.sin(rot)], axis=1)
+        left = np.stack([-forward[:, 1], forward[:, 0]], axis=1)
+        u = np.linspace(-height / 2, height / 2, int(np.ceil(height * scale * 1.5)) + 1)
+        v = np.linspace(-width / 2, width / 2, int(np.ceil(width * scale * 1.5)) + 1)
+        u, v = [array.ravel() for array in np.meshgrid(u, v)]
+        points = pos[:, None, :] + u[None, :, None] * forward[:, None, :] + v[None, :, None] * left[:, None, :]
+        x = np.floor(origin[0] + points[..., 0] * scale).astype(int)
+        y = np.floor(origin[1] + points[..., 1] * scale).astype(int)
+
+        # Write the colors of the samples inside the window
+        inside = (x >= 0) & (x < self.screen.get_width()) & (y >= 0) & (y < self.screen.get_height())
+        pixels = pygame.surfarray.pixels3d(self.screen)
+        pixels[x[inside], y[inside]] = np.broadcast_to(colors[:, None, :], x.shape + (3,))[inside]
+        del pixels
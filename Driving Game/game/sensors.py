@@ -0,0 +1,108 @@
+import numpy as np
+
+def march_distances(view_distance, wall_dx):
+    """
+    Distances at which a ray is sampled when marching toward the walls
+
+    Args:
+        view_distance: maximum distance of a ray
+        wall_dx: step used to march along a ray
+
+    Returns:
+        array of the increasing sample distances
+    """
+    # Accumulate the steps one by one so that the samples match a sequential march
+    distances = []
+    distance = 0
+    while distance + wall_dx <= view_distance:
+        distance += wall_dx
+        distances.append(distance)
+    return np.array(distances, dtype=float)
+
+def ray_directions(rot, ray_count, fov):
+    """
+    Compute the angle of each ray, uniformly distributed in the field of view of each car
+
+    Args:
+        rot: (array) rotation of each car : shape = (cars,)
+        ray_count: number of rays in the field of view
+        fov: field of view angle
+
+    Returns:
+        array of the ray angles : shape = (cars, ray_count)
+    """
+    offsets = (np.arange(ray_count) - ray_count // 2) * fov / ray_count
+    return np.asarray(rot, dtype=float)[:, None] + offsets[None, :]
+
+def cast_rays(grid, pos, rot, ray_count, fov, view_distance, wall_dx, return_hits=False):
+    """
+    Compute the distance to the nearest wall along every ray of every car at once.
+    If the grid has the segments of the walls the rays are intersected with them
+    (see game.walls), otherwise they are marched by steps of wall_dx. The cells
+    outside the grid are considered as walls.
+
+    Args:
+        grid: the grid with the map
+        pos: (array) origin of the rays of each car : shape = (cars, 2)
+        rot: (array) direction of the center of the field of view of each car : shape = (cars,)
+        ray_count: number of rays in the field of view
+        fov: field of view angle
+        view_distance: maximum distance of a ray
+        wall_dx: step used to march along a ray
+        return_hits: if True, also return whether each ray hit a wall
+
+    Returns:
+        array of the ray distances : shape = (cars, ray_count)
+        (if return_hits) boolean array of the rays hitting a wall : shape = (cars, ray_count)
+    """
+    pos = np.asarray(pos, dtype=float).reshape(-1, 2)
+    angles = ray_directions(np.reshape(rot, -1), ray_count, fov)
+    if getattr(grid, 'walls', None) is not None:
+        distances, hit = grid.walls.cast(pos, angles, view_distance)
+        return (distances, hit) if return_hits else distances
+
+    steps = march_distances(view_distance, wall_dx)
+    if len(steps) == 0:
+        distances, hit = np.zeros(angles.shape), np.zeros(angles.shape, dtype=bool)
+        return (distances, hit) if return_hits else distances
+
+    # Sample every ray at every step : shape = (cars, rays, steps)
+    ray_x = pos[:, 0, None, None] + steps[None, None, :] * np.cos(angles)[:, :, None]
+    ray_y = pos[:, 1, None, None] + steps[None, None, :] * np.sin(angles)[:, :, None]
+    grid_x = np.ceil(ray_x * grid.grid.shape[0]).astype(int)
+    grid_y = np.ceil(ray_y * grid.grid.shape[1]).astype(int)
+
+    # Look for walls, the samples leaving the grid hit the border
+    hits = _wall_at(grid, grid_x, grid_y)
+
+    # The distance is the first sample hitting a wall, or the last sample if none is hit
+    hit = np.any(hits, axis=2)
+    distances = steps[np.where(hit, np.argmax(hits, axis=2), len(steps) - 1)]
+    return (distances, hit) if return_hits else distances
+
+def _wall_at(grid, grid_x, grid_y):
+    """
+    Check whether the given cells are walls, the cells outside the grid being walls
+
+    Args:
+        grid: the grid with the map
+        grid_x: (array) first index of the cells
+        grid_y: (array) second index of the cells
+    """
+    inside = (grid_x >= 0) & (grid_x < grid.grid.shape[0]) & (grid_y >= 0) & (grid_y < grid.grid.shape[1])
+    return ~inside | grid.grid[np.where(inside, grid_x, 0), np.where(inside, grid_y, 0)]
+
+def get_inputs_batch(grid, pos, vel, rot, ray_count, player):
+    """
+    Get the inputs for the NEAT networks of several cars, one row (vel_x, ray_distance_1, ..., ray_distance_n) per car
+
+    Args:
+        grid: the grid with the map
+        pos: (array) position of each car : shape = (cars, 2)
+        vel: (array) forward velocity of each car : shape = (cars,)
+        rot: (array) rotation of each car : shape = (cars,)
+        ray_count: number of rays for the player's field of view
+        player: player holding the vision parameters shared by the cars
+    """
+    distances = cast_rays(grid, pos, rot, ray_count, player.fov, player.view_distance, player.wall_dx)
+    return np.concatenate([np.reshape(vel, (-1, 1)), distances], axis=1)
@@ -0,0 +1,126 @@
+import time
+import threading
+from collections import namedtuple
+
+# State of the game after a time step, as published by the simulation for the rendering
+# (rays: (distances, hits) of the rays seen by the controller, None if it does not use rays)
+Snapshot = namedtuple('Snapshot', ['step', 'time', 'pos', 'rot', 'vel', 'acc', 'steer', 'distance', 'rays', 'red_cells', 'game_over'])
+
+# Speeds of the simulation relative to real time, None running it as fast as possible
+SPEEDS = [1.0, 10.0, None]
+
+class SnapshotBuffer:
+    """
+    Ring buffer of the last snapshots of a simulation, written by the simulation thread and
+    read by the rendering thread without lock: a snapshot is an immutable tuple written to
+    its slot before the write count is published, so that a reader never sees a partially
+    written state, only possibly a more recent one than the count it read.
+    """
+    def __init__(self, size=64):
+        """
+        Args:
+            size: number of snapshots kept
+        """
+        self.slots = [None] * size
+        self.count = 0
+
+    def publish(self, snapshot):
+        """
+        Add a snapshot, overwriting the oldest one (single writer)
+
+        Args:
+            snapshot: the Snapshot
+        """
+        self.slots[self.count % len(self.slots)] = snapshot
+        self.count += 1
+
+    def latest(self):
+        """
+        Get the most recent snapshot, None if none was published
+        """
+        count = self.count
+        return self.slots[(count - 1) % len(self.slots)] if count > 0 else None
+
+class SimulationThread(threading.Thread):
+    """
+    Simulation of a game in its own thread, at the fixed time step of the game whatever the
+    display rate: the game is stepped so that the simulated time follows the real time
+    multiplied by the speed, and every step is published as a snapshot, the rendering only
+    reading the latest one. The thread stops at the end of the game.
+    """
+    def __init__(self, game, controller, speed=1.0, buffer_size=64):
+        """
+        Args:
+            game: the Game to simulate (not shared with the rendering)
+            controller: function controller(game) returning the (acc, steer, rays) to apply at the next step,
+                        rays being the (distances, hits) of the rays it used, or None
+            speed: speed relative to real time, None to run as fast as possible (see SPEEDS)
+            buffer_size: number of snapshots kept
+        """
+        super().__init__(daemon=True)
+        self.game = game
+        self.controller = controller
+        self.speed = speed
+        self.snapshots = SnapshotBuffer(buffer_size)
+        self.stopped = threading.Event()
+        self.steps = 0
+        self.error = None # exception which stopped the simulation, raised again by the rendering
+
+    def run(self):
+        try:
+            self.simulate()
+        except Exception as error:
+            self.error = error
+
+    def simulate(self):
+        """
+        Step the game until it is over or the simulation is stopped
+        """
+        game = self.game
+        self.publish(0.0, 0.0, None)
+        clock = time.perf_counter()
+        sim_time = target = 0.0
+        while not game.game_over and not self.stopped.is_set():
+            # Simulated time the game must reach (the speed may change at any time, and a late
+            # simulation does not try to catch up more than 0.1 s of real time)
+            now = time.perf_counter()
+            speed = self.speed
+            if speed is None:
+                target = sim_time + 0.05
+            else:
+                target += min(now - clock, 0.1) * speed
+            clock = now
+
+            # Step the game at its time step until it catches up
+            while sim_time + game.dt <= target and not game.game_over and not self.stopped.is_set():
+                acc, steer, rays = self.controller(game)
+                game.update(acc, steer)
+                sim_time += game.dt
+                self.steps += 1
+                self.publish(acc, steer, rays)
+
+            # Leave the time to the rendering until the next step is due (the game may have ended
+            # while the simulation was late, the next step being then overdue)
+            if game.game_over or self.stopped.is_set():
+                break
+            time.sleep(0 if speed is None else max(0.0, min(0.01, (sim_time + game.dt - target) / speed)))
+
+    def publish(self, acc, steer, rays):
+        """
+        Publish the state of the game after a step
+
+        Args:
+            acc: acceleration applied during the step
+            steer: steering applied during the step
+            rays: (distances, hits) of the rays seen by the controller, None if none
+        """
+        player = self.game.player
+        self.snapshots.publish(Snapshot(self.steps, player.time, player.pos.copy(), float(player.rot), player.vel.copy(),
+                                        acc, steer, player.distance, rays, list(getattr(self.game.grid, 'red_cells', [])), self.game.game_over))
+
+    def stop(self):
+        """
+        Stop the simulation and wait for the thread
+        """
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,127 @@
+import numpy as np
+
+# Reasons for which the simulation of an agent ended
+RUNNING, CRASH, MAX_TIME, STALL, NO_PROGRESS = range(5)
+TERMINATION_REASONS = ['running', 'crash', 'max_time', 'stall', 'no_progress']
+
+class TerminationPolicy:
+    """
+    Rules used to stop early the agents which do not drive anymore, so that they do not
+    use the whole simulation time. The policy only holds the configuration, the state
+    of the agents during a simulation is kept by a TerminationMonitor.
+    """
+    def __init__(self, min_velocity=None, stall_time=2.0, progress_timeout=None, progress_cell=0.05):
+        """
+        Args:
+            min_velocity: an agent whose velocity stays under this value for stall_time seconds is stopped (None to disable)
+            stall_time: duration of the velocity window (s)
+            progress_timeout: an agent which makes no new progress on the track for this duration is stopped (None to disable)
+            progress_cell: progress needed to count as a new progress. With the track of the map, an agent progresses
+                           when it goes this distance further along the track than it ever went. Without it, this is the
+                           size of the cells of a coarse grid, an agent progressing when it enters a cell it never visited
+        """
+        self.min_velocity = min_velocity
+        self.stall_time = stall_time
+        self.progress_timeout = progress_timeout
+        self.progress_cell = progress_cell
+
+    def monitor(self, count, track=None):
+        """
+        Create the monitor following a simulation of count agents with this policy
+
+        Args:
+            count: number of agents simulated
+            track: track of the map used to measure the progress (None to use a coarse grid of visited cells)
+        """
+        return TerminationMonitor(self, count, track)
+
+class TerminationMonitor:
+    """
+    State of the termination rules for the agents of one simulation.
+    """
+    def __init__(self, policy, count, track=None):
+        """
+        Args:
+            policy: the termination policy
+            count: number of agents simulated
+            track: track of the map used to measure the progress, None if not available
+        """
+        self.policy = policy
+        self.track = track
+        self.reasons = np.full(count, RUNNING)
+        self.last_moving = np.zeros(count)
+        self.last_progress = np.zeros(count)
+
+        # Progress of each agent along the track (laps included) and best progress
+        self.position = None
+        self.progress = np.zeros(count)
+        self.best = np.zeros(count)
+
+        # Coarse cells visited by each agent
+        self.cells = int(np.ceil(1.0 / policy.progress_cell))
+        self.visited = np.zeros((count, self.cells, self.cells), dtype=bool)
+
+    def update(self, elapsed_time, vel, pos, running):
+        """
+        Evaluate the termination rules after a simulation step
+
+        Args:
+            elapsed_time: time elapsed since the start of the simulation (s)
+            vel: (array) forward velocity of each agent : shape = (count,)
+            pos: (array) position of each agent : shape = (count, 2)
+            running: (array) mask of the agents still running : shape = (count,)
+
+        Returns:
+            boolean array of the running agents stopped by the policy at this step
+        """
+        policy = self.policy
+        stopped = np.zeros(len(self.reasons), dtype=bool)
+        vel = np.reshape(vel, -1)
+        pos = np.reshape(pos, (-1, 2))
+
+        # Minimum velocity over the window
+        if policy.min_velocity is not None:
+            moving = running & (vel >= policy.min_velocity)
+            self.last_moving[moving] = elapsed_time
+            stall = running & (elapsed_time - self.last_moving > policy.stall_time)
+            self.reasons[stall] = STALL
+            stopped |= stall
+
+        # New progress on the track
+        if policy.progress_timeout is not None:
+            if self.track is not None:
+                # Progress along the track since the previous step, the positions in the walls being ignored
+                position = self.track.progress_at(pos)
+                if self.position is None:
+                    self.position = position
+                advance = self.track.advance(self.position, position)
+                self.progress += np.where(running & np.isfinite(advance), advance, 0.0)
+                self.position = np.where(np.isfinite(position), position, self.position)
+                new_progress = running & (self.progress >= self.best + policy.progress_cell)
+                self.best[new_progress] = self.progress[new_progress]
+            else:
+                cells = np.clip((pos / policy.progress_cell).astype(int), 0, self.cells - 1)
+                agents = np.arange(len(self.reasons))
+                new_progress = running & ~self.visited[agents, cells[:, 0], cells[:, 1]]
+                self.visited[agents[new_progress], cells[new_progress, 0], cells[new_progress, 1]] = True
+            self.last_progress[new_progress] = elapsed_time
+            no_progress = running & ~stopped & (elapsed_time - self.last_progress > policy.progress_timeout)
+            self.reasons[no_progress] = NO_PROGRESS
+            stopped |= no_progress
+
+        return stopped
+
+    def finish(self, game_over):
+        """
+        Set the reason of the agents not stopped by the policy at the end of the simulation
+
+        Args:
+            game_over: (array) mask of the agents which crashed or were stopped : shape = (count,)
+
+        Returns:
+            array of the termination reason of each agent (see TERMINATION_REASONS)
+        """
+        game_over = np.reshape(game_over, -1)
+        self.reasons[(self.reasons == RUNNING) & game_over] = CRASH
+        self.reasons[self.reasons == RUNNING] = MAX_TIME
+        return self.reasons
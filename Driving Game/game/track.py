@@ -0,0 +1,216 @@
+import os
+import heapq
+import hashlib
+import warnings
+import numpy as np
+from game.grid import Grid
+
+class Track:
+    """
+    Centerline of the free space of a map, and an index giving for each cell of the grid
+    the arc length of the centerline at this part of the track, so that the progress of
+    a car along the track is a single lookup.
+    The track is cut at the spawn point, perpendicular to the starting direction: the
+    progress starts at 0 at the spawn point and grows along the lap up to the length
+    of the track, where it wraps back to 0.
+    """
+    def __init__(self, grid, player_pos, circuit_file=None, direction=0.0, cache=True):
+        """
+        Build the track of a grid, or read it from the cache
+
+        Args:
+            grid: the grid instance
+            player_pos: spawn point of the players
+            circuit_file: File containing the circuit (image file), used as cache key (None for no cache)
+            direction: starting direction of the players (rad)
+            cache: If True, the track is read from (or saved to) a cache file next to the circuit file
+        """
+        self.GRID_SIZE = grid.GRID_SIZE
+        self.progress = None # arc length of each cell, nan for the walls and the unreachable cells
+        self.centerline = None
+        self.length = None
+
+        # Try to read the track from the cache, the key being the circuit content, the grid size and the spawn
+        cache_file = Track.cache_file(grid.GRID_SIZE, circuit_file, player_pos, direction) if cache and circuit_file is not None else None
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as data:
+                    self.progress = data['progress']
+                    self.centerline = data['centerline']
+                    self.length = float(data['length'])
+            except (OSError, ValueError, KeyError):
+                warnings.warn('Invalid track cache file: ' + cache_file)
+                self.progress = None
+
+        if self.progress is None:
+            self.build(grid, player_pos, direction)
+            if cache_file is not None:
+                self.save_cache(cache_file)
+
+    def from_arrays(progress, centerline, length):
+        """
+        Create a track from already built arrays
+
+        Args:
+            progress: Arc length of each cell of the grid
+            centerline: Points of the centerline, in order along the lap
+            length: Length of the track
+        """
+        instance = Track.__new__(Track)
+        instance.GRID_SIZE = progress.shape[0]
+        instance.progress = progress
+        instance.centerline = centerline
+        instance.length = length
+        return instance
+
+    def cache_file(grid_size, circuit_file, player_pos, direction=0.0):
+        """
+        Path of the cache file of a track, in the cache/ folder next to the circuit file
+
+        Args:
+            grid_size: Number of cells in the grid
+            circuit_file: File containing the circuit (image file)
+            player_pos: spawn point of the players
+            direction: starting direction of the players (rad)
+        """
+        with open(circuit_file, 'rb') as f:
+            digest = hashlib.sha256(f.read())
+        digest.update(repr((float(player_pos[0]), float(player_pos[1]), float(direction))).encode())
+        return os.path.join(os.path.dirname(circuit_file), 'cache', 'track-{}-{}.npz'.format(grid_size, digest.hexdigest()[:16]))
+
+    def save_cache(self, cache_file):
+        """
+        Save the track in a compressed cache file
+
+        Args:
+            cache_file: Path of the cache file
+        """
+        # Write to a temporary file first, several processes may build the same track
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                np.savez_compressed(f, progress=self.progress, centerline=self.centerline, length=self.length)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            warnings.warn('Could not write the track cache file: ' + cache_file)
+
+    def build(self, grid, player_pos, direction=0.0):
+        """
+        Build the centerline and the progress index. The geodesic distance of every free
+        cell from the starting line is computed going forward around the track, its level
+        sets being the cross sections of the track. The centerline goes through the cell of
+        each cross section the furthest from the walls, and the progress of a cell is the
+        arc length of the centerline at its cross section.
+
+        Args:
+            grid: the grid instance
+            player_pos: spawn point of the players
+            direction: starting direction of the players (rad)
+        """
+        size = grid.GRID_SIZE
+        free = grid.grid == 0
+        start = np.clip(np.floor(np.asarray(player_pos, dtype=float) * size).astype(int), 0, size - 1)
+        if not free[start[0], start[1]]:
+            raise ValueError('The spawn point of the track is in a wall')
+
+        # Coordinates of the cells along (s) and across (t) the starting direction
+        forward = np.array([np.cos(direction), np.sin(direction)])
+        across = np.array([-forward[1], forward[0]])
+        cells = np.stack(np.meshgrid(np.arange(size), np.arange(size), indexing='ij'), axis=-1) - start
+        s, t = cells @ forward, cells @ across
+
+        # Starting line: the free cells across the spawn point, up to the walls
+        span = [0, 0]
+        for side, sign in ((0, -1), (1, 1)):
+            while True:
+                cell = np.round(start + (span[side] + sign) * across).astype(int)
+                if np.any(cell < 0) or np.any(cell >= size) or not free[cell[0], cell[1]]:
+                    break
+                span[side] += sign
+        on_line = (t >= span[0] - 0.5) & (t <= span[1] + 0.5)
+
+        # Geodesic distance (in cells) from the starting line, without crossing it backward
+        distance = np.full((size, size), np.inf)
+        heap = [(0.0, x, y) for x, y in zip(*np.nonzero(free & on_line & (s >= 0) & (s < 1)))]
+        for _, x, y in heap:
+            distance[x, y] = 0.0
+        neighbors = [(dx, dy, np.hypot(dx, dy)) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx != 0 or dy != 0]
+        while heap:
+            d, x, y = heapq.heappop(heap)
+            if d > distance[x, y]:
+                continue
+            for dx, dy, step in neighbors:
+                nx, ny = x + dx, y + dy
+                if nx < 0 or nx >= size or ny < 0 or ny >= size or not free[nx, ny] or d + step >= distance[nx, ny]:
+                    continue
+                if (s[x, y] >= 0) != (s[nx, ny] >= 0) and (on_line[x, y] or on_line[nx, ny]):
+                    continue
+                distance[nx, ny] = d + step
+                heapq.heappush(heap, (d + step, nx, ny))
+
+        # The lap ends on the cells just behind the starting line
+        behind = np.isfinite(distance) & on_line & (s < 0) & (s >= -1)
+        if not np.any(behind):
+            raise ValueError('The track is not a loop going back to the spawn point')
+        lap = distance[behind].min() + 1
+
+        # Centerline: the cell of each cross section (1 cell wide) the furthest from the walls
+        clearance = Grid.from_arrays(size, grid.grid)
+        clearance.build_distance_field()
+        sections = np.where(np.isfinite(distance), np.floor(distance), -1).astype(int)
+        points = []
+        for k in range(int(np.ceil(lap))):
+            section = sections == k
+            if not np.any(section):
+                continue
+            field = clearance.distance_field[section]
+            ridge = np.argwhere(section)[field >= field.max() - 0.5]
+            points.append((k + 0.5, *((ridge.mean(axis=0) + 0.5) / size)))
+        points = np.array(points)
+
+        # Smooth the centerline over a few cells, the track being a loop
+        window = 5
+        kernel = np.ones(window) / window
+        padded = np.concatenate([points[-window:, 1:], points[:, 1:], points[:window, 1:]])
+        centerline = np.stack([np.convolve(padded[:, i], kernel, mode='same')[window:-window] for i in range(2)], axis=1)
+
+        # Arc length along the centerline, from its first point
+        segments = np.hypot(*np.diff(np.concatenate([centerline, centerline[:1]]), axis=0).T)
+        arc = np.concatenate([[0.0], np.cumsum(segments[:-1])])
+        length = segments.sum()
+
+        # Progress of each cell: arc length at its cross section, the closing segment joining the last and first sections
+        xp = np.concatenate([[points[-1, 0] - lap], points[:, 0], [points[0, 0] + lap]])
+        fp = np.concatenate([[-segments[-1]], arc, [length]])
+        progress = np.full((size, size), np.nan, dtype=np.float32)
+        reached = np.isfinite(distance)
+        progress[reached] = np.interp(np.minimum(distance[reached], lap), xp, fp) % length
+
+        self.progress = progress
+        self.centerline = centerline
+        self.length = float(length)
+
+    def progress_at(self, pos):
+        """
+        Get the progress along the track of some positions
+
+        Args:
+            pos: (array) positions : shape = (..., 2)
+
+        Returns:
+            array of the arc length of the track at each position, in [0, length[ (nan in the walls)
+        """
+        cells = np.clip(np.floor(np.asarray(pos, dtype=float) * self.GRID_SIZE).astype(int), 0, self.GRID_SIZE - 1)
+        return self.progress[cells[..., 0], cells[..., 1]]
+
+    def advance(self, previous, current):
+        """
+        Get the signed progress between two progress values, accounting for the lap wrapping
+        (a car crossing the starting line forward advances by a small positive amount)
+
+        Args:
+            previous: (array) previous progress values
+            current: (array) current progress values
+        """
+        return (np.asarray(current) - previous + self.length / 2) % self.length - self.length / 2
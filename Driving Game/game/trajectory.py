@@ -0,0 +1,150 @@
+import os
+import json
+import numpy as np
+
+# Columns of a trajectory, one row per time step, followed by one column per ray distance
+COLUMNS = ['time', 'x', 'y', 'rot', 'vel', 'acc', 'steer']
+
+class TrajectoryRecorder:
+    """
+    Recording of the trajectory of a player during a simulation, as a growing float32 array
+    with one row per time step (see COLUMNS)
+    """
+    def __init__(self, ray_count, capacity=4096):
+        """
+        Args:
+            ray_count: number of rays of the player
+            capacity: initial number of rows, doubled when full
+        """
+        self.rows = np.zeros((capacity, len(COLUMNS) + ray_count), dtype=np.float32)
+        self.count = 0
+
+    def record(self, time, pos, rot, vel, acc, steer, rays):
+        """
+        Record the state of the player after a time step
+
+        Args:
+            time: elapsed time of the simulation
+            pos: position of the player
+            rot: rotation of the player
+            vel: velocity of the player
+            acc: acceleration applied during the step
+            steer: steering applied during the step
+            rays: distances of the rays seen by the network
+        """
+        if self.count == len(self.rows):
+            self.rows = np.concatenate([self.rows, np.zeros_like(self.rows)])
+        row = self.rows[self.count]
+        row[0], row[1], row[2], row[3], row[4], row[5], row[6] = time, pos[0], pos[1], rot, vel, acc, steer
+        row[len(COLUMNS):] = rays
+        self.count += 1
+
+    def array(self):
+        """
+        Get the recorded rows
+        """
+        return self.rows[:self.count]
+
+class BatchTrajectoryRecorder:
+    """
+    Recording of the trajectories of the players of a batch simulation (see game.batch_game),
+    as a growing float32 array with one row per time step and player, the trajectory of a
+    player being the rows of the steps it was running
+    """
+    def __init__(self, count, ray_count, capacity=1024):
+        """
+        Args:
+            count: number of players
+            ray_count: number of rays of the players
+            capacity: initial number of steps, doubled when full
+        """
+        self.rows = np.zeros((capacity, count, len(COLUMNS) + ray_count), dtype=np.float32)
+        self.count = 0
+
+    def record(self, time, pos, rot, vel, acc, steer, rays):
+        """
+        Record the state of the players after a time step
+
+        Args:
+            time: elapsed time of the simulation
+            pos: (array) position of each player : shape = (players, 2)
+            rot: (array) rotation of each player : shape = (players,)
+            vel: (array) velocity of each player : shape = (players,)
+            acc: (array) acceleration applied during the step : shape = (players,)
+            steer: (array) steering applied during the step : shape = (players,)
+            rays: (array) distances of the rays seen by the networks : shape = (players, rays)
+        """
+        if self.count == len(self.rows):
+            self.rows = np.concatenate([self.rows, np.zeros_like(self.rows)])
+        rows = self.rows[self.count]
+        rows[:, 0] = time
+        rows[:, 1:3] = pos
+        rows[:, 3], rows[:, 4], rows[:, 5], rows[:, 6] = rot, vel, acc, steer
+        rows[:, len(COLUMNS):] = rays
+        self.count += 1
+
+    def array(self, player, steps):
+        """
+        Get the recorded rows of a player
+
+        Args:
+            player: index of the player
+            steps: number of steps the player was running
+        """
+        return self.rows[:steps, player].copy()
+
+def save_trajectories(file, trajectories, agents, **metadata):
+    """
+    Save trajectories as a .npy file with the rows of all the agents one after the other,
+    which is memory mapped when replayed, and a .json index of the rows of each agent
+
+    Args:
+        file: path of the files, without extension
+        trajectories: list of the arrays of rows of each agent (see TrajectoryRecorder)
+        agents: list of dictionaries describing each agent (id, fitness...)
+        metadata: values saved in the index (map, time step...)
+    """
+    os.makedirs(os.path.dirname(file) or '.', exist_ok=True)
+    ray_count = trajectories[0].shape[1] - len(COLUMNS) if trajectories else 0
+    stops = np.cumsum([len(trajectory) for trajectory in trajectories]).tolist()
+    rows = np.concatenate(trajectories) if trajectories else np.zeros((0, len(COLUMNS)), dtype=np.float32)
+    np.save(file + '.npy', rows.astype(np.float32, copy=False))
+
+    index = dict(metadata)
+    index['columns'] = COLUMNS + ['ray{}'.format(i) for i in range(ray_count)]
+    index['agents'] = [dict(agent, start=start, stop=stop) for agent, start, stop in zip(agents, [0] + stops[:-1], stops)]
+    with open(file + '.json', 'w') as f:
+        json.dump(index, f, indent=1)
+
+class Trajectories:
+    """
+    Trajectories saved by save_trajectories, the rows being memory mapped instead of read
+    """
+    def __init__(self, file):
+        """
+        Args:
+            file: path of the files, with or without the .npy or .json extension
+        """
+        file = os.path.splitext(file)[0] if file.endswith(('.npy', '.json')) else file
+        with open(file + '.json', 'r') as f:
+            self.index = json.load(f)
+        self.rows = np.load(file + '.npy', mmap_mode='r')
+        self.agents = self.index['agents']
+        self.ray_count = len(self.index['columns']) - len(COLUMNS)
+
+    def __len__(self):
+        return len(self.agents)
+
+    def agent(self, index):
+        """
+        Get the trajectory of an agent
+
+        Args:
+            index: index of the agent in the file
+
+        Returns:
+            dictionary describing the agent
+            array of its rows (see COLUMNS), a view of the memory mapped file
+        """
+        agent = self.agents[index]
+        return agent, self.rows[agent['start']:agent['stop']]
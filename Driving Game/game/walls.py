@@ -0,0 +1,317 @@
+import os
+import hashlib
+import warnings
+import numpy as np
+from PIL import Image
+
+class WallSegments:
+    """
+    Contours of the walls of a circuit as line segments, extracted from the circuit image
+    with marching squares, and a uniform grid of buckets listing the segments crossing
+    each bucket. The rays and the cars are intersected with the segments of the buckets
+    they cross only: the distances are exact instead of quantized by the cells and the
+    march step, and the cost does not depend on the number of walls. The cost of the rays
+    grows with the number of buckets crossed, so with the view distance, and they are
+    slower than marching in the grid (see game.sensors.cast_rays) at any view distance.
+    """
+    # Number of buckets (per axis) of the grid of segments
+    BUCKETS = 64
+
+    # Sum of the RGB values of a pixel from which it is a wall (as in Grid.load_circuit)
+    LEVEL = 255
+
+    # Segments of each marching squares case, as pairs of the edges of the square they join
+    # (edges 0: a-b, 1: b-c, 2: c-d, 3: d-a, the case being the sum of the corners a: 1, b: 2, c: 4, d: 8
+    # in walls), the cases 16 and 17 being the saddles 5 and 10 with a wall at the center of the square
+    CASES = [[], [(3, 0)], [(0, 1)], [(3, 1)], [(1, 2)], [(3, 0), (1, 2)], [(0, 2)], [(3, 2)],
+             [(2, 3)], [(0, 2)], [(0, 1), (2, 3)], [(1, 2)], [(1, 3)], [(0, 1)], [(3, 0)], [],
+             [(0, 1), (2, 3)], [(3, 0), (1, 2)]]
+
+    def __init__(self, circuit_file, cache=True):
+        """
+        Extract the walls of a circuit file
+
+        Args:
+            circuit_file: File containing the circuit (image file)
+            cache: If True, the walls are read from (or saved to) a cache file next to the circuit file
+        """
+        self.levels = None
+        
+        # Try to read the walls from the cache, the key being the circuit content and the number of buckets
+        cache_file = WallSegments.cache_file(circuit_file) if cache else None
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as data:
+                    self.levels = data['levels'].astype(np.float32)
+                    self.segments = data['segments']
+                    self.buckets = data['buckets']
+            except (OSError, ValueError, KeyError):
+                warnings.warn('Invalid walls cache file: ' + cache_file)
+                self.levels = None
+        
+        if self.levels is None:
+            # Sum of the RGB values of each pixel, indexed as [x, y], surrounded by walls
+            with Image.open(circuit_file) as im:
+                pixels = np.asarray(im.convert('RGB'), dtype=np.float32).transpose(1, 0, 2).sum(axis=2)
+            self.levels = np.pad(pixels, 1, constant_values=3 * 255)
+            self.segments = WallSegments.extract(self.levels)
+            self.buckets = WallSegments.build_buckets(self.segments)
+            if cache_file is not None:
+                self.save_cache(cache_file)
+        self.build_index()
+
+    def from_arrays(levels, segments, buckets):
+        """
+        Create the walls from already built arrays, without reading the circuit file
+
+        Args:
+            levels: Sum of the RGB values of each pixel, with a border of walls
+            segments: Segments of the walls (x0, y0, x1, y1)
+            buckets: Index of the segments of each bucket, -1 for none
+        """
+        instance = WallSegments.__new__(WallSegments)
+        instance.levels = levels
+        instance.segments = segments
+        instance.buckets = buckets
+        instance.build_index()
+        return instance
+
+    def cache_file(circuit_file):
+        """
+        Path of the cache file of the walls of a circuit, in the cache/ folder next to the
+        circuit file as the grids (see Grid.cache_file)
+        
+        Args:
+            circuit_file: File containing the circuit (image file)
+        """
+        with open(circuit_file, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:16]
+        return os.path.join(os.path.dirname(circuit_file), 'cache', 'walls-{}-{}.npz'.format(WallSegments.BUCKETS, digest))
+    
+    def save_cache(self, cache_file):
+        """
+        Save the levels of the pixels, the segments and the buckets in a compressed cache file
+        
+        Args:
+            cache_file: Path of the cache file
+        """
+        # Write to a temporary file first, several processes may extract the same walls
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                np.savez_compressed(f, levels=self.levels.astype(np.uint16), segments=self.segments, buckets=self.buckets)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            warnings.warn('Could not write the walls cache file: ' + cache_file)
+
+    def build_index(self):
+        """
+        Build the arrays read by the rays from the buckets: the start (x, y) and direction
+        (x, y) of the segments of each bucket, nan for none : shape = (4, BUCKETS, BUCKETS, most
+        segments in a bucket), and whether each bucket has segments
+        """
+        segments = np.where(self.buckets >= 0, self.segments[np.maximum(self.buckets, 0)].transpose(3, 0, 1, 2), np.nan)
+        self.bucket_segments = np.stack([segments[0], segments[1], segments[2] - segments[0], segments[3] - segments[1]])
+        self.occupied = np.any(self.buckets >= 0, axis=2)
+
+    def extract(levels):
+        """
+        Extract the contours of the walls with marching squares: the pixel centers are the
+        corners of the squares, and the contour crosses the edges of a square at the level
+        of a wall, interpolated linearly between the corners
+
+        Args:
+            levels: Sum of the RGB values of each pixel, with a border of walls : shape = (width + 2, height + 2)
+
+        Returns:
+            array of the segments (x0, y0, x1, y1), in the coordinates of the grid ([0, 1]) : shape = (segments, 4)
+        """
+        a, b, c, d = levels[:-1, :-1], levels[1:, :-1], levels[1:, 1:], levels[:-1, 1:]
+        x, y = np.meshgrid(np.arange(a.shape[0], dtype=float), np.arange(a.shape[1], dtype=float), indexing='ij')
+
+        # Case of each square, the saddles being separated by the level at their center
+        level = WallSegments.LEVEL
+        case = (a >= level) * 1 + (b >= level) * 2 + (c >= level) * 4 + (d >= level) * 8
+        center = (a + b + c + d) / 4 >= level
+        case = np.where((case == 5) & center, 16, np.where((case == 10) & center, 17, case))
+
+        # Points where the contour crosses the edges of the squares
+        with np.errstate(divide='ignore', invalid='ignore'):
+            edges = [np.stack([x + (level - a) / (b - a), y], axis=-1),
+                     np.stack([x + 1, y + (level - b) / (c - b)], axis=-1),
+                     np.stack([x + 1 - (level - c) / (d - c), y + 1], axis=-1),
+                     np.stack([x, y + 1 - (level - d) / (a - d)], axis=-1)]
+
+        segments = []
+        for index, pairs in enumerate(WallSegments.CASES):
+            squares = case == index
+            for first, second in pairs:
+                segments.append(np.concatenate([edges[first][squares], edges[second][squares]], axis=1))
+        segments = np.concatenate(segments)
+
+        # The corner (0, 0) is the center of the border pixel before the first pixel of the image
+        size = np.array(levels.shape, dtype=float) - 2
+        return (segments - 0.5) / np.tile(size, 2)
+
+    def build_buckets(segments):
+        """
+        List the segments overlapping each bucket (by their bounding box)
+
+        Args:
+            segments: array of the segments (x0, y0, x1, y1)
+
+        Returns:
+            array of the segments of each bucket, padded with -1 : shape = (BUCKETS, BUCKETS, most segments in a bucket)
+        """
+        count = WallSegments.BUCKETS
+        first = np.clip(np.floor(np.minimum(segments[:, :2], segments[:, 2:]) * count), 0, count - 1).astype(int)
+        last = np.clip(np.floor(np.maximum(segments[:, :2], segments[:, 2:]) * count), 0, count - 1).astype(int)
+
+        # Buckets of each segment, in a fixed window covering any bounding box
+        span = np.max(last - first, initial=0) + 1
+        buckets_x = np.minimum(first[:, 0, None, None] + np.arange(span)[None, :, None], last[:, 0, None, None])
+        buckets_y = np.minimum(first[:, 1, None, None] + np.arange(span)[None, None, :], last[:, 1, None, None])
+        keys = (buckets_x * count + buckets_y) * len(segments) + np.arange(len(segments))[:, None, None]
+        keys = np.unique(keys)
+        bucket, segment = keys // len(segments), keys % len(segments)
+
+        # Rank of each segment in its bucket, the keys being sorted by bucket
+        starts = np.searchsorted(bucket, bucket)
+        rank = np.arange(len(bucket)) - starts
+        table = np.full((count * count, np.max(rank, initial=-1) + 1), -1, dtype=np.int32)
+        table[bucket, rank] = segment
+        return table.reshape(count, count, -1)
+
+    def inside(self, points):
+        """
+        Check whether points are in the walls, interpolating the levels of the pixels as the
+        contours do. The points outside the grid are in the walls.
+
+        Args:
+            points: (array) coordinates of the points : shape = (points, 2)
+        """
+        size = np.array(self.levels.shape) - 2
+        outside = np.any((points < 0) | (points > 1), axis=1)
+
+        # Bilinear interpolation between the centers of the pixels
+        u = np.clip(points, 0, 1) * size + 0.5
+        cell = np.minimum(np.floor(u).astype(int), size)
+        f = u - cell
+        x, y = cell[:, 0], cell[:, 1]
+        level = (self.levels[x, y] * (1 - f[:, 0]) * (1 - f[:, 1]) + self.levels[x + 1, y] * f[:, 0] * (1 - f[:, 1]) +
+                 self.levels[x + 1, y + 1] * f[:, 0] * f[:, 1] + self.levels[x, y + 1] * (1 - f[:, 0]) * f[:, 1])
+        return outside | (level >= WallSegments.LEVEL)
+
+    def cast(self, pos, angles, view_distance):
+        """
+        Intersect the rays with the segments of the buckets they cross, all at once: the
+        buckets crossed by a ray are found from the distances at which it crosses their
+        boundaries, and its distance is the nearest intersection with their segments.
+        A ray starting in a wall hits it at distance 0, and a ray leaving the grid hits
+        its border.
+
+        Args:
+            pos: (array) origin of the rays of each car : shape = (cars, 2)
+            angles: (array) angle of each ray : shape = (cars, rays)
+            view_distance: maximum distance of a ray
+
+        Returns:
+            array of the ray distances : shape = (cars, rays)
+            boolean array of the rays hitting a wall : shape = (cars, rays)
+        """
+        count = WallSegments.BUCKETS
+        origin = np.broadcast_to(pos[:, None, :], angles.shape + (2,)).reshape(-1, 2)
+        direction = np.stack([np.cos(angles), np.sin(angles)], axis=-1).reshape(-1, 2)
+
+        # Distances at which the rays cross the boundaries of the buckets along each axis, in order
+        crossed = np.arange(int(np.ceil(view_distance * count)) + 1)
+        cell = origin * count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            boundaries = np.where(direction > 0, np.floor(cell) + 1, np.ceil(cell) - 1)[..., None] + np.sign(direction)[..., None] * crossed
+            crossings = np.where(direction[..., None] != 0, (boundaries / count - origin[..., None]) / direction[..., None], np.inf)
+        crossings = np.sort(crossings.reshape(len(origin), -1), axis=1)
+
+        # Bucket crossed by the rays from each distance : shape = (rays, buckets)
+        entries = np.concatenate([np.zeros((len(origin), 1)), crossings], axis=1)
+        middles = (entries + np.minimum(np.concatenate([crossings, entries[:, -1:] + 1 / count], axis=1), entries + 1 / count)) / 2
+        x = np.floor((origin[:, 0, None] + middles * direction[:, 0, None]) * count).astype(int)
+        y = np.floor((origin[:, 1, None] + middles * direction[:, 1, None]) * count).astype(int)
+        inside = (x >= 0) & (x < count) & (y >= 0) & (y < count)
+        seen = entries < view_distance
+
+        # Intersect the rays with the segments of the buckets with segments : shape = (crossed buckets, bucket segments)
+        ray, slot = np.nonzero(seen & inside & self.occupied[np.clip(x, 0, count - 1), np.clip(y, 0, count - 1)])
+        start_x, start_y, edge_x, edge_y = self.bucket_segments[:, x[ray, slot], y[ray, slot]]
+        start_x, start_y = start_x - origin[ray, 0, None], start_y - origin[ray, 1, None]
+        d_x, d_y = direction[ray, 0, None], direction[ray, 1, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            denom = d_x * edge_y - d_y * edge_x
+            t_hit = (start_x * edge_y - start_y * edge_x) / denom
+            s_hit = (start_x * d_y - start_y * d_x) / denom
+        t_hit = np.min(np.where((t_hit >= 0) & (s_hit >= 0) & (s_hit <= 1), t_hit, np.inf), axis=1)
+        t = np.full(len(origin), np.inf)
+        np.minimum.at(t, ray, t_hit)
+
+        # The rays leaving the grid hit its border, the rays starting in a wall hit it at once
+        t = np.minimum(t, np.min(np.where(seen & ~inside, entries, np.inf), axis=1))
+        t[self.inside(origin)] = 0.0
+        hit = t < view_distance
+        t = np.where(hit, t, view_distance)
+        return t.reshape(angles.shape), hit.reshape(angles.shape)
+
+    def collisions(self, center, forward, left, width, height):
+        """
+        Test the rotated rectangle of each car against the segments of the buckets of its
+        bounding box, clipping each segment to the rectangle in the frame of the car. A car
+        whose center is in a wall also collides.
+
+        Args:
+            center: (array) center of each car : shape = (cars, 2)
+            forward: (array) forward direction of each car : shape = (cars, 2)
+            left: (array) left direction of each car : shape = (cars, 2)
+            width: car width
+            height: car height
+
+        Returns:
+            boolean array of the cars hitting a wall : shape = (cars,)
+            array of the segments hit by the cars
+        """
+        count = WallSegments.BUCKETS
+        extent = np.abs(forward) * height / 2 + np.abs(left) * width / 2
+        first = np.clip(np.floor((center - extent) * count), 0, count - 1).astype(int)
+        last = np.clip(np.floor((center + extent) * count), 0, count - 1).astype(int)
+        collided = self.inside(center)
+
+        # Segments of the buckets of each car, in a fixed window covering any bounding box : shape = (cars, candidates)
+        span = np.max(last - first, initial=0) + 1
+        buckets_x = np.minimum(first[:, 0, None, None] + np.arange(span)[None, :, None], last[:, 0, None, None])
+        buckets_y = np.minimum(first[:, 1, None, None] + np.arange(span)[None, None, :], last[:, 1, None, None])
+        candidates = self.buckets[buckets_x, buckets_y].reshape(len(center), -1)
+
+        # Only test the cars near a segment
+        near = np.flatnonzero(np.any(candidates >= 0, axis=1))
+        if len(near) == 0:
+            return collided, np.zeros(0, dtype=int)
+        candidates = candidates[near]
+        segments = self.segments[np.maximum(candidates, 0)]
+
+        # Ends of the segments in the frame of the car (forward, left)
+        start = segments[..., :2] - center[near, None, :]
+        edge = segments[..., 2:] - segments[..., :2]
+        lower, upper = np.zeros(candidates.shape), np.ones(candidates.shape)
+        for axis, half in ((forward[near], height / 2), (left[near], width / 2)):
+            p = start[..., 0] * axis[:, 0, None] + start[..., 1] * axis[:, 1, None]
+            dp = edge[..., 0] * axis[:, 0, None] + edge[..., 1] * axis[:, 1, None]
+
+            # Part of the segment between the two sides of the rectangle on this axis
+            with np.errstate(divide='ignore', invalid='ignore'):
+                s1, s2 = (-half - p) / dp, (half - p) / dp
+            parallel = dp == 0
+            between = np.abs(p) <= half
+            lower = np.maximum(lower, np.where(parallel, np.where(between, -np.inf, np.inf), np.minimum(s1, s2)))
+            upper = np.minimum(upper, np.where(parallel, np.where(between, np.inf, -np.inf), np.maximum(s1, s2)))
+
+        hits = (candidates >= 0) & (lower <= upper)
+        collided[near] |= np.any(hits, axis=1)
+        return collided, np.unique(candidates[hits])
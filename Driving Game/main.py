@@ -1,13 +1,25 @@
 import os
 import time
+import multiprocessing
 import numpy as np
 from brain.neat import NeatAlgorithm
+from brain.compiled_network import CompiledNetwork, PopulationNetwork
 from game.game import Game
-from game.grid import Grid
-from multiprocessing import Pool
+from game.batch_game import BatchGame
+from game.maps import MapRegistry
+from game.trajectory import TrajectoryRecorder, BatchTrajectoryRecorder, Trajectories, save_trajectories
+from game.simulation import SimulationThread
+from game.sensors import cast_rays
+from game.termination import TerminationPolicy, TERMINATION_REASONS, MAX_TIME
+from brain.evaluator import Evaluator, StateStream, attach_grid, attach_states
+from brain.distributed import DistributedEvaluator
+from brain.archive import GenomeArchive
+from brain.species_statistics import SpeciesStatistics
+from brain.manifest import RunManifest
+from brain.fitness_cache import FitnessCache, network_digest, context_digest, code_digest
+from brain.instrumentation import PhaseTimer, WorkerProfiler, profile_task, write_generation_timings
 from neat.six_util import iteritems
 import warnings
-import csv
 
 
 def map_outputs(output, dt, player):
@@ -33,39 +45,349 @@ def map_outputs(output, dt, player):
     
     return acc, steer
 
-def run_simulation(args):
+def map_outputs_batch(outputs, dt, player):
     """
-    Run the simulation for a player and return the fitness
+    Map the outputs from a batch of NEAT networks to the acceleration and steering values
     
     Args:
-        args: tuple (game, (network, (PLAYER_MAX_TIME, PLAYER_RAY_COUNT)))
+        outputs: (array) output values of each network : shape = (count, 4), see map_outputs
+        dt: time step for the simulation
+        player: player holding the physical car performance
+    """
+    outputs = np.asarray(outputs)
+    acc = np.where(outputs[:, 0] >= 0.5, outputs[:, 1], 0.0)
+    acc = (acc * 2.0 * player.max_acc - player.max_acc) / player.acc_mult
+    acc = np.where(outputs[:, 2] >= 0.5, acc - player.brake_acc, acc)
+    steer = (outputs[:, 3] * 2.0 * player.max_steer - player.max_steer) / player.steer_mult
+    return acc, steer
+
+def run_simulation(args, recorder=None):
+    """
+    Run the simulation for a player and return the fitness, the termination reason, the number
+    of simulated steps and the wall time of the simulation
+    
+    Args:
+        args: tuple (grid, PLAYER_POS, network, (PLAYER_MAX_TIME, PLAYER_RAY_COUNT, DT, TERMINATION, CONTROL_PERIOD, PHYSICS_SUBSTEPS)),
+              the grid being a grid instance or a shared grid descriptor
+        recorder: TrajectoryRecorder recording the state of the player at each step (None for no recording)
     """
     # Get the arguments
-    game, (network, (PLAYER_MAX_TIME, PLAYER_RAY_COUNT)) = args
+    grid, player_pos, network, (PLAYER_MAX_TIME, PLAYER_RAY_COUNT, DT, TERMINATION, CONTROL_PERIOD, PHYSICS_SUBSTEPS) = args
+    game = Game(attach_grid(grid), player_pos, DT, PHYSICS_SUBSTEPS)
+    monitor = (TERMINATION or TerminationPolicy()).monitor(1, game.grid.track)
+    start_time = time.perf_counter()
     
     # Run the game for each player
     elapsed_time = 0.0
+    steps = 0
     while not game.game_over and elapsed_time < PLAYER_MAX_TIME:
-        # Get the inputs of the current game state
-        inputs = game.get_inputs(PLAYER_RAY_COUNT)
-        
-        # Get the outputs from the neat network
-        outputs = network.activate(inputs)
+        # Choose a new action every CONTROL_PERIOD steps, the last action being held in between
+        if steps % CONTROL_PERIOD == 0:
+            # Get the inputs of the current game state
+            inputs = game.get_inputs(PLAYER_RAY_COUNT)
+            
+            # Get the outputs from the neat network
+            outputs = network.activate(inputs)
+            acc, steer = map_outputs(outputs, game.dt, game.player)
         
         # Execute the action on the game
-        acc, steer = map_outputs(outputs, game.dt, game.player)
         game.update(acc, steer)
         
         # Update the elapsed time
         elapsed_time += game.dt
+        steps += 1
+        if recorder is not None:
+            recorder.record(elapsed_time, game.player.pos, game.player.rot, game.player.vel[0], acc, steer, inputs[1:])
+        
+        # Stop the players which do not drive anymore
+        if not game.game_over and monitor.update(elapsed_time, game.player.vel[0], game.player.pos, np.ones(1, dtype=bool))[0]:
+            game.game_over = True
         
     # Compute fitness for the players
     fitness_params = game.get_fitness_parameters()
+    return fitness_params[0], int(monitor.finish(game.game_over)[0]), steps, time.perf_counter() - start_time
+
+def record_simulation(args):
+    """
+    Run the simulation for a player, recording its trajectory if requested (see run_simulation)
+    
+    Args:
+        args: tuple (grid, PLAYER_POS, network, parameters, record) as for run_simulation, the trajectory
+              being recorded if record is not 0
+        
+    Returns:
+        result of run_simulation
+        array of the recorded trajectory (see game.trajectory), None if not recorded
+    """
+    recorder = TrajectoryRecorder(args[3][1]) if args[4] else None
+    result = run_simulation(args[:4], recorder)
+    return result, recorder.array() if recorder is not None else None
+
+def network_controller(net):
+    """
+    Controller of a game simulated in its own thread (see SimulationThread) by a network,
+    choosing a new action every CONTROL_PERIOD steps as during the training
+    
+    Args:
+        net: the network driving the player
+    """
+    control_step = 0
+    action = None
+    def control(game):
+        nonlocal control_step, action
+        if control_step % CONTROL_PERIOD == 0:
+            # Get the inputs of the current game state, keeping the rays to display them
+            player = game.player
+            distances, hits = cast_rays(game.grid, player.pos, player.rot, PLAYER_RAY_COUNT, player.fov, player.view_distance, player.wall_dx, return_hits=True)
+            
+            # Get the outputs from the neat network
+            outputs = net.activate((player.vel[0], *distances[0]))
+            action = (*map_outputs(outputs, game.dt, player), (distances[0], hits[0]))
+        control_step += 1
+        return action
+    return control
+
+def run_batch_simulation(args, recorder=None):
+    """
+    Run the simulation for a batch of players sharing the same grid and return their fitnesses,
+    termination reasons, numbers of simulated steps and the wall time of the batch simulation
+    
+    Args:
+        args: tuple (grid, PLAYER_POS, networks, (PLAYER_MAX_TIME, PLAYER_RAY_COUNT, DT, TERMINATION, CONTROL_PERIOD, PHYSICS_SUBSTEPS), stream),
+              the grid being a grid instance or a shared grid descriptor, and stream the (states descriptor, agent
+              index of each network) streaming the states of the players to the population viewer, or None
+        recorder: BatchTrajectoryRecorder recording the states of the players at each step (None for no recording)
+    """
+    # Get the arguments
+    grid, player_pos, networks, (PLAYER_MAX_TIME, PLAYER_RAY_COUNT, DT, TERMINATION, CONTROL_PERIOD, PHYSICS_SUBSTEPS), stream = args
+    game = BatchGame(attach_grid(grid), player_pos, len(networks), DT, PHYSICS_SUBSTEPS)
+    monitor = (TERMINATION or TerminationPolicy()).monitor(len(networks), game.grid.track)
+    if stream is not None:
+        states, agents = attach_states(stream[0]), stream[1]
+    
+    # Evaluate the compiled networks all at once
+    population_network = None
+    if all(isinstance(network, CompiledNetwork) for network in networks):
+        population_network = PopulationNetwork(networks)
+    
+    # Run the game for all the players at once
+    start_time = time.perf_counter()
+    elapsed_time = 0.0
+    step = 0
+    steps = np.zeros(len(networks), dtype=int)
+    outputs = np.zeros((len(networks), 4))
+    while not np.all(game.game_over) and elapsed_time < PLAYER_MAX_TIME:
+        # Choose new actions every CONTROL_PERIOD steps, the last actions being held in between
+        if step % CONTROL_PERIOD == 0:
+            # Get the inputs of the current game state
+            inputs = game.get_inputs(PLAYER_RAY_COUNT)
+            
+            # Get the outputs from the neat networks of the players still running
+            if population_network is not None:
+                outputs = population_network.activate(inputs)
+            else:
+                for i in np.flatnonzero(~game.game_over):
+                    outputs[i] = networks[i].activate(inputs[i])
+            acc, steer = map_outputs_batch(outputs, game.dt, game.player)
+        
+        # Execute the actions on the game
+        step += 1
+        steps += ~game.game_over
+        game.update(acc, steer)
+        
+        # Update the elapsed time
+        elapsed_time += game.dt
+        if recorder is not None:
+            recorder.record(elapsed_time, game.pos, game.rot, game.vel, acc, steer, inputs[:, 1:])
+        
+        # Stop the players which do not drive anymore
+        game.game_over |= monitor.update(elapsed_time, game.vel, game.pos, ~game.game_over)
+        
+        # Publish the states of the players to the population viewer
+        if stream is not None:
+            states[agents, 0:2] = game.pos
+            states[agents, 2] = game.rot
+            states[agents, 3] = np.where(game.game_over, StateStream.STOPPED, StateStream.RUNNING)
+    
+    # Compute fitness for the players
+    fitness_params = game.get_fitness_parameters()
+    wall_time = time.perf_counter() - start_time
+    return [(fitness, reason, agent_steps, wall_time) for fitness, reason, agent_steps in
+            zip(fitness_params[0].tolist(), monitor.finish(game.game_over).tolist(), steps.tolist())]
+
+def record_batch_simulation(args):
+    """
+    Run the simulation for a batch of players, recording the trajectories of the best ones (see run_batch_simulation)
+    
+    Args:
+        args: tuple (grid, PLAYER_POS, networks, parameters, stream, record) as for run_batch_simulation, record
+              being the number of the best players of the batch whose trajectories are returned
+        
+    Returns:
+        result of run_batch_simulation
+        dictionary {index of the player in the batch: array of its recorded trajectory (see game.trajectory)}
+    """
+    record = args[5]
+    recorder = BatchTrajectoryRecorder(len(args[2]), args[3][1]) if record > 0 else None
+    results = run_batch_simulation(args[:5], recorder)
+    if recorder is None:
+        return results, {}
+    best = np.argsort([result[0] for result in results])[::-1][:record]
+    return results, {int(i): recorder.array(i, results[i][2]) for i in best}
+
+def simulate_maps(maps, networks, profiler=None, stream=None, record=None):
+    """
+    Simulate all the networks on several maps using the workers of the evaluator, the
+    (network, map) tasks of all the maps being evaluated in a single parallel batch.
+    The networks whose results are in the fitness cache are not simulated again.
+    The trajectories are recorded during the simulations, the networks found in the
+    fitness cache having been recorded in the generation which simulated them.
+    
+    Args:
+        maps: list of the (grid, player_pos, map_name) of the maps (see game.maps.MapEntry),
+              each grid being shared once with the workers under the name of its map
+        networks: list of networks to evaluate
+        profiler: WorkerProfiler profiling the simulations in the workers (None for no profiling)
+        stream: (map name, states descriptor) streaming the states of the networks simulated on this map to
+                the population viewer, the agents being the networks (see StateStream), None for no stream
+        record: (map name, count) recording the trajectories of the count best networks simulated on this map,
+                None for no recording
+        
+    Returns:
+        dictionary {map name: (fitnesses, reasons, telemetry)} with
+            the list of the fitness of each network
+            the list of the termination reason of each network (see game.termination)
+            the list of the (simulated steps, simulation wall time) of each network,
+            (0, 0.0) for the networks found in the fitness cache
+        (if record) dictionary {network index: array of its recorded trajectory} of the best networks
+            simulated on the recorded map (see game.trajectory), at least count of them if simulated
+    """
+    params = (PLAYER_MAX_TIME, PLAYER_RAY_COUNT, DT, TERMINATION, CONTROL_PERIOD, PHYSICS_SUBSTEPS)
+    if record is None:
+        function = run_batch_simulation if BATCH_SIMULATION else run_simulation
+    else:
+        function = record_batch_simulation if BATCH_SIMULATION else record_simulation
+    digests = [network_digest(network) for network in networks] if fitness_cache is not None else None
+    
+    # Tasks of all the maps, a map listed twice being simulated once
+    args = []
+    simulated = [] # (map name, index of the networks simulated on the map, their cache keys)
+    results = {}   # map name -> result of each network
+    for grid, player_pos, grid_name in maps:
+        if grid_name in results:
+            continue
+        results[grid_name] = [None] * len(networks)
+        
+        # Get the results of the networks already simulated in this context, with the same evaluation
+        # path (the batch simulation and the compiled networks may differ in the last bits)
+        keys = [None] * len(networks)
+        if fitness_cache is not None:
+            context = context_digest(grid_name, grid, player_pos, list(params) + [BATCH_SIMULATION, COMPILED_NETWORKS], simulator_code)
+            for i, digest in enumerate(digests):
+                keys[i] = FitnessCache.key(digest, context)
+                cached = fitness_cache.get(keys[i])
+                if cached is not None:
+                    results[grid_name][i] = cached + (0, 0.0)
+            
+            # Show the networks found in the cache in the population viewer, as they are not simulated
+            if stream is not None and stream[0] == grid_name:
+                hits = [i for i, result in enumerate(results[grid_name]) if result is not None]
+                population_stream.show_cached(hits, [keys[i] for i in hits])
+        indices = [i for i, result in enumerate(results[grid_name]) if result is None]
+        if not indices:
+            continue
+        simulated.append((grid_name, indices, keys))
+        
+        shared_grid = evaluator.publish(grid_name, grid)
+        if BATCH_SIMULATION:
+            # Split the networks in one batch per worker, each batch being simulated at once
+            batches = np.array_split(np.array(indices), min(len(indices), evaluator.processes))
+            streamed = stream is not None and stream[0] == grid_name
+            tasks = [(shared_grid, player_pos, [networks[i] for i in batch], params, (stream[1], batch) if streamed else None) for batch in batches]
+        else:
+            # Evaluate the fitness of each network
+            tasks = [(shared_grid, player_pos, networks[i], params) for i in indices]
+        if record is not None:
+            # Number of the best networks of each task whose trajectories are recorded (the best networks
+            # of the batches including the best networks of the map)
+            count = record[1] if record[0] == grid_name else 0
+            tasks = [task + (count,) for task in tasks]
+        args += tasks
+    
+    if profiler is not None:
+        outputs = evaluator.map(profile_task, profiler.wrap(function, args)) if args else []
+    else:
+        outputs = evaluator.map(function, args) if args else []
+    
+    # Separate the recorded trajectories from the results, indexed by the position of the networks in the tasks
+    trajectories = {}
+    if record is not None:
+        if BATCH_SIMULATION:
+            offsets = np.cumsum([0] + [len(task[2]) for task in args]).tolist()
+            trajectories = {offsets[k] + i: trajectory for k, (_, batch) in enumerate(outputs) for i, trajectory in batch.items()}
+        else:
+            trajectories = {k: trajectory for k, (_, trajectory) in enumerate(outputs) if trajectory is not None}
+        outputs = [output for output, _ in outputs]
+    if BATCH_SIMULATION:
+        outputs = [output for batch in outputs for output in batch]
+    
+    # Dispatch the results of the simulations and the trajectories to their maps, and cache them
+    task = 0
+    recorded = {}
+    for grid_name, indices, keys in simulated:
+        for i in indices:
+            results[grid_name][i] = outputs[task]
+            if task in trajectories:
+                recorded[i] = trajectories[task]
+            if fitness_cache is not None:
+                fitness_cache.put(keys[i], results[grid_name][i][:2])
+            task += 1
+    
+    # Keep the final states of the networks streamed to the population viewer, to show them when they are cached
+    if stream is not None and fitness_cache is not None:
+        for grid_name, indices, keys in simulated:
+            if grid_name == stream[0]:
+                population_stream.remember(indices, [keys[i] for i in indices])
+    
+    simulations = {}
+    for grid_name, map_results in results.items():
+        fitnesses, reasons, steps, wall_times = zip(*map_results)
+        simulations[grid_name] = (list(fitnesses), list(reasons), list(zip(steps, wall_times)))
+    return (simulations, recorded) if record is not None else simulations
+
+def simulate_population(grid_name, grid, player_pos, networks, profiler=None):
+    """
+    Simulate all the networks on a grid using the workers of the evaluator
+    
+    Args:
+        grid_name: name of the map, the grid being shared once with the workers under this name
+        grid: the grid instance
+        player_pos: spawn point of the players
+        networks: list of networks to evaluate
+        profiler: WorkerProfiler profiling the simulations in the workers (None for no profiling)
+        
+    Returns:
+        list of the fitness of each network
+        list of the termination reason of each network (see game.termination)
+        list of the (simulated steps, simulation wall time) of each network
+    """
+    return simulate_maps([(grid, player_pos, grid_name)], networks, profiler)[grid_name]
+
+def report_terminations(fitnesses, reasons):
+    """
+    Print how the simulations of the agents ended, and warn about the agents running out of time
     
-     # Check if out of time
-    if elapsed_time >= PLAYER_MAX_TIME and fitness_params[0] > 0.1:
-        warnings.warn('Agent out of time')
-    return fitness_params[0]
+    Args:
+        fitnesses: list of the fitness of each agent
+        reasons: list of the termination reason of each agent
+    """
+    counts = np.bincount(reasons, minlength=len(TERMINATION_REASONS))
+    print('Terminations: ' + ', '.join('{} {}'.format(name, count) for name, count in zip(TERMINATION_REASONS, counts) if count > 0))
+    
+    # Check if out of time
+    out_of_time = sum(1 for fitness, reason in zip(fitnesses, reasons) if reason == MAX_TIME and fitness > 0.1)
+    if out_of_time > 0:
+        warnings.warn('{} agents out of time'.format(out_of_time))
 
 def eval_genomes(genomes, current_config):
     """
@@ -80,65 +402,230 @@ def eval_genomes(genomes, current_config):
     neat.config = current_config
     generation = neat.population.generation
     
-    if np.random.rand() < PROB_CHANGE_MAP:
-        grid, PLAYER_POS, map_name = load_map(MAP_FOLDER)
+    # Time the phases of the generation, and profile the workers if requested
+    timer = PhaseTimer()
+    profiler = WorkerProfiler() if PROFILE_WORKERS else None
+    
+    with timer.phase('load_map'):
+        if np.random.rand() < PROB_CHANGE_MAP:
+            grid, PLAYER_POS, map_name = maps.select(MAP_FOLDER)
 
-    # Run each genome
-    with Pool() as pool:
-        # Create the game instances and the networks
-        games = [Game(grid, PLAYER_POS, DT) for _ in range(len(genomes))]
-        neat_networks = [neat.create_network(genome) for _, genome in genomes]
-        # Evaluate the fitness of each genome
-        args = zip(games, zip(neat_networks, [(PLAYER_MAX_TIME, PLAYER_RAY_COUNT)] * len(genomes)))
-        fitnesses = pool.map(run_simulation, args)
-        
-        if BENCHMARK_PAILLON:
-            # Evaluate the fitness on a single map for benchmarking
-            grid_bench, PLAYER_POS_bench, _ = load_map('maps/circuit_paillon/')
-            games_bench = [Game(grid_bench, PLAYER_POS_bench, DT) for _ in range(len(genomes))]
-            args_bench = zip(games_bench, zip(neat_networks, [(PLAYER_MAX_TIME, PLAYER_RAY_COUNT)] * len(genomes)))
-            fitnesses_bench = pool.map(run_simulation, args_bench)
-        
-        # Set the fitness of each genome as benchmark value to save
-        for i, (_, genome) in enumerate(genomes):
-            genome.fitness = fitnesses_bench[i] * 10.0 if BENCHMARK_PAILLON else fitnesses[i] * 10.0
-        
-        # Save the species statistics as (generation, specie_id, agent_id, fitness) lines in a csv file
+    # Create the networks
+    with timer.phase('create_networks'):
+        if COMPILED_NETWORKS:
+            neat_networks = [neat.compile_network(genome) for _, genome in genomes]
+        else:
+            neat_networks = [neat.create_network(genome) for _, genome in genomes]
+    
+    # Evaluate the fitness of each genome, on the training map and on a single map for benchmarking
+    evaluated_maps = [(grid, PLAYER_POS, map_name)]
+    if BENCHMARK_PAILLON:
+        evaluated_maps.append(maps['circuit_paillon'])
+    
+    # Stream the agents simulated on the training map to the population viewer, while its window is open
+    stream = None
+    if population_stream is not None and population_viewer.is_alive():
+        genome_to_species = neat.population.species.genome_to_species
+        species = [genome_to_species.get(genome_id, -1) for genome_id, _ in genomes]
+        stream = (map_name, population_stream.begin(generation, map_name, species))
+    # Record the trajectories of the best genomes on the training map during the simulation, to replay them
+    with timer.phase('simulate'):
+        if RECORD_TRAJECTORIES > 0:
+            simulations, trajectories = simulate_maps(evaluated_maps, neat_networks, profiler, stream, (map_name, RECORD_TRAJECTORIES))
+        else:
+            simulations = simulate_maps(evaluated_maps, neat_networks, profiler, stream)
+    fitnesses, reasons, telemetry = simulations[map_name]
+    report_terminations(fitnesses, reasons)
+    cache_counts = None
+    if fitness_cache is not None:
+        cache_counts = fitness_cache.take_counts()
+        print('Fitness cache: {} hits, {} misses ({} results cached)'.format(cache_counts['hits'], cache_counts['misses'], len(fitness_cache)))
+    if BENCHMARK_PAILLON:
+        fitnesses_bench, reasons_bench, _ = simulations['circuit_paillon']
+    
+    if RECORD_TRAJECTORIES > 0:
+        with timer.phase('save_trajectories'):
+            save_best_trajectories(genomes, trajectories, fitnesses, reasons, generation)
+    
+    # Set the fitness of each genome as benchmark value to save
+    for i, (_, genome) in enumerate(genomes):
+        genome.fitness = fitnesses_bench[i] * 10.0 if BENCHMARK_PAILLON else fitnesses[i] * 10.0
+        genome.termination = reasons_bench[i] if BENCHMARK_PAILLON else reasons[i]
+    
+    # Save the species statistics as (generation, specie_id, agent_id, fitness, termination) rows
+    with timer.phase('save_statistics'):
         save_species_statistics(neat.population.species.species, generation)
-        
-        # save all genomes
+    
+    # save all genomes
+    with timer.phase('save_genomes'):
         if SAVE_BEST_GENOME_ONLY:
             os.makedirs(SAVING_FOLDER, exist_ok=True)
             best = np.argmax(fitnesses)
             name_save = SAVING_FOLDER + 'gen{}-fit{:.3f}-'.format(generation, genome.fitness) + map_name[8:]
             neat.save_genome(name_save, genomes[best][1])
         else:
-            gen_folder = SAVING_FOLDER + 'gen{}-'.format(generation)  + map_name[8:] + '/'
-            os.makedirs(gen_folder, exist_ok=True)
-            for i, (genome_id, genome) in enumerate(genomes):
-                neat.save_genome(gen_folder + 'id{}-fit{:.3f}'.format(genome_id, genome.fitness), genome)
+            # Append the genomes to the archive of the run, written in the background
+            for genome_id, genome in genomes:
+                archive.add(generation, genome_id, genome, genome.fitness, map_name)
+    
+    # Save the timings of the generation next to the species statistics
+    agents = [{'id': genome_id, 'steps': steps, 'steps_per_sec': steps / wall_time if wall_time > 0 else None,
+               'termination': TERMINATION_REASONS[reason]}
+              for (genome_id, _), (steps, wall_time), reason in zip(genomes, telemetry, reasons)]
+    write_generation_timings(SAVING_FOLDER + 'timings.jsonl', generation, map_name, timer.phases, agents, cache_counts)
+    if profiler is not None:
+        profiler.save(SAVING_FOLDER + 'profile-gen{}'.format(generation))
+    
+    # Update the manifest of the run with the summary of the generation
+    manifest.add_generation(generation, map_name, [fitness * 10.0 for fitness in fitnesses], [genome_id for genome_id, _ in genomes],
+                            [fitness * 10.0 for fitness in fitnesses_bench] if BENCHMARK_PAILLON else None,
+                            sum(timer.phases.values()), archive.take_written() if archive is not None else ())
+    
+    # Correct the fitness of each genome to the training run value for training
+    for i, (_, genome) in enumerate(genomes):
+        genome.fitness = fitnesses[i] * 10.0
+        genome.termination = reasons[i]
+
+
+def evolve_async(generations):
+    """
+    Evolve the population without generation barrier (see brain.steady_state): the genomes
+    are evaluated one by one on the training map as soon as a worker is free, and each
+    window of pop_size evaluations is saved as a generation
+    
+    Args:
+        generations: number of generations to run
+    """
+    if PROB_CHANGE_MAP > 0 or BENCHMARK_PAILLON or PROFILE_WORKERS:
+        warnings.warn('The asynchronous evolution trains on a single map, without benchmark map and worker profiles')
+    shared_grid = evaluator.publish(map_name, grid)
+    params = (PLAYER_MAX_TIME, PLAYER_RAY_COUNT, DT, TERMINATION, CONTROL_PERIOD, PHYSICS_SUBSTEPS)
+    if fitness_cache is not None:
+        context = context_digest(map_name, grid, PLAYER_POS, list(params) + [False, COMPILED_NETWORKS], simulator_code) # one game per genome
+    keys = {}    # genome id -> fitness cache key of the genomes under evaluation
+    results = {} # genome id -> (fitness, termination reason, simulated steps, simulation wall time)
+    
+    def evaluate(genome, done):
+        network = neat.compile_network(genome) if COMPILED_NETWORKS else neat.create_network(genome)
+        if fitness_cache is not None:
+            keys[genome.key] = FitnessCache.key(network_digest(network), context)
+            cached = fitness_cache.get(keys[genome.key])
+            if cached is not None:
+                done(cached + (0, 0.0))
+                return
+        evaluator.submit(run_simulation, (shared_grid, PLAYER_POS, network, params), done, lambda error: done(None, error))
+    
+    def set_result(genome, result):
+        genome.fitness = result[0] * 10.0
+        genome.termination = result[1]
+        results[genome.key] = result
+        key = keys.pop(genome.key, None)
+        if key is not None and result[2] > 0:
+            fitness_cache.put(key, result[:2])
+    
+    start_time = [time.perf_counter()]
+    def end_generation(genomes):
+        generation = neat.population.generation
+        fitnesses, reasons, steps, wall_times = zip(*(results.pop(genome_id) for genome_id, _ in genomes))
+        report_terminations(fitnesses, reasons)
+        cache_counts = None
+        if fitness_cache is not None:
+            cache_counts = fitness_cache.take_counts()
+            print('Fitness cache: {} hits, {} misses ({} results cached)'.format(cache_counts['hits'], cache_counts['misses'], len(fitness_cache)))
         
-        # Correct the fitness of each genome to the training run value for training
-        for i, (_, genome) in enumerate(genomes):
-            genome.fitness = fitnesses[i] * 10.0
+        # Save the statistics of the population and the genomes evaluated in the generation
+        timer = PhaseTimer()
+        timer.phases['simulate'] = time.perf_counter() - start_time[0]
+        with timer.phase('save_statistics'):
+            save_species_statistics(neat.population.species.species, generation)
+        with timer.phase('save_genomes'):
+            if SAVE_BEST_GENOME_ONLY:
+                os.makedirs(SAVING_FOLDER, exist_ok=True)
+                best = int(np.argmax(fitnesses))
+                name_save = SAVING_FOLDER + 'gen{}-fit{:.3f}-'.format(generation, genomes[best][1].fitness) + map_name[8:]
+                neat.save_genome(name_save, genomes[best][1])
+            else:
+                for genome_id, genome in genomes:
+                    archive.add(generation, genome_id, genome, genome.fitness, map_name)
+        
+        agents = [{'id': genome_id, 'steps': agent_steps, 'steps_per_sec': agent_steps / wall_time if wall_time > 0 else None,
+                   'termination': TERMINATION_REASONS[reason]}
+                  for (genome_id, _), agent_steps, wall_time, reason in zip(genomes, steps, wall_times, reasons)]
+        write_generation_timings(SAVING_FOLDER + 'timings.jsonl', generation, map_name, timer.phases, agents, cache_counts)
+        manifest.add_generation(generation, map_name, [fitness * 10.0 for fitness in fitnesses], [genome_id for genome_id, _ in genomes],
+                                None, sum(timer.phases.values()), archive.take_written() if archive is not None else ())
+        start_time[0] = time.perf_counter()
+    
+    # Keep two genomes per worker under evaluation, so that a worker never waits for the next one
+    return neat.run_steady_state(evaluate, set_result, generations, 2 * evaluator.processes, end_generation)
 
+def save_best_trajectories(genomes, trajectories, fitnesses, reasons, generation):
+    """
+    Save the trajectories of the best genomes of a generation recorded on the training map
+    (see simulate_maps) in the trajectories folder of the run
+    
+    Args:
+        genomes: list of tuples (genome_id, genome_instance)
+        trajectories: dictionary {genome index: array of its recorded trajectory}
+        fitnesses: list of the training fitness of each genome
+        reasons: list of the termination reason of each genome
+        generation: current generation
+    """
+    best = sorted(trajectories, key=lambda i: fitnesses[i], reverse=True)[:RECORD_TRAJECTORIES]
+    if not best:
+        return
+    agents = [{'id': genomes[i][0], 'fitness': fitnesses[i] * 10.0, 'termination': TERMINATION_REASONS[reasons[i]]} for i in best]
+    save_trajectories(SAVING_FOLDER + 'trajectories/gen{}'.format(generation), [trajectories[i] for i in best], agents,
+                      map=map_name, generation=generation, dt=DT)
 
         
+def run_population_viewer(stream, rate=30, grid_size=250):
+    """
+    Show the agents of each generation live in a window, as they are simulated by the workers
+    (run in its own process, until the window is closed)
+    
+    Args:
+        stream: descriptor of the StateStream of the training
+        rate: frames per second of the window
+        grid_size: number of cells of the grids (per axis)
+    """
+    import pygame
+    from game.population_viewer import PopulationViewer
+    arrays = StateStream.attach(stream)
+    viewer = PopulationViewer()
+    clock = pygame.time.Clock()
+    grids = {}
+    while viewer.running:
+        viewer.events()
+        generation, viewed_map, states, species = StateStream.read(arrays)
+        if viewed_map:
+            # Load the maps from the maps folder, as the remote workers do
+            if viewed_map not in grids:
+                grids[viewed_map] = MapRegistry.load('maps/' + viewed_map + '/', grid_size=grid_size).grid
+            viewer.draw(grids[viewed_map], generation, viewed_map, states, species)
+        clock.tick(rate)
+    pygame.quit()
+
 def save_species_statistics(species, generation):
     """
-    Save the species statistics in a csv file
+    Append the species statistics of a generation to the columnar store of the run
+    (see brain.species_statistics)
     
     Args:
         species: (dict) Species dictionary
         generation: (int) Current generation
     """
-    mode = 'w' if generation == 0 else 'a'
+    rows = [(specie_id, agent_id, agent.fitness, getattr(agent, 'termination', MAX_TIME))
+            for specie_id, specie in iteritems(species) for agent_id, agent in iteritems(specie.members)]
+    specie_ids, agent_ids, fitnesses, terminations = zip(*rows) if rows else ([], [], [], [])
     
-    with open(SAVING_FOLDER +'species.csv', mode, newline='') as file:
-        writer = csv.writer(file)
-        for specie_id, specie in iteritems(species):
-            for agent_id, agent in iteritems(specie.members):
-                writer.writerow([generation, specie_id, agent_id, agent.fitness])
+    SpeciesStatistics(SAVING_FOLDER + 'species').append({
+        'generation': np.full(len(rows), generation),
+        'species': specie_ids,
+        'agent': agent_ids,
+        'fitness': fitnesses,
+        'termination': terminations,
+    }, reset=generation == 0)
         
         
 def visualize(genome, graph_viz_path=None):
@@ -219,13 +706,15 @@ def visualize(genome, graph_viz_path=None):
         warnings.warn('Graphviz library not found')
 
 
-def load_map(MAP_FOLDER, index=0):
+def load_map(MAP_FOLDER, index=0, grid_size=250, wall_segments=False):
     
     """
-    Load the map grid and coordinates of the spawn point
+    Load the map grid, with the track of the map attached, and coordinates of the spawn point
     
     args:
         MAP_FOLDER: (str) Path to the map folder, None for mixed maps during training
+        grid_size: (int) Number of cells of the grid (per axis)
+        wall_segments: (bool) Extract the segments of the walls, so that the rays and collisions are exact
         
     return:
         grid: (array) Grid of the map
@@ -236,16 +725,8 @@ def load_map(MAP_FOLDER, index=0):
         # pick a randdom map folder
         list_maps = os.listdir('maps/')
         MAP_FOLDER = 'maps/' + np.random.choice(list_maps) + '/'
-        
-    with open(MAP_FOLDER + 'spawn.csv', 'r') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            PLAYER_POS = (float(row[0]), float(row[1]))
-    
-    grid = Grid(250, MAP_FOLDER + 'circuit.png')
-    
-    map_name = MAP_FOLDER.split('/')[-2]
     
+    grid, PLAYER_POS, map_name = MapRegistry.load(MAP_FOLDER, grid_size, wall_segments)
     return grid, PLAYER_POS, map_name
         
 
@@ -256,13 +737,26 @@ if __name__ == '__main__':
     LOAD_CHECKPOINT = False
     BENCHMARK_PAILLON = True
     SAVE_BEST_GENOME_ONLY = False
+    BATCH_SIMULATION = True # Simulate the population in vectorized batches instead of one game per genome
+    COMPILED_NETWORKS = True # Evaluate the networks compiled into NumPy arrays instead of neat-python networks
+    EARLY_TERMINATION = False # Stop the agents which do not drive anymore (see TERMINATION), which changes their fitness
+    WALL_SEGMENTS = False   # Intersect the rays and the cars with the segments of the wall contours (exact distances, but slower) instead of the cells
+    GRID_SIZE = 250         # Number of cells of the grids (per axis), the walls of finer grids following the circuit images more closely
+    PROFILE_WORKERS = False # Run cProfile in the workers and save the merged statistics of each generation
+    ASYNC_EVOLUTION = False # Evolve without generation barrier (rtNEAT steady state), a genome being evaluated as soon as a worker is free
+    RECORD_TRAJECTORIES = 0 # Number of the best genomes of each generation whose trajectories are recorded, to replay them
+    FITNESS_CACHE_SIZE = 100000 # Number of simulation results cached to skip the networks already simulated, 0 to always simulate
+    POPULATION_VIEWER = False # Show all the agents of each generation live in a window while training, colored by species
+    VIEWER_RATE = 30        # Frames per second of the population viewer
     
     # File paths
     SAVING_FOLDER = 'checkpoints/test/'
     MAP_FOLDER = None #'maps/circuit_paillon/' # Path to the map folder, None for mixed maps during training
     PROB_CHANGE_MAP = 0.0
     CONFIG_FILE = 'brain/config.txt'
-    CHECKPOINT_FILE = 'checkpoints/gen39-fit1.2614408462209652'
+    CHECKPOINT_FILE = 'checkpoints/gen39-fit1.2614408462209652' # Genome file, or genome archive to load its best genome
+    FITNESS_CACHE_FILE = 'checkpoints/fitness_cache.pickle' # File keeping the fitness cache between the runs, None to not save it
+    REPLAY_FILE = None # Recorded trajectories to replay with graphics (e.g. 'checkpoints/test/trajectories/gen10'), None to run the game
     GRAPH_VIZ_PATH = os.path.curdir + '/graphviz/bin/' # Path to the graphviz executable
     
     # Simulation parameters
@@ -270,9 +764,31 @@ if __name__ == '__main__':
     PLAYER_MAX_TIME = 100.0 # Maximum lifetime of a player simulation
     PLAYER_RAY_COUNT = 5    # Number of rays to cast from the player
     DT = 0.01               # Time step for the simulation
+    CONTROL_PERIOD = 1      # Number of time steps between two network decisions (the action is held in between)
+    PHYSICS_SUBSTEPS = 1    # Number of physics steps and collision checks in a time step
+    SIMULATION_SPEED = 1.0  # Speed of the game with graphics relative to real time (1.0, 10.0 or None for as fast as possible, V to change)
+    DISPLAY_RATE = 60       # Maximum frames per second of the game with graphics
+    
+    # Early termination of the agents which do not drive anymore, with EARLY_TERMINATION (None: the agents
+    # are simulated until they crash or reach PLAYER_MAX_TIME, as in the runs without early termination)
+    TERMINATION = TerminationPolicy(
+        min_velocity=0.01,    # Stop an agent whose velocity stays under this value...
+        stall_time=2.0,       # ...for this duration (s)
+        progress_timeout=5.0, # Stop an agent which does not reach a new part of the track for this duration (s)
+        progress_cell=0.05)   # Distance along the track counting as a new progress
+    if not EARLY_TERMINATION:
+        TERMINATION = None
     
-    # Load the circuit
-    grid, PLAYER_POS, map_name = load_map(MAP_FOLDER)
+    # Distributed evaluation, by the workers started with worker.py on other machines
+    COORDINATOR_ADDRESS = None # Port on which the workers connect (served on localhost), or (host, port), None to evaluate with a local pool
+    COORDINATOR_AUTHKEY = None # Key authenticating the workers, None to read it from the NEAT_AUTHKEY environment variable (required)
+    
+    # Load the circuit, or all the circuits once for the training
+    if GAME_GRAPHICS:
+        grid, PLAYER_POS, map_name = load_map(MAP_FOLDER, grid_size=GRID_SIZE, wall_segments=WALL_SEGMENTS)
+    else:
+        maps = MapRegistry('maps/', grid_size=GRID_SIZE, wall_segments=WALL_SEGMENTS)
+        grid, PLAYER_POS, map_name = maps.select(MAP_FOLDER)
     # Create the save folder
     os.makedirs(SAVING_FOLDER, exist_ok=True)
 
@@ -280,80 +796,99 @@ if __name__ == '__main__':
         import pygame
         from game.game_graphics import GameGraphics
         
-        if LOAD_CHECKPOINT:
-            # Create and run the NEAT algorithm loading from a checkpoint
-            neat = NeatAlgorithm(CONFIG_FILE, CHECKPOINT_FILE)
+        if REPLAY_FILE is not None:
+            # Replay the recorded trajectories on their map, without running the networks nor the physics
+            trajectories = Trajectories(REPLAY_FILE)
+            grid, PLAYER_POS, map_name = load_map('maps/' + trajectories.index['map'] + '/', grid_size=GRID_SIZE, wall_segments=WALL_SEGMENTS)
+            game = GameGraphics(grid, PLAYER_POS)
+            game.replay(trajectories)
+            while game.running:
+                game.tick()
+                game.events()
+                game.replay_update()
+                game.draw()
+        else:
+            if LOAD_CHECKPOINT:
+                # Create and run the NEAT algorithm loading from a checkpoint
+                neat = NeatAlgorithm(CONFIG_FILE, CHECKPOINT_FILE)
             
-            # Create the network from the genome
-            net = neat.create_network(neat.best)
+                # Create the network from the genome
+                net = neat.create_network(neat.best)
             
-            # Visualize the network
-            visualize(neat.best, GRAPH_VIZ_PATH)
+                # Visualize the network
+                visualize(neat.best, GRAPH_VIZ_PATH)
         
-        while True:
             # Create the game with graphics
             game = GameGraphics(grid, PLAYER_POS)
-            
-            # Run the game for the player
-            frame_time_store = [0.0] * 10
-            frame_time_avg = 1.0
-            last_frame_time = time.time()
-            while not game.game_over:
-                frame_time = time.time()
-                
-                # Update the game state
-                if not LOAD_CHECKPOINT:
-                    cur_time = time.time()
-                    dt = cur_time - last_frame_time
-                    last_frame_time = cur_time
+            speed = SIMULATION_SPEED
+            while game.running:
+                # Simulate the game in its own thread at DT, the window rendering its latest state
+                if LOAD_CHECKPOINT:
+                    controller = network_controller(net)
                 else:
-                    dt = DT
-                game.tick(dt)
-                
-                # Handle window events
-                game.events()
-                
-                if not LOAD_CHECKPOINT:
-                    # Get the inputs of the current game state
-                    acc, steer = game.key_inputs()
-                    
-                    # Update the game state
-                    game.update(acc, steer)
-                else:
-                    # Compute the iteration count based on the frame time, so that the game runs at DT
-                    it_count = max(int(DT / frame_time_avg), 1)
-                    
-                    # Run the game for the player
-                    for it in range(it_count):
-                        # Get the inputs of the current game state
-                        inputs = game.get_inputs(PLAYER_RAY_COUNT)
-                        
-                        # Get the outputs from the neat network
-                        outputs = net.activate(inputs)
-                        
-                        # Execute the action on the game
-                        acc, steer = map_outputs(outputs, game.dt, game.player)
-                
-                        # Update the game state
-                        game.update(acc, steer)
-                        
-                        # Check if the game is over
-                        if game.game_over:
-                            break
-                
-                # Display the game
-                game.draw()
+                    controller = lambda _: (*game.key_inputs(), None)
+                simulation = SimulationThread(Game(grid, PLAYER_POS, DT, PHYSICS_SUBSTEPS), controller, speed)
+                game.follow(simulation, keyboard=not LOAD_CHECKPOINT, display_rate=DISPLAY_RATE)
+                simulation.start()
                 
-                # Update the frame time
-                frame_time_store.pop(0)
-                frame_time_store.append(time.time() - frame_time)
-                frame_time_avg = sum(frame_time_store) / 10
+                # Render the game until it is over, then start a new one at the same speed
+                while game.running and not game.game_over:
+                    game.tick()
+                    game.events()
+                    game.snapshot_update()
+                    game.draw()
+                speed = simulation.speed
+                simulation.stop()
     
         # Quit the window
         pygame.quit()
     else:
+        # Start the workers evaluating the genomes, or wait for the remote workers to connect
+        if COORDINATOR_ADDRESS is None:
+            evaluator = Evaluator()
+        else:
+            evaluator = DistributedEvaluator(COORDINATOR_ADDRESS, COORDINATOR_AUTHKEY)
+        
+        # Results of the networks already simulated, in this run or the previous ones (with the same simulator code)
+        fitness_cache = FitnessCache(FITNESS_CACHE_SIZE, FITNESS_CACHE_FILE) if FITNESS_CACHE_SIZE > 0 else None
+        simulator_code = code_digest([map_outputs, map_outputs_batch, run_simulation, network_controller, run_batch_simulation])
+        
+        # Archive of all the genomes of the run
+        archive = None if SAVE_BEST_GENOME_ONLY else GenomeArchive(SAVING_FOLDER + 'genomes.archive', new=True)
+        
+        # Manifest of the run, starting with its configuration
+        manifest = RunManifest(SAVING_FOLDER + 'manifest.sqlite', new=True)
+        manifest.set_config({name: value for name, value in globals().items() if name.isupper() and name != 'COORDINATOR_AUTHKEY'})
+        
         # Create and run the NEAT algorithm
-        neat = NeatAlgorithm(CONFIG_FILE)
-        neat.run(eval_genomes, GENERATIONS)
+        population_stream = population_viewer = None
+        try:
+            neat = NeatAlgorithm(CONFIG_FILE)
+            
+            # Stream the states of the agents to the population viewer, shown in its own process
+            if POPULATION_VIEWER:
+                if COORDINATOR_ADDRESS is not None or not BATCH_SIMULATION or ASYNC_EVOLUTION:
+                    warnings.warn('The population viewer needs the local evaluator, the batch simulation and the generational evolution')
+                else:
+                    population_stream = StateStream(2 * neat.config.pop_size)
+                    population_viewer = multiprocessing.Process(target=run_population_viewer, args=(population_stream.descriptor, VIEWER_RATE, GRID_SIZE), daemon=True)
+                    population_viewer.start()
+            
+            if ASYNC_EVOLUTION:
+                evolve_async(GENERATIONS)
+            else:
+                neat.run(eval_genomes, GENERATIONS)
+        finally:
+            evaluator.close()
+            if population_viewer is not None:
+                population_viewer.terminate()
+                population_viewer.join()
+                population_stream.close()
+            if fitness_cache is not None:
+                fitness_cache.save()
+            if archive is not None:
+                archive.close()
+                manifest.add_entries(archive.take_written())
+            manifest.close()
     
     
\ No newline at end of file
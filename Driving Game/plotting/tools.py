@@ -2,6 +2,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import neat
 import os
+from brain.species_statistics import load_species_statistics, group_max
+from brain.manifest import RunManifest
 
 def hist_final_fitness_parameter(title):
 	"""
@@ -17,17 +19,24 @@ def hist_final_fitness_parameter(title):
 
 	fits_max = []
 	for i, subfolder in enumerate(subfolders):
-		# read all filenames in the directory 'checkpoints\folder'
+		# read the best fitness in the manifest of the run
+		if os.path.exists(main_folder + subfolder + '\\manifest.sqlite'):
+			with RunManifest(main_folder + subfolder + '\\manifest.sqlite') as manifest:
+				fits_max.append(manifest.best_fitness() or 0)
+			continue
+
+		# older runs without manifest: read all filenames in the directory 'checkpoints\folder'
 		filenames = os.listdir(main_folder + subfolder)
 
 		fit_max = 0
 		for filename in filenames:
-			# ignore the configuration file
-			if filename == 'config.txt':
+			# ignore the files which are not genomes (the file name is like "gen8-fit0.203-paillon")
+			parts = filename.split('-')
+			if len(parts) < 3 or not parts[1].startswith('fit'):
 				continue
 
-			# extract the fitness value (the file name is like "gen8-fit0.203-paillon")
-			fit = float(filename.split('-')[1][3:])
+			# extract the fitness value
+			fit = float(parts[1][3:])
 			# update the maximum fitness
 			fit_max = max(fit_max, fit)
 
@@ -77,41 +86,24 @@ def plot_fitness_diff_species_from_csv(title):
 	
 	main_folder = 'checkpoints\\' + title +'\\'
 
-	# load the csv file
-	data = np.loadtxt(main_folder + 'species.csv', delimiter=',')
-	gens = data[:, 0]
-	species = data[:, 1]
-	agents = data[:, 2]
-	fitness = data[:, 3]
-
-	for s in np.unique(species):
-		# get the indices of each species
-		inds1 = np.where(species == s)[0]
-		gs, max_fits = [], []
-
-		for g in np.unique(gens):
-			# get the indices of each generation
-			inds2 = np.where(gens == g)[0]
-			inds = np.intersect1d(inds1, inds2)
-			if len(inds) == 0:
-				continue
+	# load the species statistics
+	data = load_species_statistics(main_folder)
 
-			# store the generation number and the maximum fitness of the species
-			gs.append(g)
-			max_fits.append(np.max(fitness[inds]))
+	# maximum fitness of each (species, generation) pair, sorted by species then generation
+	(species, gens), max_fits_all = group_max([data['species'], data['generation']], data['fitness'])
+	bounds = np.flatnonzero(np.diff(species)) + 1
 
-		# sort the lists by generation number
-		inds = np.argsort(gs)
-		gs = np.array(gs)[inds]
-		max_fits = np.array(max_fits)[inds]
-  
-		# do a light running average to smooth the curves
-		try:
-			max_fits = np.convolve(max_fits, np.ones(3) / 3, mode='valid')
-			gs = gs[1:-1]
-			plt.plot(gs, max_fits, label='Species ' + str(int(s)), alpha=0.8, linewidth=5, color=my_color_func(int(s - 1)))
-		except:
+	for inds in np.split(np.arange(len(species)), bounds):
+		if len(inds) < 3:
 			continue
+		s = species[inds[0]]
+		gs = gens[inds]
+		max_fits = max_fits_all[inds]
+
+		# do a light running average to smooth the curves
+		max_fits = np.convolve(max_fits, np.ones(3) / 3, mode='valid')
+		gs = gs[1:-1]
+		plt.plot(gs, max_fits, label='Species ' + str(int(s)), alpha=0.8, linewidth=5, color=my_color_func(int(s - 1)))
 
 	plt.xlabel('Generation', fontsize=40)
 	plt.ylabel('Fitness', fontsize=40)
@@ -136,27 +128,15 @@ def plot_best_fitness_from_csv(title, color='k', linestyle='--', label=None):
 	
 	main_folder = 'checkpoints\\' + title +'\\'
 
-	# load the csv file
-	data = np.loadtxt(main_folder + 'species.csv', delimiter=',')
-	gens = data[:, 0]
-	species = data[:, 1]
-	agents = data[:, 2]
-	fitness = data[:, 3]
-
-
-	max_fit = []
-	for g in np.unique(gens):
-		# get the indices of each generation
-		inds = np.where(gens == g)[0]
-		if len(inds) == 0:
-			continue
+	# load the species statistics
+	data = load_species_statistics(main_folder)
 
-		# store the generation number and the maximum fitness of the species for each generation
-		max_fit.append(np.max(fitness[inds]))
+	# maximum fitness of each generation
+	(gens,), max_fit = group_max([data['generation']], data['fitness'])
 
 	# do a running average to smooth the curves
 	max_fit = np.convolve(max_fit, np.ones(11) / 11, mode='valid')
-	gs = np.unique(gens)[5:-5]
+	gs = gens[5:-5]
  
 	plt.plot(gs, max_fit, label=label, alpha=0.8, linewidth=5, color=color, linestyle=linestyle)
 	plt.yscale('log')
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import the packages of the project as main.py does, from its folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,71 @@
+import os
+import random
+
+import neat
+import numpy as np
+import pytest
+
+from brain.compiled_network import CompiledNetwork, PopulationNetwork, ACTIVATIONS
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'brain', 'config.txt')
+
+@pytest.fixture(scope='module')
+def config():
+    return neat.Config(neat.DefaultGenome, neat.DefaultReproduction, neat.DefaultSpeciesSet, neat.DefaultStagnation, CONFIG_FILE)
+
+def random_genomes(config, count, seed, mutations=20):
+    """
+    Genomes of the repo configuration mutated at random, with disabled connections and
+    nodes not connected to the outputs
+    """
+    random.seed(seed)
+    genome_config = config.genome_config
+    genomes = []
+    for key in range(count):
+        genome = config.genome_type(key)
+        genome.configure_new(genome_config)
+        for _ in range(random.randint(0, mutations)):
+            genome.mutate(genome_config)
+
+        # Disable some connections
+        for connection in genome.connections.values():
+            if random.random() < 0.2:
+                connection.enabled = False
+
+        # Add a hidden node only fed by an input, which does not reach the outputs
+        node_key = genome_config.get_new_node_key(genome.nodes)
+        genome.nodes[node_key] = genome.create_node(genome_config, node_key)
+        connection = genome.create_connection(genome_config, genome_config.input_keys[0], node_key)
+        genome.connections[connection.key] = connection
+        genomes.append(genome)
+    return genomes
+
+def test_same_outputs_as_neat(config):
+    rng = np.random.default_rng(0)
+    for genome in random_genomes(config, 200, seed=0):
+        reference = neat.nn.FeedForwardNetwork.create(genome, config)
+        compiled = CompiledNetwork.create(genome, config)
+        for inputs in rng.normal(size=(5, config.genome_config.num_inputs)) * 2:
+            np.testing.assert_allclose(compiled.activate(inputs), reference.activate(inputs.tolist()), rtol=1e-9, atol=1e-12)
+
+def test_activations(config):
+    # Every activation function of the compiled networks, on the hidden and output nodes
+    rng = np.random.default_rng(1)
+    names = sorted(ACTIVATIONS)
+    for index, genome in enumerate(random_genomes(config, 100, seed=1)):
+        for node in genome.nodes.values():
+            node.activation = names[(index + node.key) % len(names)]
+        reference = neat.nn.FeedForwardNetwork.create(genome, config)
+        compiled = CompiledNetwork.create(genome, config)
+        for inputs in rng.normal(size=(5, config.genome_config.num_inputs)):
+            with np.errstate(all='ignore'):
+                outputs = compiled.activate(inputs)
+            np.testing.assert_allclose(outputs, reference.activate(inputs.tolist()), rtol=1e-9, atol=1e-12)
+
+def test_population_network(config):
+    genomes = random_genomes(config, 50, seed=2)
+    networks = [CompiledNetwork.create(genome, config) for genome in genomes]
+    inputs = np.random.default_rng(2).normal(size=(len(genomes), config.genome_config.num_inputs))
+    outputs = PopulationNetwork(networks).activate(inputs)
+    for genome, row, output in zip(genomes, inputs, outputs):
+        np.testing.assert_allclose(output, neat.nn.FeedForwardNetwork.create(genome, config).activate(row.tolist()), rtol=1e-9, atol=1e-12)
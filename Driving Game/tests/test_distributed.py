@@ -0,0 +1,71 @@
+import os
+import multiprocessing
+
+import pytest
+
+import main
+from brain.distributed import DistributedEvaluator, run_worker, AUTHKEY_VARIABLE
+from game.maps import MapRegistry
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUTHKEY = b'test-key'
+WORKERS = 3
+
+# The thread of the manager server exits with SystemExit when the coordinator is closed
+pytestmark = pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+
+class ConstantNetwork:
+    """
+    Network always accelerating and steering slightly, the same in the coordinator and the workers
+    """
+    def activate(self, inputs):
+        return [1.0, 0.5, 0.0, 0.6]
+
+@pytest.fixture
+def coordinator(monkeypatch):
+    # The workers load the maps from the maps folder of the current directory
+    monkeypatch.chdir(PROJECT)
+    evaluator = DistributedEvaluator(('localhost', 0), AUTHKEY, processes=WORKERS)
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=run_worker, args=(evaluator.address, AUTHKEY, 'worker-{}'.format(i))) for i in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    yield evaluator
+    evaluator.close()
+    for worker in workers:
+        worker.join(timeout=10)
+        assert worker.exitcode == 0
+
+def test_local_workers(coordinator):
+    # Simulate on the workers the same agents as in this process
+    entry = MapRegistry.load('maps/circuit_en_8/')
+    grid = coordinator.publish('circuit_en_8', entry.grid)
+    params = (1.0, 5, 0.01, None, 1, 1)
+    tasks = [(grid, entry.player_pos, ConstantNetwork(), params) for _ in range(2 * WORKERS)]
+    results = coordinator.map(main.run_simulation, tasks)
+
+    expected = main.run_simulation((entry.grid, entry.player_pos, ConstantNetwork(), params))
+    assert [result[:3] for result in results] == [expected[:3]] * len(tasks)
+    assert set(coordinator.queue.last_seen) == {'worker-{}'.format(i) for i in range(WORKERS)}
+
+def test_wrong_authkey(coordinator):
+    # The worker runs in its own process, as the manager classes are shared in a process
+    worker = multiprocessing.get_context('fork').Process(target=run_worker, args=(coordinator.address, b'wrong-key', 'intruder'))
+    worker.start()
+    worker.join(timeout=10)
+    assert worker.exitcode != 0
+    assert 'intruder' not in coordinator.queue.last_seen
+
+def test_no_authkey(monkeypatch):
+    monkeypatch.delenv(AUTHKEY_VARIABLE, raising=False)
+    with pytest.raises(ValueError):
+        DistributedEvaluator(('localhost', 0))
+    with pytest.raises(ValueError):
+        run_worker(('localhost', 0))
+
+def test_default_localhost():
+    evaluator = DistributedEvaluator(0, AUTHKEY)
+    try:
+        assert evaluator.address[0] == '127.0.0.1'
+    finally:
+        evaluator.close()
@@ -0,0 +1,47 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from game.simulation import SimulationThread
+
+class EndingGame:
+    """
+    Game ending after a number of steps, with the attributes read by the snapshots
+    """
+    def __init__(self, steps, dt=0.01):
+        self.dt = dt
+        self.steps = steps
+        self.game_over = False
+        self.grid = SimpleNamespace(red_cells=[])
+        self.player = SimpleNamespace(pos=np.zeros(2), rot=0.0, vel=np.zeros(2), distance=0.0, time=0.0)
+
+    def update(self, acc, steer):
+        self.player.time += self.dt
+        self.steps -= 1
+        self.game_over = self.steps <= 0
+
+def slow_controller(game):
+    time.sleep(0.02)
+    return 1.0, 0.0, None
+
+def test_game_over_while_late():
+    # The controller is slower than x10 real time, so that the game ends while the
+    # simulation is behind its target time
+    game = EndingGame(steps=5)
+    simulation = SimulationThread(game, slow_controller, speed=10.0)
+    simulation.start()
+    simulation.join(timeout=5)
+    assert not simulation.is_alive()
+    assert simulation.error is None
+    assert simulation.steps == 5
+    assert simulation.snapshots.latest().game_over
+
+def test_stop_while_late():
+    game = EndingGame(steps=10 ** 6)
+    simulation = SimulationThread(game, slow_controller, speed=10.0)
+    simulation.start()
+    time.sleep(0.2)
+    simulation.stop()
+    assert simulation.error is None
+    assert not game.game_over
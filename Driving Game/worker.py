@@ -0,0 +1,44 @@
+"""
+Worker of a distributed evaluation: connects to the coordinator (main.py run with
+COORDINATOR_ADDRESS set), runs the simulations it is given and sends back the results.
+The worker loads the maps from its own maps folder, which must be the same as the one
+of the coordinator. It exits when the coordinator stops.
+
+Usage:
+    python worker.py HOST:PORT                  # one worker process
+    python worker.py HOST:PORT --processes 8    # one worker process per simulation slot of the machine
+
+The key authenticating the worker is the one of the coordinator, given with --authkey or
+in the NEAT_AUTHKEY environment variable (there is no default key).
+"""
+import os
+import argparse
+import warnings
+from multiprocessing import Process
+
+# The simulator uses paths relative to its folder
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# The tasks run the simulation functions of the main script
+import main
+from brain.distributed import run_worker, read_authkey, AUTHKEY_VARIABLE
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Worker of a distributed evaluation of the genomes')
+    parser.add_argument('address', help='address of the coordinator, as HOST:PORT')
+    parser.add_argument('--authkey', help='key authenticating the worker (default: the {} environment variable)'.format(AUTHKEY_VARIABLE))
+    parser.add_argument('--processes', type=int, default=1, help='number of worker processes (default: %(default)s)')
+    args = parser.parse_args()
+    try:
+        authkey = read_authkey(args.authkey)
+    except ValueError as error:
+        parser.error(str(error))
+
+    warnings.simplefilter('ignore')
+    host, port = args.address.rsplit(':', 1)
+    address = (host, int(port))
+    workers = [Process(target=run_worker, args=(address, authkey)) for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()